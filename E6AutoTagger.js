@@ -39,6 +39,7 @@
         sortingMode: 'flat',
         requestTimeout: 10000,
         maxRetries: 2,
+        fillAutocompleteFromE621: false,
     };
 
     const CSS = {
@@ -170,6 +171,8 @@
         7: '#fff'
     };
 
+    const AUTOCOMPLETE_LIMIT = 10;
+
     const state = {
         config: null,
         connectionCheckInterval: null,
@@ -262,6 +265,7 @@
 
     const getHealthEndpoint = () => `${getApiBase()}/health`;
     const getPredictEndpoint = () => `${getApiBase()}/predict`;
+    const getAutocompleteEndpoint = term => `${getApiBase()}/autocomplete?q=${encodeURIComponent(term)}&limit=${AUTOCOMPLETE_LIMIT}`;
 
     const saveConfig = (newConfig) => {
         DEBUG.log('Config', 'Saving new configuration', newConfig);
@@ -622,6 +626,16 @@
                document.querySelector('#preview img');
     };
 
+    const blobUrlToDataUrl = async (url) => {
+        const blob = await (await fetch(url)).blob();
+        return await new Promise((resolve, reject) => {
+            const reader = new FileReader();
+            reader.onload = () => resolve(reader.result);
+            reader.onerror = () => reject(reader.error);
+            reader.readAsDataURL(blob);
+        });
+    };
+
     const imageElementToDataUrl = async (img) => {
         if (!img) {
             throw new Error("Could not find the image preview. Please try again.");
@@ -724,13 +738,18 @@
         try {
             const isUploadPage = window.location.href.includes('/uploads/new');
             const sourceUrl = getUploadSourceUrl();
-            const previewUrl = previewImage.src?.trim() || '';
+            // video posts preview in a <video>, whose file may be given by a <source>
+            const previewUrl = (previewImage.currentSrc || previewImage.src)?.trim() || '';
             const candidateUrl = isUploadPage && sourceUrl ? sourceUrl : previewUrl;
 
             let aiResponse;
             if (/^https?:\/\//i.test(candidateUrl)) {
                 DEBUG.log('Process', 'Sending image URL to AI for processing', { imageUrl: candidateUrl });
                 aiResponse = await sendToAI({ imageUrl: candidateUrl });
+            } else if (previewImage.tagName === 'VIDEO' && previewUrl) {
+                // the backend samples frames from the whole video, so send the file rather than one frame
+                DEBUG.log('Process', 'Converting preview video to base64 for processing');
+                aiResponse = await sendToAI({ imageDataUrl: await blobUrlToDataUrl(previewUrl) });
             } else {
                 DEBUG.log('Process', 'Converting preview image to base64 for processing');
                 const imageDataUrl = await imageElementToDataUrl(previewImage);
@@ -805,8 +824,10 @@
         let currentSuggestions = [];
         let activeIndex = -1;
         let currentTagSegment = { term: '', start: -1, end: -1 };
+        let suggestionRequest = 0;
 
         const fetchSuggestions = createDebounce((term) => {
+            const request = ++suggestionRequest;
             term = term.trim();
             if (!term || term.length < 3) {
                 suggestionsContainer.style.display = 'none';
@@ -818,65 +839,118 @@
             suggestionsContainer.innerHTML = '';
             suggestionsContainer.style.display = 'none';
 
-            GM_xmlhttpRequest({
-                method: "GET",
-                url: `https://e621.net/tags/autocomplete.json?search[name_matches]=${encodeURIComponent(term)}&expiry=7`,
-                headers: {
-                    "Content-Type": "application/json",
-                    "Accept": "application/json"
-                },
-                onload: (response) => {
-                    try {
-                        const responseData = JSON.parse(response.responseText);
-                        const tags = Array.isArray(responseData) ? responseData : [];
+            const showSuggestions = (tags) => {
+                if (tags.length === 0) {
+                    suggestionsContainer.style.display = 'none';
+                    currentSuggestions = [];
+                    activeIndex = -1;
+                    return;
+                }
 
-                        if (tags.length === 0) {
-                            suggestionsContainer.style.display = 'none';
-                            currentSuggestions = [];
-                            activeIndex = -1;
+                const fragment = document.createDocumentFragment();
+                currentSuggestions = tags;
+                activeIndex = -1;
+
+                tags.forEach((tag, index) => {
+                    const suggestion = document.createElement('div');
+                    suggestion.className = 'tag-suggestion';
+                    suggestion.dataset.index = index;
+                    suggestion.textContent = tag.name.replace(/_/g, ' ');
+                    suggestion.style.color = TAG_CATEGORIES[tag.category] || '#fff';
+
+                    // the backend only knows post counts if its tag metadata has them
+                    if (typeof tag.post_count === 'number') {
+                        const countLabel = document.createElement('span');
+                        countLabel.className = 'tag-count';
+                        countLabel.textContent = tag.post_count.toLocaleString();
+                        suggestion.appendChild(countLabel);
+                    }
+
+                    fragment.appendChild(suggestion);
+                });
+
+                suggestionsContainer.innerHTML = '';
+                suggestionsContainer.appendChild(fragment);
+
+                suggestionsContainer.addEventListener('click', handleSuggestionClick);
+                suggestionsContainer.addEventListener('mouseover', handleSuggestionMouseover);
+
+                const rect = textarea.getBoundingClientRect();
+                const parentRect = containerDiv.getBoundingClientRect();
+                suggestionsContainer.style.position = 'absolute';
+                suggestionsContainer.style.top = `${rect.bottom - parentRect.top}px`;
+                suggestionsContainer.style.left = `${rect.left - parentRect.left}px`;
+                suggestionsContainer.style.width = `${rect.width}px`;
+                suggestionsContainer.style.display = 'block';
+            };
+
+            const requestSuggestions = (url, onSuccess, onFailure) => {
+                GM_xmlhttpRequest({
+                    method: "GET",
+                    url,
+                    headers: {
+                        "Content-Type": "application/json",
+                        "Accept": "application/json"
+                    },
+                    onload: (response) => {
+                        if (response.status !== 200) {
+                            onFailure();
                             return;
                         }
 
-                        const fragment = document.createDocumentFragment();
-                        currentSuggestions = tags;
-                        activeIndex = -1;
+                        let responseData;
+                        try {
+                            responseData = JSON.parse(response.responseText);
+                        } catch (error) {
+                            console.error("Error parsing tag suggestions:", error);
+                            onFailure();
+                            return;
+                        }
 
-                        tags.forEach((tag, index) => {
-                            const suggestion = document.createElement('div');
-                            suggestion.className = 'tag-suggestion';
-                            suggestion.dataset.index = index;
-                            suggestion.textContent = tag.name.replace(/_/g, ' ');
-                            suggestion.style.color = TAG_CATEGORIES[tag.category] || '#fff';
+                        onSuccess(Array.isArray(responseData) ? responseData : []);
+                    },
+                    onerror: onFailure
+                });
+            };
 
-                            const countLabel = document.createElement('span');
-                            countLabel.className = 'tag-count';
-                            countLabel.textContent = tag.post_count.toLocaleString();
-                            suggestion.appendChild(countLabel);
+            // backend suggestions first, then e621's, once per tag name
+            const mergeSuggestions = (first, second) => {
+                const names = new Set(first.map(tag => tag.name));
+                return first
+                    .concat(second.filter(tag => !names.has(tag.name)))
+                    .slice(0, AUTOCOMPLETE_LIMIT);
+            };
 
-                            fragment.appendChild(suggestion);
-                        });
+            const hideSuggestions = () => {
+                suggestionsContainer.style.display = 'none';
+            };
 
-                        suggestionsContainer.innerHTML = '';
-                        suggestionsContainer.appendChild(fragment);
-
-                        suggestionsContainer.addEventListener('click', handleSuggestionClick);
-                        suggestionsContainer.addEventListener('mouseover', handleSuggestionMouseover);
-
-                        const rect = textarea.getBoundingClientRect();
-                        const parentRect = containerDiv.getBoundingClientRect();
-                        suggestionsContainer.style.position = 'absolute';
-                        suggestionsContainer.style.top = `${rect.bottom - parentRect.top}px`;
-                        suggestionsContainer.style.left = `${rect.left - parentRect.left}px`;
-                        suggestionsContainer.style.width = `${rect.width}px`;
-                        suggestionsContainer.style.display = 'block';
-                    } catch (error) {
-                        console.error("Error parsing tag suggestions:", error);
-                        suggestionsContainer.style.display = 'none';
-                    }
-                },
-                onerror: () => {
-                    suggestionsContainer.style.display = 'none';
+            const e621Endpoint = `https://e621.net/tags/autocomplete.json?search[name_matches]=${encodeURIComponent(term)}&expiry=7`;
+
+            // the local backend answers from the model's own tags without a round trip to e621,
+            // which is only asked when the backend is unavailable, or to fill in short lists if enabled
+            requestSuggestions(getAutocompleteEndpoint(term), localTags => {
+                showSuggestions(localTags);
+
+                const config = state.config || loadConfig();
+                if (!config.fillAutocompleteFromE621 || localTags.length >= AUTOCOMPLETE_LIMIT) {
+                    return;
                 }
+
+                DEBUG.log('Autocomplete', `Backend returned ${localTags.length} tags, adding e621 results`);
+                requestSuggestions(
+                    e621Endpoint,
+                    e621Tags => {
+                        // the user may have typed on while e621 answered
+                        if (request === suggestionRequest) {
+                            showSuggestions(mergeSuggestions(localTags, e621Tags));
+                        }
+                    },
+                    () => {}
+                );
+            }, () => {
+                DEBUG.log('Autocomplete', 'Backend autocomplete unavailable, asking e621');
+                requestSuggestions(e621Endpoint, showSuggestions, hideSuggestions);
             });
         }, 300);
 
@@ -1331,6 +1405,9 @@
         addConfigCheckbox(form, 'enableAutoTagOnEdit', 'Enable Constant Tags on Edit', config.enableAutoTagOnEdit,
                           'Apply constant tags when editing existing posts');
 
+        addConfigCheckbox(form, 'fillAutocompleteFromE621', 'Fill Autocomplete from e621', config.fillAutocompleteFromE621,
+                          'Also ask e621 when the backend suggests fewer than ten tags, adding its results once they arrive');
+
         const sortingContainer = document.createElement('div');
         sortingContainer.className = 'config-row';
         form.appendChild(sortingContainer);
@@ -1507,6 +1584,7 @@
                     preserveExistingTags: form.querySelector('[name="preserveExistingTags"]').checked,
                     rescaleTagBox: form.querySelector('[name="rescaleTagBox"]').checked,
                     enableAutoTagOnEdit: form.querySelector('[name="enableAutoTagOnEdit"]').checked,
+                    fillAutocompleteFromE621: form.querySelector('[name="fillAutocompleteFromE621"]').checked,
                     sortingMode: form.querySelector('[name="sortingMode"]').value,
                     requestTimeout: parseInt(form.querySelector('[name="requestTimeout"]').value) || DEFAULT_CONFIG.requestTimeout,
                     maxRetries: parseInt(form.querySelector('[name="maxRetries"]').value) || DEFAULT_CONFIG.maxRetries
@@ -4,32 +4,54 @@ Original file remains licensed under the Apache License, Version 2.0.
 See /LICENSE.
 """
 
+import atexit
 import base64
 import csv
 import os
+from collections import OrderedDict
+from functools import lru_cache
 from io import BytesIO, StringIO
 from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, NamedTuple
+from uuid import uuid4
+
+# startup phases and their duration in seconds, see startup_phase
+startup_seconds: dict[str, float] = {}
+_phase_start = perf_counter()
 
 import numpy as np
 
 import torch
 from torch import Tensor
-from torch.nn import Parameter
 from torch.nn.functional import sigmoid
 
-import gradio as gr
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 
-from PIL import Image, ImageDraw, ImageFont
-
-import requests
-
-from model import load_model, process_image, patchify_image
-from image import unpatchify
+from PIL import Image
+
+from cache import SpillCache
+from calibrate import ValidationData, calibrate_data, get_metric, load_validation_data, pr_filter
+from executor import ModelExecutor
+from inference import TagClassifier, batched
+from jobs import Job, JobRegistry
+from tagindex import TagEntry, load_tag_index
+from loader import Loader
+from serving import ModelWorkers
+from metrics import device_memory, device_utilization, metrics, process_memory
+from model import (
+    load_model, process_image, process_frames, process_video, patchify_image, patchify_frames, prepare_batch,
+    reduce_frames, forward_head_classes,
+)
+from image import get_srgb_patch, unpatchify
+from video import VIDEO_EXTENSIONS, VIDEO_SUPPORTED, is_video_data
 
 PATCH_SIZE = 16
 MAX_SEQ_LEN = 1024
+CAM_BATCH_SIZE = 32
+CAM_CACHE_SIZE = 16
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 if hasattr(torch.backends, "fp32_precision"):
@@ -38,8 +60,66 @@ else:
     torch.backends.cuda.matmul.allow_tf32 = True
     torch.backends.cudnn.allow_tf32 = True
 
-model_lock = Lock()
-MODEL_PATH = "models/jtp-3-hydra.safetensors"
+# concurrent model calls; model calls never modify module state, so they can overlap
+MAX_STREAMS = int(os.environ.get("JTP_MAX_STREAMS", "2"))
+
+# API worker processes sharing the CPU model's weights; 0 serves the API in this process
+API_WORKERS = int(os.environ.get("JTP_API_WORKERS", "0"))
+
+# seconds an API request waits for a worker process before failing with 504
+API_WORKER_TIMEOUT = float(os.environ.get("JTP_API_WORKER_TIMEOUT", "60"))
+
+# frames sampled from animated GIF, WebP and PNG images, see inference.py --frames;
+# tags are combined by their maximum over the frames, so anything in any frame is tagged
+ANIMATION_FRAMES = max(1, int(os.environ.get("JTP_ANIMATION_FRAMES", "4")))
+MAX_FRAMES = 32
+
+# keyframes sampled from WebM, MP4, MKV and MOV videos, combined the same way, and the
+# seconds spent decoding each video before classifying the keyframes decoded so far
+VIDEO_FRAMES = max(1, int(os.environ.get("JTP_VIDEO_FRAMES", "8")))
+VIDEO_TIME_BUDGET = float(os.environ.get("JTP_VIDEO_BUDGET", "10"))
+
+# batch tab jobs, see inference.py --batch and --workers
+BATCH_SIZE = int(os.environ.get("JTP_BATCH_SIZE", "8"))
+BATCH_WORKERS = int(os.environ.get("JTP_BATCH_WORKERS", "-1"))
+
+# memory kept for browsing batch results; older entries spill to a temporary directory
+BATCH_CACHE_BYTES = int(os.environ.get("JTP_BATCH_CACHE_MB", "1024")) * 1024 * 1024
+
+# disk kept for spilled batch results; the oldest are deleted beyond it, and can no longer be browsed
+BATCH_DISK_BYTES = int(os.environ.get("JTP_BATCH_DISK_MB", "8192")) * 1024 * 1024
+
+# per-stage latency and cache statistics at /api/e6/metrics
+metrics.enabled = os.environ.get("JTP_METRICS", "1") != "0"
+
+VALIDATION_DATA_PATH = "data/jtp-3-hydra-val.csv"
+TAG_METADATA_PATH = "data/jtp-3-hydra-tags.csv"
+MAX_AUTOCOMPLETE = 50
+CALIBRATION_METRICS = ["cti", "f0.5", "f1", "f2", "j", "p4"]
+CALIBRATION_EPSILON = -0.0001 # see calibrate.py --epsilon
+
+INFERENCE_MODEL_PATH = "models/jtp-3-hydra-inference.safetensors"
+MODEL_PATH = (
+    INFERENCE_MODEL_PATH
+    if os.path.exists(INFERENCE_MODEL_PATH)
+    else "models/jtp-3-hydra.safetensors"
+)
+
+# serve only the /api/e6 endpoints, without importing Gradio or building the web UI
+HEADLESS = os.environ.get("JTP_HEADLESS", "0") != "0"
+
+if not HEADLESS:
+    import gradio as gr
+
+def startup_phase(phase: str) -> None:
+    """Record the time since the previous phase ended as the duration of `phase`."""
+
+    global _phase_start
+    now = perf_counter()
+    startup_seconds[phase] = now - _phase_start
+    _phase_start = now
+
+startup_phase("imports")
 
 def load_model_or_exit():
     if not os.path.exists(MODEL_PATH):
@@ -69,6 +149,19 @@ def load_model_or_exit():
 
 model, tag_list = load_model_or_exit()
 model.requires_grad_(False)
+startup_phase("model")
+
+executor = ModelExecutor(device, MAX_STREAMS)
+
+api_workers: ModelWorkers | None = None
+if API_WORKERS > 0:
+    if device == "cpu":
+        api_workers = ModelWorkers(model, API_WORKERS, patch_size=PATCH_SIZE, max_seqlen=MAX_SEQ_LEN)
+        atexit.register(api_workers.shutdown)
+    else:
+        print("JTP_API_WORKERS is ignored on CUDA; concurrent requests share the device through JTP_MAX_STREAMS.")
+
+    startup_phase("api_workers")
 
 def rewrite_tag(tag: str) -> str:
     return tag.replace("_", " ").replace("vulva", "pussy")
@@ -79,19 +172,32 @@ tags = {
 }
 tag_list = list(tags.keys())
 
-FONT = ImageFont.load_default(24)
+@lru_cache(maxsize=1)
+def cam_font() -> Any:
+    from PIL import ImageFont
+
+    return ImageFont.load_default(24)
+
+def top_predictions(probits: Tensor, k: int = 250) -> tuple[dict[str, float], list[int]]:
+    values, indices = probits.topk(k)
+    predictions = {
+        tag_list[idx.item()]: val.item()
+        for idx, val in sorted(
+            zip(indices, values),
+            key=lambda item: item[1].item(),
+            reverse=True
+        )
+    }
+
+    return predictions, indices.tolist()
 
 @torch.no_grad()
 def run_classifier(image: Image.Image, cam_depth: int):
     patches, patch_coords, patch_valid = patchify_image(image, PATCH_SIZE, MAX_SEQ_LEN)
-    patches = patches.unsqueeze(0).to(device=device, non_blocking=True)
-    patch_coords = patch_coords.unsqueeze(0).to(device=device, non_blocking=True)
-    patch_valid = patch_valid.unsqueeze(0).to(device=device, non_blocking=True)
 
-    patches = patches.to(dtype=torch.bfloat16).div_(127.5).sub_(1.0)
-    patch_coords = patch_coords.to(dtype=torch.int32)
+    with executor.stream(), metrics.stage("forward"):
+        patches, patch_coords, patch_valid = prepare_batch([patches], [patch_coords], [patch_valid], device)
 
-    with model_lock:
         features = model.forward_intermediates(
             patches,
             patch_coord=patch_coords,
@@ -104,70 +210,143 @@ def run_classifier(image: Image.Image, cam_depth: int):
         logits = model.forward_head(features["image_features"], patch_valid=patch_valid)
         del features["image_features"]
 
+        probits = sigmoid(logits[0].to(dtype=torch.float32))
+        probits.mul_(2.0).sub_(1.0) # scale to -1 to 1
+        probits = probits.cpu()
+
     features["patch_coords"] = patch_coords
     features["patch_valid"] = patch_valid
     del patches, patch_coords, patch_valid
 
-    probits = sigmoid(logits[0].to(dtype=torch.float32))
-    probits.mul_(2.0).sub_(1.0) # scale to -1 to 1
+    predictions, top_tags = top_predictions(probits)
 
-    values, indices = probits.cpu().topk(250)
-    predictions = {
-        tag_list[idx.item()]: val.item()
-        for idx, val in sorted(
-            zip(indices, values),
-            key=lambda item: item[1].item(),
-            reverse=True
-        )
-    }
+    features["key"] = uuid4().hex
+    features["top_tags"] = top_tags
 
     return features, predictions
 
 @torch.no_grad()
-def run_cam(
-    display_image: Image.Image,
-    image: Image.Image, features: dict[str, Tensor],
-    tag_idx: int, cam_depth: int
-):
-    intermediates = features["image_intermediates"]
-    if len(intermediates) < cam_depth:
-        features, _ = run_classifier(image, cam_depth)
-        intermediates = features["image_intermediates"]
-    elif len(intermediates) > cam_depth:
-        intermediates = intermediates[-cam_depth:]
+def run_frames(frames: list[Image.Image]) -> Tensor:
+    """Classify processed animation frames in one batch, returning their combined probabilities scaled to -1 to 1."""
+    patches, patch_coords, patch_valid = patchify_frames(frames, PATCH_SIZE, MAX_SEQ_LEN)
 
-    patch_coords = features["patch_coords"]
-    patch_valid = features["patch_valid"]
+    with executor.stream(), metrics.stage("forward"):
+        p_d, pc_d, pv_d = prepare_batch(list(patches), list(patch_coords), list(patch_valid), device)
 
-    with model_lock:
-        saved_q = model.attn_pool.q
-        saved_p = model.attn_pool.out_proj.weight
+        probits = model(p_d, pc_d, pv_d).float().sigmoid()
+        probits = reduce_frames(probits, [len(frames)])[0]
+        probits.mul_(2.0).sub_(1.0) # scale to -1 to 1
+        probits = probits.cpu()
 
-        try:
-            model.attn_pool.q = Parameter(saved_q[:, [tag_idx], :], requires_grad=False)
-            model.attn_pool.out_proj.weight = Parameter(saved_p[[tag_idx], :, :], requires_grad=False)
-
-            with torch.enable_grad():
-                for intermediate in intermediates:
-                    intermediate.requires_grad_(True).retain_grad()
-                    model.forward_head(intermediate, patch_valid=patch_valid)[0, 0].backward()
-        finally:
-            model.attn_pool.q = saved_q
-            model.attn_pool.out_proj.weight = saved_p
-
-    cam_1d: Tensor | None = None
-    for intermediate in intermediates:
-        patch_grad = (intermediate.grad.float() * intermediate.sign()).sum(dim=(0, 2))
-        intermediate.grad = None
-
-        if cam_1d is None:
-            cam_1d = patch_grad
-        else:
-            cam_1d.add_(patch_grad)
+    return probits
+
+class CamCache:
+    """LRU cache of per-tag CAMs, keyed by image features and CAM depth."""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, int], dict[int, Tensor]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str, cam_depth: int, tag_idx: int) -> Tensor | None:
+        with self._lock:
+            cams = self._entries.get((key, cam_depth))
+            cam = cams.get(tag_idx) if cams is not None else None
+
+            if cams is not None:
+                self._entries.move_to_end((key, cam_depth))
+
+        metrics.count("cache_hits" if cam is not None else "cache_misses", cache="cam")
+        return cam
+
+    def cached(self, key: str, cam_depth: int) -> set[int]:
+        with self._lock:
+            return set(self._entries.get((key, cam_depth), ()))
+
+    def put(self, key: str, cam_depth: int, cams: dict[int, Tensor]) -> None:
+        with self._lock:
+            self._entries.setdefault((key, cam_depth), {}).update(cams)
+            self._entries.move_to_end((key, cam_depth))
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+cam_cache = CamCache(CAM_CACHE_SIZE)
+
+def _batched_grad(output: Tensor, input: Tensor) -> Tensor:
+    grad_outputs = torch.eye(output.size(-1), device=output.device, dtype=output.dtype)
+
+    try:
+        grad, = torch.autograd.grad(
+            output, input,
+            grad_outputs=grad_outputs.unsqueeze(1).expand(-1, *output.shape),
+            retain_graph=True, is_grads_batched=True
+        )
+        return grad
+    except RuntimeError: # no batching rule for an op on this device
+        return torch.stack([
+            torch.autograd.grad(output[..., idx].sum(), input, retain_graph=True)[0]
+            for idx in range(output.size(-1))
+        ])
+
+def compute_cams(intermediates: list[Tensor], patch_valid: Tensor, tag_idxs: list[int]) -> Tensor:
+    """Compute CAMs for several tags with one forward and one batched backward pass per intermediate.
+
+    Returns:
+        Tensor of shape (len(tag_idxs), seqlen) on the CPU.
+    """
+    classes = torch.tensor(tag_idxs, device=patch_valid.device, dtype=torch.int64)
+
+    cams: Tensor | None = None
+    with torch.enable_grad():
+        for intermediate in intermediates:
+            x = intermediate.detach().requires_grad_(True)
+            output = forward_head_classes(model, x, classes, patch_valid)
+
+            # (tags, batch, seqlen, dim) -> (tags, seqlen)
+            patch_grad = (_batched_grad(output, x).float() * x.detach().sign()).sum(dim=(1, 3))
+            del output, x
+
+            if cams is None:
+                cams = patch_grad
+            else:
+                cams.add_(patch_grad)
+
+    assert cams is not None
+    return cams.cpu()
 
-    assert cam_1d is not None
+@torch.no_grad()
+def run_cam(
+    display_image: Image.Image,
+    image: Image.Image, features: dict[str, Any],
+    tag_idx: int, cam_depth: int
+):
+    cam_1d = cam_cache.get(features["key"], cam_depth, tag_idx)
 
-    cam_2d = unpatchify(cam_1d, patch_coords, patch_valid).cpu().numpy()
+    if cam_1d is None:
+        intermediates = features["image_intermediates"]
+        if len(intermediates) < cam_depth:
+            key = features["key"]
+            features, _ = run_classifier(image, cam_depth)
+            features["key"] = key
+            intermediates = features["image_intermediates"]
+        elif len(intermediates) > cam_depth:
+            intermediates = intermediates[-cam_depth:]
+
+        # also compute the most likely tags, since they are usually selected next
+        cached = cam_cache.cached(features["key"], cam_depth)
+        tag_idxs = [tag_idx, *(
+            idx for idx in features["top_tags"]
+            if idx != tag_idx and idx not in cached
+        )][:CAM_BATCH_SIZE]
+
+        with executor.stream():
+            cams = compute_cams(intermediates, features["patch_valid"], tag_idxs)
+
+        cam_cache.put(features["key"], cam_depth, dict(zip(tag_idxs, cams.unbind(0))))
+        cam_1d = cams[0]
+
+    cam_2d = unpatchify(cam_1d, features["patch_coords"].cpu(), features["patch_valid"].cpu()).numpy()
     return cam_composite(display_image, cam_2d), features
 
 def cam_composite(image: Image.Image, cam: np.ndarray):
@@ -202,11 +381,13 @@ def cam_composite(image: Image.Image, cam: np.ndarray):
 
     image = Image.alpha_composite(image, cam_pil)
 
+    from PIL import ImageDraw
+
     draw = ImageDraw.Draw(image)
     draw.text(
         (image.width - 7, image.height - 7),
         f"{cam_scale.item():.4g}",
-        anchor="rd", font=FONT, fill=(32, 32, 255, 255)
+        anchor="rd", font=cam_font(), fill=(32, 32, 255, 255)
     )
 
     return image
@@ -248,27 +429,72 @@ def filter_tags(
         tag_str: comma-separated list including appended tags.
         predictions: dict used for confidence display (no synthetic values).
     """
-    append_list = [tag.strip() for tag in append_tags.split(',') if tag.strip()]
     blacklist_set = {tag.strip() for tag in blacklist_tags.split(',') if tag.strip()}
     
     filtered_predictions = apply_filters(
         predictions, threshold, calibration, blacklist_set
     )
 
+    return join_tags(filtered_predictions, append_tags), filtered_predictions
+
+def join_tags(filtered_predictions: dict[str, float], append_tags: str = "") -> str:
+    """Build the comma-separated tag string, with append tags first."""
+    append_list = [tag.strip() for tag in append_tags.split(',') if tag.strip()]
+
     tag_order: list[str] = []
     for tag in append_list:
         if tag and tag not in filtered_predictions:
             tag_order.append(tag)
     tag_order.extend(filtered_predictions.keys())
 
-    tag_str = ", ".join(tag_order)
-    return tag_str, filtered_predictions
+    return ", ".join(tag_order)
+
+def load_validation_data_or_none() -> ValidationData | None:
+    if not os.path.exists(VALIDATION_DATA_PATH):
+        return None
+
+    try:
+        return load_validation_data(VALIDATION_DATA_PATH)
+    except Exception as exc:  # noqa: BLE001
+        print(f"Calibration from validation data is unavailable: {exc}")
+        return None
+
+validation_data = load_validation_data_or_none()
+startup_phase("validation_data")
+
+@lru_cache(maxsize=32)
+def solve_calibration(metric: str, min_precision: float, min_recall: float) -> dict[str, float]:
+    """Calibrate all tags from the validation data, as calibrate.py does with the same options.
+
+    Raises:
+        RuntimeError: if the validation data is unavailable.
+        ValueError: if the metric is not recognized.
+    """
+    if validation_data is None:
+        raise RuntimeError(f"Missing validation data: {VALIDATION_DATA_PATH}")
+
+    calibrated = calibrate_data(validation_data, get_metric(metric), [
+        pr_filter(min_precision, 0.0),
+        pr_filter(0.0, min_recall),
+    ])
+
+    # round like a calibration file, so results match calibrate.py output
+    return {
+        rewrite_tag(tag): float(f"{min(1.0, max(0.0, threshold + CALIBRATION_EPSILON)):.4f}")
+        for tag, (threshold, _) in calibrated.items()
+    }
 
 
 class E6PredictRequest(BaseModel):
     image: str | None = None
     image_url: str | None = None
     confidence: float = 0.25
+    # when set, per-tag thresholds are solved for this metric instead of using confidence
+    metric: str | None = None
+    min_precision: float = 0.098
+    min_recall: float = 0.198
+    # frames sampled from animated images or videos; defaults to JTP_ANIMATION_FRAMES or JTP_VIDEO_FRAMES
+    frames: int | None = None
 
 
 class E6PredictResponse(BaseModel):
@@ -283,55 +509,208 @@ async def e6_health():
     return {"status": "ok"}
 
 
+# every tag the model knows, for autocomplete without asking e621
+tag_index = load_tag_index(TAG_METADATA_PATH) if os.path.exists(TAG_METADATA_PATH) else None
+startup_phase("tag_index")
+
+
+class E6AutocompleteEntry(BaseModel):
+    name: str
+    category: int
+    post_count: int | None = None
+
+
+# lookups take microseconds, so they run on the event loop
+@fastapi_app.get("/api/e6/autocomplete", response_model=list[E6AutocompleteEntry])
+async def e6_autocomplete(q: str = "", limit: int = 10):
+    """
+    Tags starting with or containing `q`, best matches first, in the shape of e621's
+    `/tags/autocomplete.json` so clients can use either.
+    """
+    if tag_index is None:
+        metrics.count("requests", endpoint="autocomplete", status="404")
+        raise HTTPException(status_code=404, detail=f"Autocomplete requires {TAG_METADATA_PATH}")
+
+    if not 1 <= limit <= MAX_AUTOCOMPLETE:
+        metrics.count("requests", endpoint="autocomplete", status="400")
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_AUTOCOMPLETE}")
+
+    with metrics.stage("autocomplete"):
+        entries: list[TagEntry] = tag_index.search(q, limit)
+
+    metrics.count("requests", endpoint="autocomplete", status="200")
+    return [entry._asdict() for entry in entries]
+
+
+metrics.describe("requests", "API requests by endpoint and status code.")
+metrics.describe("errors", "Stages that raised an exception.")
+metrics.describe("cache_hits", "Cache lookups that found an entry.")
+metrics.describe("cache_misses", "Cache lookups that found no entry.")
+
+metrics.gauge("queue_depth", "Model calls waiting for an executor slot.", lambda: executor.waiting)
+metrics.gauge("running", "Model calls holding an executor slot.", lambda: executor.running)
+metrics.gauge("worker_pending", "API requests sent to worker processes and not yet finished.", lambda: api_workers.pending if api_workers is not None else None)
+metrics.gauge("process_memory_bytes", "Memory used by the backend process.", process_memory)
+metrics.gauge("device_memory_bytes", "Memory used on the model device.", lambda: device_memory(device))
+metrics.gauge("device_utilization_percent", "Utilization of the model device.", lambda: device_utilization(device))
+metrics.gauge("batch_cache_entries", "Batch results kept for browsing.", lambda: len(batch_store))
+metrics.gauge("batch_cache_bytes", "Memory used by batch results kept for browsing.", lambda: batch_store.size)
+metrics.gauge("batch_cache_disk_bytes", "Disk used by spilled batch results.", lambda: batch_store.disk_size)
+metrics.gauge(
+    "batch_cache_lookups_total", "Lookups of batch results kept for browsing.",
+    lambda: { (("result", "hit"),): batch_store.hits, (("result", "miss"),): batch_store.misses },
+    kind="counter",
+)
+metrics.gauge(
+    "calibration_cache_lookups_total", "Lookups of live calibrations.",
+    lambda: {
+        (("result", "hit"),): solve_calibration.cache_info().hits,
+        (("result", "miss"),): solve_calibration.cache_info().misses,
+    },
+    kind="counter",
+)
+metrics.gauge(
+    "startup_seconds", "Time spent in each phase of starting the backend.",
+    lambda: { (("phase", phase),): seconds for phase, seconds in startup_seconds.items() },
+)
+
+
+@fastapi_app.get("/api/e6/metrics")
+async def e6_metrics():
+    """Per-stage latency histograms, counters and resource usage in the Prometheus text format."""
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled; unset JTP_METRICS=0 to enable them")
+
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# sync handlers run in the threadpool, so concurrent requests can share the executor
 @fastapi_app.post("/api/e6/predict", response_model=E6PredictResponse)
-async def e6_predict(payload: E6PredictRequest):
+def e6_predict(payload: E6PredictRequest):
+    try:
+        response = _e6_predict(payload)
+    except HTTPException as exc:
+        metrics.count("requests", endpoint="predict", status=str(exc.status_code))
+        raise
+    except Exception:
+        metrics.count("requests", endpoint="predict", status="500")
+        raise
+
+    metrics.count("requests", endpoint="predict", status="200")
+    return response
+
+
+def _e6_predict(payload: E6PredictRequest) -> E6PredictResponse:
     """
     Lightweight HTTP API for external clients (e.g. Tampermonkey script).
 
     Expects either:
     - `image`: a base64 data URL or raw base64 image string, or
     - `image_url`: an http(s) URL that the local backend can fetch.
-    Also accepts a confidence threshold.
+    Also accepts a confidence threshold, or a calibration `metric` with
+    `min_precision` and `min_recall` to use per-tag thresholds instead.
+    Animated images and videos are tagged from up to `frames` sampled frames.
     Returns a single-element `data` list containing the comma-separated
     tag string, matching the legacy E6AutoTagger format.
     """
+    if payload.frames is not None and not 1 <= payload.frames <= MAX_FRAMES:
+        raise HTTPException(status_code=400, detail=f"frames must be between 1 and {MAX_FRAMES}")
+
+    calibration = None
+    if payload.metric is not None:
+        if payload.metric.lower() not in CALIBRATION_METRICS:
+            raise HTTPException(status_code=400, detail=f"metric must be one of {', '.join(CALIBRATION_METRICS)}")
+
+        try:
+            calibration = solve_calibration(payload.metric.lower(), payload.min_precision, payload.min_recall)
+        except RuntimeError as exc:
+            raise HTTPException(status_code=503, detail=str(exc)) from exc
+
     try:
         if payload.image_url:
             image_url = payload.image_url.strip()
             if not image_url.lower().startswith(("http://", "https://")):
                 raise HTTPException(status_code=400, detail="image_url must be http(s)")
 
-            response = requests.get(
-                image_url,
-                timeout=30,
-                headers={"User-Agent": "E6AutoTagger/2.4.5 (+local backend)"},
-            )
-            response.raise_for_status()
-            image = Image.open(BytesIO(response.content))
+            import requests
+
+            with metrics.stage("fetch"):
+                response = requests.get(
+                    image_url,
+                    timeout=30,
+                    headers={"User-Agent": "E6AutoTagger/2.4.5 (+local backend)"},
+                )
+                response.raise_for_status()
+
+            image_bytes = response.content
         elif payload.image:
-            image_data = payload.image.strip()
-            if "," in image_data:
-                _, image_data = image_data.split(",", 1)
+            with metrics.stage("base64"):
+                image_data = payload.image.strip()
+                if "," in image_data:
+                    _, image_data = image_data.split(",", 1)
 
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(BytesIO(image_bytes))
+                image_bytes = base64.b64decode(image_data)
         else:
             raise HTTPException(status_code=400, detail="Provide image or image_url")
+
+        # videos are only opened when decoded
+        image = None if is_video_data(image_bytes) else Image.open(BytesIO(image_bytes))
     except Exception as exc:  # noqa: BLE001
         if isinstance(exc, HTTPException):
             raise
         raise HTTPException(status_code=400, detail="Invalid image input") from exc
 
-    processed_image = process_image(image, PATCH_SIZE, MAX_SEQ_LEN)
-    _, predictions = run_classifier(processed_image, cam_depth=1)
-
-    tag_str, _ = filter_tags(
-        predictions,
-        threshold=payload.confidence,
-        calibration=None,
-        append_tags="",
-        blacklist_tags="",
-    )
+    if image is None and not VIDEO_SUPPORTED:
+        raise HTTPException(status_code=415, detail="Videos require PyAV on the backend; install it with 'pip install av'")
+
+    frames = payload.frames or (ANIMATION_FRAMES if image is not None else VIDEO_FRAMES)
+
+    if api_workers is not None:
+        if image is not None:
+            # only the header has been read, so the worker decodes the image from scratch
+            image.close()
+
+        with metrics.stage("worker"):
+            try:
+                probits = api_workers.predict(
+                    image_bytes, frames=frames, time_budget=VIDEO_TIME_BUDGET,
+                    timeout=API_WORKER_TIMEOUT,
+                )
+            except TimeoutError as exc:
+                raise HTTPException(status_code=504, detail="Timed out waiting for a worker process") from exc
+            except Exception as exc:  # noqa: BLE001
+                if api_workers.broken:
+                    raise HTTPException(status_code=503, detail="Worker processes are unavailable") from exc
+                if image is not None:
+                    raise
+                raise HTTPException(status_code=400, detail="Invalid video input") from exc
+
+        predictions, _ = top_predictions(probits)
+    else:
+        if image is not None:
+            processed_frames = process_frames(image, PATCH_SIZE, MAX_SEQ_LEN, frames=frames)
+        else:
+            try:
+                processed_frames = process_video(
+                    BytesIO(image_bytes), PATCH_SIZE, MAX_SEQ_LEN,
+                    frames=frames, time_budget=VIDEO_TIME_BUDGET,
+                )
+            except Exception as exc:  # noqa: BLE001
+                raise HTTPException(status_code=400, detail="Invalid video input") from exc
+
+        if len(processed_frames) > 1:
+            predictions, _ = top_predictions(run_frames(processed_frames))
+        else:
+            _, predictions = run_classifier(processed_frames[0], cam_depth=1)
+
+    with metrics.stage("postprocess"):
+        tag_str, _ = filter_tags(
+            predictions,
+            threshold=payload.confidence,
+            calibration=calibration,
+            append_tags="",
+            blacklist_tags="",
+        )
 
     return E6PredictResponse(data=[tag_str])
 
@@ -348,62 +727,233 @@ def save_tags_to_file(output_path: str, tags):
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write(tag_str)
 
-def batch_image_changed(
-    image_name: str,
-    batch_predictions: dict[str, dict[str, float]],
-    tag_strings: dict[str, str],
-    folder_path: str,
-):
-    """Update batch image preview and tag box to match selection."""
-    if not image_name or not batch_predictions or not folder_path:
-        return None, {}, ""
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif'}
+if VIDEO_SUPPORTED:
+    IMAGE_EXTENSIONS.update(VIDEO_EXTENSIONS)
+BATCH_RESULTS_SHOWN = 200
 
-    image_path = os.path.join(folder_path, image_name)
-    try:
-        image = Image.open(image_path)
-    except Exception:
-        image = None
-
-    return image, batch_predictions.get(image_name, {}), tag_strings.get(image_name, "")
+class BatchResult(NamedTuple):
+    name: str
+    tag_str: str
+    predictions: dict[str, float]
+    error: str | None = None
 
-def batch_cam_changed(
-    image_name: str,
-    folder_path: str,
-    tag: str,
-    cam_depth: int,
-):
-    """Generate or clear CAM overlay for the selected batch image and tag.
+batch_store = SpillCache(BATCH_CACHE_BYTES, disk_budget=BATCH_DISK_BYTES, prefix="jtp-batch-")
+atexit.register(batch_store.close)
 
-    - When tag == "None", returns the original image (no CAM).
-    - Otherwise, recomputes CAM fresh from the original image so overlays
-      don't stack.
+class BatchJob(Job[BatchResult]):
     """
-    if not image_name or not folder_path:
-        return None
+    A folder tagging job. Besides the results, the model input patches and last
+    backbone block output of each image are kept in `batch_store`, so browsing the
+    results and drawing CAMs doesn't need to reload the images.
+    """
+
+    def __init__(
+        self,
+        folder_path: str,
+        output_dir: str,
+        image_files: list[str],
+        target: Callable[["BatchJob"], None],
+    ) -> None:
+        super().__init__(len(image_files), target) # type: ignore[arg-type]
+
+        self.folder_path = folder_path
+        self.output_dir = output_dir
+        self.image_files = image_files
+        self.total_tags = 0
+
+        self._by_name: dict[str, int] = {}
+
+    def add_result(self, result: BatchResult) -> None:
+        with self._lock:
+            self._by_name[result.name] = len(self._results)
+            self._results.append(result)
+            self.total_tags += len([t for t in (result.tag_str.split(",") if result.tag_str else []) if t.strip()])
+
+    def result(self, name: str) -> BatchResult | None:
+        with self._lock:
+            idx = self._by_name.get(name)
+            return self._results[idx] if idx is not None else None
+
+    def store_key(self, name: str) -> str:
+        return f"{self.id}/{name}"
+
+    def close(self) -> None:
+        batch_store.discard(self.store_key(name) for name in self.image_files)
+
+batch_jobs = JobRegistry()
+
+@torch.no_grad()
+def _run_batch_job(
+    job: BatchJob,
+    threshold: float,
+    calibration: dict[str, float] | None,
+    append_tags: str,
+    blacklist_tags: str,
+) -> None:
+    n_workers = BATCH_WORKERS if job.total > BATCH_SIZE else 0
+    loader = Loader(
+        n_workers, patch_size=PATCH_SIZE, max_seqlen=MAX_SEQ_LEN,
+        frames=ANIMATION_FRAMES, video_frames=VIDEO_FRAMES, video_time_budget=VIDEO_TIME_BUDGET,
+    )
+
+    # same as filter_tags over top_predictions, for the whole batch on the device
+    classifier = TagClassifier(
+        tag_list, calibration if calibration is not None else threshold,
+        exclude_tags=(tag.strip() for tag in blacklist_tags.split(',') if tag.strip()),
+        device=device,
+    )
 
-    image_path = os.path.join(folder_path, image_name)
     try:
-        image = Image.open(image_path)
-    except Exception:
+        for batch in batched(job.image_files, BATCH_SIZE):
+            if job.cancelled:
+                break
+
+            paths = [os.path.join(job.folder_path, image_file) for image_file in batch]
+            loaded = loader.load(paths)
+
+            names: list[str] = []
+            patches: list[Tensor] = []
+            patch_coords: list[Tensor] = []
+            patch_valid: list[Tensor] = []
+            counts: list[int] = []
+
+            for image_file, path in zip(batch, paths):
+                result = loaded[path]
+                if isinstance(result, Exception):
+                    job.add_result(BatchResult(image_file, "", {}, str(result)))
+                    continue
+
+                # one row per sampled frame of animations and videos
+                if result[0].dim() == 3:
+                    result = tuple(part.unbind(0) for part in result)
+                else:
+                    result = tuple((part,) for part in result)
+
+                names.append(image_file)
+                patches.extend(result[0])
+                patch_coords.extend(result[1])
+                patch_valid.extend(result[2])
+                counts.append(len(result[0]))
+
+            if not names:
+                continue
+
+            with executor.stream():
+                p_d, pc_d, pv_d = prepare_batch(patches, patch_coords, patch_valid, device)
+                features = model.forward_intermediates(
+                    p_d,
+                    patch_coord=pc_d,
+                    patch_valid=pv_d,
+                    indices=1,
+                    output_dict=True,
+                    output_fmt='NLC'
+                )
+
+                logits = model.forward_head(features["image_features"], patch_valid=pv_d)
+                probits = reduce_frames(logits.float().sigmoid(), counts).mul_(2.0).sub_(1.0)
+
+                # only the top predictions are considered, as in top_predictions
+                values, indices = probits.topk(250)
+                probits = torch.full_like(probits, float("-inf")).scatter_(1, indices, values)
+                labels = classifier(probits)
+                indices = indices.tolist()
+
+                intermediates = features["image_intermediates"][-1].cpu()
+                del p_d, pc_d, pv_d, features, logits, probits, values
+
+            # the first sampled frame of each image is kept for browsing and CAMs
+            first_rows = [sum(counts[:idx]) for idx in range(len(counts))]
+
+            for idx, (image_file, image_labels) in enumerate(zip(names, labels)):
+                # in order of confidence
+                filtered_predictions = {
+                    tag_list[tag_idx]: image_labels[tag_list[tag_idx]]
+                    for tag_idx in indices[idx]
+                    if tag_list[tag_idx] in image_labels
+                }
+                tag_str = join_tags(filtered_predictions, append_tags)
+
+                try:
+                    output_filename = os.path.splitext(image_file)[0] + '.txt'
+                    save_tags_to_file(os.path.join(job.output_dir, output_filename), tag_str)
+                except Exception as e:
+                    job.add_result(BatchResult(image_file, "", {}, str(e)))
+                    continue
+
+                # copy the valid rows, so the entries don't keep the whole batch alive
+                row = first_rows[idx]
+                n = int(patch_valid[row].sum())
+                batch_store.put(job.store_key(image_file), {
+                    "patches": patches[row][:n].clone(),
+                    "patch_coords": patch_coords[row][:n].clone(),
+                    "intermediate": intermediates[row, :n].clone(),
+                })
+
+                job.add_result(BatchResult(image_file, tag_str, filtered_predictions))
+    finally:
+        loader.shutdown()
+
+def _batch_summary(job: BatchJob) -> str:
+    match job.status:
+        case "completed":
+            status = f"Completed! Processed {job.done} images."
+        case "cancelled":
+            status = f"Cancelled after {job.done} of {job.total} images."
+        case "failed":
+            status = f"Failed after {job.done} of {job.total} images: {job.error}"
+        case _:
+            status = f"Processing {job.done} of {job.total} images..."
+
+    return (
+        f"{status}\n"
+        f"Total tags generated: {job.total_tags} ({job.throughput:.2f} images/s)\n"
+        f"Output directory: {job.output_dir}"
+    )
+
+def _batch_results_text(job: BatchJob) -> str:
+    results = job.results(max(0, job.done - BATCH_RESULTS_SHOWN))
+
+    lines = [
+        f"{result.name}: Error - {result.error}"
+        if result.error is not None else
+        f"{result.name}: {len([t for t in (result.tag_str.split(',') if result.tag_str else []) if t.strip()])} tags"
+        for result in results
+    ]
+
+    if job.done > len(results):
+        lines.insert(0, f"... {job.done - len(results)} earlier results not shown")
+
+    return "\n".join(lines)
+
+def _batch_entry(job: BatchJob, image_name: str) -> tuple[Image.Image, dict[str, Any]] | None:
+    """Rebuild the preview image and CAM features of a batch result from `batch_store`."""
+    entry = batch_store.get(job.store_key(image_name))
+    result = job.result(image_name)
+    if entry is None or result is None:
         return None
 
-    if tag == "None":
-        return resize_image(image)
+    n = entry["patches"].size(0)
+    image = get_srgb_patch(entry["patches"], entry["patch_coords"], PATCH_SIZE)
+    features = {
+        "image_intermediates": [entry["intermediate"].unsqueeze(0).to(device)],
+        "patch_coords": entry["patch_coords"].unsqueeze(0).to(device=device, dtype=torch.int32),
+        "patch_valid": torch.ones(1, n, device=device, dtype=torch.bool),
+        "key": job.store_key(image_name),
+        "top_tags": [tags[tag] for tag in result.predictions if tag in tags],
+    }
 
-    display_image = resize_image(image)
-    processed_image = process_image(image, PATCH_SIZE, MAX_SEQ_LEN)
+    return image, features
 
-    try:
-        features, _ = run_classifier(processed_image, cam_depth)
-    except Exception:
-        return display_image
+def _batch_selection(job: BatchJob, image_name: str | None):
+    result = job.result(image_name) if image_name else None
+    if result is None:
+        return None, {}, ""
 
-    tag_idx = tags.get(tag)
-    if tag_idx is None:
-        return display_image
+    entry = _batch_entry(job, image_name)
+    image = entry[0] if entry is not None else None
 
-    cam_image, _ = run_cam(display_image, processed_image, features, tag_idx, cam_depth)
-    return cam_image
+    return image, result.predictions, result.tag_str
 
 def process_folder_batch(
     folder_path: str,
@@ -412,170 +962,122 @@ def process_folder_batch(
     append_tags: str,
     blacklist_tags: str,
     output_dir: str,
-    cam_depth: int,
-    progress=gr.Progress()
 ):
-    """Batch process images and return a per-image foldout summary.
+    """Start a background job that tags every image in a folder.
 
-    This does not rely on append tags having fake confidences.
+    Progress and per-image results are read back by `poll_batch_job`.
     """
     output_dir = (output_dir or "").strip() or folder_path
 
-    image_extensions = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif'}
     try:
         all_files = os.listdir(folder_path)
     except Exception as e:
-        return f"Error reading folder: {str(e)}", ""
+        return None, 0, f"Error reading folder: {str(e)}", "", gr.skip(), gr.Timer(active=False)
 
     image_files = [
         f for f in all_files
-        if os.path.splitext(f)[1].lower() in image_extensions
+        if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS
     ]
 
     if not image_files:
-        return "No image files found in the selected folder.", ""
+        return None, 0, "No image files found in the selected folder.", "", gr.skip(), gr.Timer(active=False)
 
     os.makedirs(output_dir, exist_ok=True)
 
-    results: list[str] = []
-    batch_mapping: dict[str, dict[str, float]] = {}
-    tag_strings: dict[str, str] = {}
-    total_tags = 0
-
-    for idx, image_file in enumerate(image_files):
-        progress((idx + 1, len(image_files)), desc=f"Processing {image_file}")
+    job = BatchJob(
+        folder_path, output_dir, image_files,
+        lambda job: _run_batch_job(job, threshold, calibration, append_tags, blacklist_tags)
+    )
+    batch_jobs.submit(job)
 
-        try:
-            image_path = os.path.join(folder_path, image_file)
-            image = Image.open(image_path)
-            processed_image = process_image(image, PATCH_SIZE, MAX_SEQ_LEN)
-            _, predictions = run_classifier(processed_image, cam_depth)
+    return (
+        job.id, 0,
+        _batch_summary(job), "",
+        gr.Dropdown(choices=[], value=None),
+        gr.Timer(active=True),
+    )
 
-            tag_str, filtered_predictions = filter_tags(
-                predictions, threshold, calibration, append_tags, blacklist_tags
-            )
+def poll_batch_job(job_id: str | None, shown: int):
+    """Stream progress and new results of a batch job to the UI."""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return shown, gr.skip(), gr.skip(), gr.skip(), gr.skip(), gr.skip(), gr.skip(), gr.Timer(active=False)
+
+    timer = gr.Timer(active=job.running)
+    done = job.done
+
+    if done == shown:
+        return shown, _batch_summary(job), gr.skip(), gr.skip(), gr.skip(), gr.skip(), gr.skip(), timer
+
+    names = [result.name for result in job.results() if result.error is None]
+    if shown == 0 and names:
+        # select the first image once results start arriving
+        return (
+            done, _batch_summary(job), _batch_results_text(job),
+            gr.Dropdown(choices=names, value=names[0]),
+            *_batch_selection(job, names[0]),
+            timer,
+        )
 
-            output_filename = os.path.splitext(image_file)[0] + '.txt'
-            output_path = os.path.join(output_dir, output_filename)
-            save_tags_to_file(output_path, tag_str)
+    return (
+        done, _batch_summary(job), _batch_results_text(job),
+        gr.Dropdown(choices=names),
+        gr.skip(), gr.skip(), gr.skip(),
+        timer,
+    )
 
-            tag_count = len([t for t in (tag_str.split(",") if tag_str else []) if t.strip()])
-            tag_count = len([t for t in (tag_str.split(",") if tag_str else []) if t.strip()])
-            total_tags += tag_count
-            batch_mapping[image_file] = filtered_predictions
-            tag_strings[image_file] = tag_str
+def cancel_batch_job(job_id: str | None):
+    job = batch_jobs.get(job_id)
+    if job is not None:
+        job.cancel()
 
-            results.append(f"{image_file}: {tag_count} tags")
+def restore_batch_job():
+    """Reattach to the most recent batch job after a page load."""
+    job = batch_jobs.latest()
+    if job is None:
+        return None, 0, gr.Timer(active=False)
 
-            if processed_image is not image:
-                image.close()
+    return job.id, 0, gr.Timer(active=True)
 
-        except Exception as e:
-            results.append(f"{image_file}: Error - {str(e)}")
+def batch_image_changed(image_name: str, job_id: str | None):
+    """Update batch image preview and tag box to match selection."""
+    job = batch_jobs.get(job_id)
+    if not image_name or job is None:
+        return None, {}, ""
 
-    summary = (
-        f"Completed! Processed {len(image_files)} images.\n"
-        f"Total tags generated: {total_tags}\n"
-        f"Output directory: {output_dir}"
-    )
+    return _batch_selection(job, image_name)
 
-    results_text = "\n".join(results)
+def batch_cam_changed(
+    image_name: str,
+    job_id: str | None,
+    tag: str,
+    cam_depth: int,
+):
+    """Generate or clear CAM overlay for the selected batch image and tag.
 
-    first_image = image_files[0] if image_files else None
-    dropdown_update = gr.Dropdown(choices=image_files, value=first_image)
-    first_predictions = batch_mapping.get(first_image, {}) if first_image else {}
-    first_tag_string = tag_strings.get(first_image, "") if first_image else ""
+    - When tag == "None", returns the model input image (no CAM).
+    - Otherwise, draws the CAM over a fresh copy of it so overlays don't stack.
+      CAMs come from the stored backbone output, and are cached per image.
+    """
+    job = batch_jobs.get(job_id)
+    if not image_name or job is None:
+        return None
 
-    first_image_obj = None
-    if first_image:
-        first_path = os.path.join(folder_path, first_image)
-        try:
-            first_image_obj = Image.open(first_path)
-        except Exception:
-            first_image_obj = None
+    entry = _batch_entry(job, image_name)
+    if entry is None:
+        return None
 
-    return (
-        summary,
-        results_text,
-        batch_mapping,
-        tag_strings,
-        dropdown_update,
-        folder_path,
-        first_image_obj,
-        first_predictions,
-        first_tag_string,
-    )
+    image, features = entry
+    tag_idx = tags.get(tag)
+    if tag == "None" or tag_idx is None:
+        return image
 
-def process_folder(
-    folder_path: str,
-    threshold: float,
-    calibration: dict[str, float] | None,
-    append_tags: str,
-    blacklist_tags: str,
-    output_dir: str,
-    cam_depth: int,
-    progress=gr.Progress()
-):
-    """Process all images in a folder and generate text files with tags."""
-    append_list = [tag.strip() for tag in append_tags.split(',') if tag.strip()]
-    blacklist_set = {tag.strip() for tag in blacklist_tags.split(',') if tag.strip()}
-    
-    image_extensions = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif'}
     try:
-        all_files = os.listdir(folder_path)
-    except Exception as e:
-        return f"Error reading folder: {str(e)}", ""
-    
-    image_files = [
-        f for f in all_files
-        if os.path.splitext(f)[1].lower() in image_extensions
-    ]
-    
-    if not image_files:
-        return "No image files found in the selected folder.", ""
-    
-    os.makedirs(output_dir, exist_ok=True)
-    
-    results = []
-    total_tags = 0
-    
-    for idx, image_file in enumerate(image_files):
-        progress((idx, len(image_files)), desc=f"Processing {image_file}")
-        
-        try:
-            image_path = os.path.join(folder_path, image_file)
-            image = Image.open(image_path)
-            processed_image = process_image(image, PATCH_SIZE, MAX_SEQ_LEN)
-            
-            features, predictions = run_classifier(processed_image, cam_depth)
-            
-            modified_predictions = apply_tag_modifications(
-                predictions, threshold, calibration, append_list, blacklist_set
-            )
-            
-            output_filename = os.path.splitext(image_file)[0] + '.txt'
-            output_path = os.path.join(output_dir, output_filename)
-            save_tags_to_file(output_path, modified_predictions)
-            
-            tag_count = len(modified_predictions)
-            total_tags += tag_count
-            results.append(f"✓ {image_file}: {tag_count} tags")
-            
-            if processed_image is not image:
-                image.close()
-            
-        except Exception as e:
-            results.append(f"✗ {image_file}: Error - {str(e)}")
-    
-    summary = (
-        f"Completed! Processed {len(image_files)} images.\n"
-        f"Total tags generated: {total_tags}\n"
-        f"Output directory: {output_dir}"
-    )
-    
-    results_text = "\n".join(results)
-    
-    return summary, results_text
+        cam_image, _ = run_cam(image, image, features, tag_idx, cam_depth)
+    except Exception:
+        return image
+
+    return cam_image
 
 def resize_image(image: Image.Image) -> Image.Image:
     longest_side = max(image.height, image.width)
@@ -606,6 +1108,8 @@ def image_upload(image: Image.Image):
     )
 
 def url_submit(url: str):
+    import requests
+
     resp = requests.get(url, timeout=10)
     resp.raise_for_status()
 
@@ -671,9 +1175,25 @@ def calibration_changed(predictions: dict[str, float], calibration_data: bytes,
         gr.Textbox(label="Change Calibration")
     )
 
+def calibration_solved(
+    predictions: dict[str, float],
+    metric: str, min_precision: float, min_recall: float,
+    append_tags: str = "", blacklist_tags: str = "",
+):
+    try:
+        calibration = solve_calibration(metric, min_precision, min_recall)
+    except Exception:
+        return gr.skip(), gr.skip(), gr.skip(), gr.skip(), gr.skip()
+
+    return (
+        *filter_tags(predictions, 0.0, calibration, append_tags, blacklist_tags), calibration,
+        gr.Slider(label=f"Using {metric.upper()} Calibration", elem_classes=["inactive-slider"]),
+        gr.Textbox(label="Upload Calibration")
+    )
+
 def cam_changed(
     display_image: Image.Image,
-    image: Image.Image, features: dict[str, Tensor],
+    image: Image.Image, features: dict[str, Any],
     tag: str, cam_depth: int
 ):
     if tag == "None":
@@ -681,7 +1201,7 @@ def cam_changed(
 
     return run_cam(display_image, image, features, tags[tag], cam_depth)
 
-def tag_box_select(evt: gr.SelectData):
+def tag_box_select(evt: "gr.SelectData"): # resolved by Gradio when called, so headless mode never imports it
     return evt.value
 
 custom_css = """
@@ -712,225 +1232,333 @@ custom_css = """
 }
 """
 
-with gr.Blocks(
-    title="RedRocket JTP-3 Hydra",
-    css=custom_css,
-    analytics_enabled=False,
-) as demo:
-    display_image_state = gr.State()
-    image_state = gr.State()
-    features_state = gr.State()
-    predictions_state = gr.State(value={})
-    calibration_state = gr.State()
-    batch_predictions_state = gr.State(value={})
-    batch_folder_state = gr.State(value="")
-    batch_tag_strings_state = gr.State(value={})
-
-
-    gr.HTML(
-        "<h1 style='display:flex; flex-flow: row nowrap; align-items: center;'>"
-        "<a href='https://huggingface.co/RedRocket' target='_blank'>"
-        "<img src='https://huggingface.co/spaces/RedRocket/README/resolve/main/RedRocket.png' style='width: 2em; margin-right: 0.5em;'>"
-        "</a>"
-        "<span>"
-        "<a href='https://huggingface.co/RedRocket' target='_blank'>RedRocket</a> &ndash; JTP-3 Hydra"
-        "</span>"
-        "</h1>"
-    )
+def build_ui() -> "gr.Blocks":
+    """Build the web UI. Not called in headless mode."""
+
+    with gr.Blocks(
+        title="RedRocket JTP-3 Hydra",
+        css=custom_css,
+        analytics_enabled=False,
+    ) as demo:
+        display_image_state = gr.State()
+        image_state = gr.State()
+        features_state = gr.State()
+        predictions_state = gr.State(value={})
+        calibration_state = gr.State()
+        batch_job_state = gr.State()
+        batch_shown_state = gr.State(value=0)
+
+
+        gr.HTML(
+            "<h1 style='display:flex; flex-flow: row nowrap; align-items: center;'>"
+            "<a href='https://huggingface.co/RedRocket' target='_blank'>"
+            "<img src='https://huggingface.co/spaces/RedRocket/README/resolve/main/RedRocket.png' style='width: 2em; margin-right: 0.5em;'>"
+            "</a>"
+            "<span>"
+            "<a href='https://huggingface.co/RedRocket' target='_blank'>RedRocket</a> &ndash; JTP-3 Hydra"
+            "</span>"
+            "</h1>"
+        )
 
-    with gr.Tabs():
-        with gr.Tab("Single Image"):
-            with gr.Row():
-                with gr.Column():
+        with gr.Tabs():
+            with gr.Tab("Single Image"):
+                with gr.Row():
                     with gr.Column():
-                        image = gr.Image(
-                            sources=['upload', 'clipboard'], type='pil',
-                            show_label=False,
-                            show_download_button=False,
-                            show_share_button=False,
-                            elem_id="image_container"
-                        )
+                        with gr.Column():
+                            image = gr.Image(
+                                sources=['upload', 'clipboard'], type='pil',
+                                show_label=False,
+                                show_download_button=False,
+                                show_share_button=False,
+                                elem_id="image_container"
+                            )
 
-                        url = gr.Textbox(
-                            label="Upload Image via Url:",
-                            placeholder="https://example.com/image.jpg",
-                            max_lines=1,
-                            submit_btn="⮝",
-                        )
+                            url = gr.Textbox(
+                                label="Upload Image via Url:",
+                                placeholder="https://example.com/image.jpg",
+                                max_lines=1,
+                                submit_btn="⮝",
+                            )
 
-                    with gr.Column():
-                        cam_tag = gr.Dropdown(
-                            value="None", choices=["None"] + tag_list,
-                            label="CAM Attention Overlay (You can also click a tag on the right.)", show_label=True
-                        )
-                        cam_depth = gr.Slider(
-                            minimum=1, maximum=27, step=1, value=1,
-                            label="CAM Depth (1=fastest, more precise; 27=slowest, more general)"
-                        )
+                        with gr.Column():
+                            cam_tag = gr.Dropdown(
+                                value="None", choices=["None"] + tag_list,
+                                label="CAM Attention Overlay (You can also click a tag on the right.)", show_label=True
+                            )
+                            cam_depth = gr.Slider(
+                                minimum=1, maximum=27, step=1, value=1,
+                                label="CAM Depth (1=fastest, more precise; 27=slowest, more general)"
+                            )
 
-                with gr.Column():
-                    with gr.Row(variant="panel"):
-                        threshold_slider = gr.Slider(
-                            minimum=0.00, maximum=1.00, step=0.01, value=0.30,
-                            label="Tag Threshold", scale=4
-                        )
+                    with gr.Column():
+                        with gr.Row(variant="panel"):
+                            threshold_slider = gr.Slider(
+                                minimum=0.00, maximum=1.00, step=0.01, value=0.30,
+                                label="Tag Threshold", scale=4
+                            )
 
-                        with gr.Column(), gr.Group():
-                            calibration_default = gr.Button(
-                                interactive=os.path.exists("calibration.csv"),
-                                value="Default Calibration", size="lg",
+                            with gr.Column(), gr.Group():
+                                calibration_default = gr.Button(
+                                    interactive=os.path.exists("calibration.csv"),
+                                    value="Default Calibration", size="lg",
+                                )
+
+                                calibration_upload = gr.UploadButton(
+                                    file_count="single", file_types=["text"], type="binary",
+                                    label="Upload Calibration", size="md", variant="secondary",
+                                )
+
+                        with gr.Row(variant="panel", visible=validation_data is not None):
+                            calibration_metric = gr.Dropdown(
+                                choices=CALIBRATION_METRICS, value="cti",
+                                label="Calibration Metric", scale=1,
+                            )
+                            calibration_precision = gr.Slider(
+                                minimum=0.0, maximum=1.0, step=0.001, value=0.098,
+                                label="Minimum Precision", scale=2,
+                            )
+                            calibration_recall = gr.Slider(
+                                minimum=0.0, maximum=1.0, step=0.001, value=0.198,
+                                label="Minimum Recall", scale=2,
                             )
 
-                            calibration_upload = gr.UploadButton(
-                                file_count="single", file_types=["text"], type="binary",
-                                label="Upload Calibration", size="md", variant="secondary",
+                        # Tag modification inputs
+                        with gr.Row():
+                            append_tags_input = gr.Textbox(
+                                label="Append Tags (comma-separated)",
+                                placeholder="tag1, tag2, tag3",
+                                max_lines=1
                             )
+                            blacklist_tags_input = gr.Textbox(
+                                label="Blacklist Tags (comma-separated)",
+                                placeholder="tag1, tag2, tag3",
+                                max_lines=1
+                            )
+
+                        tag_string = gr.Textbox(lines=3, label="Tags", show_copy_button=True)
+                        tag_box = gr.Label(num_top_classes=250, show_label=False, show_heading=False)
 
-                    # Tag modification inputs
-                    with gr.Row():
-                        append_tags_input = gr.Textbox(
-                            label="Append Tags (comma-separated)",
-                            placeholder="tag1, tag2, tag3",
+            with gr.Tab("Batch Processing"):
+                with gr.Row():
+                    with gr.Column():
+                        batch_folder_input = gr.Textbox(
+                            label="Input Folder Path",
+                            placeholder="C:\\path\\to\\images",
                             max_lines=1
                         )
-                        blacklist_tags_input = gr.Textbox(
-                            label="Blacklist Tags (comma-separated)",
-                            placeholder="tag1, tag2, tag3",
+                        batch_output_input = gr.Textbox(
+                            label="Output Folder Path (for text files)",
+                            placeholder="C:\\path\\to\\output (Defaults to Input if blank)",
                             max_lines=1
                         )
 
-                    tag_string = gr.Textbox(lines=3, label="Tags", show_copy_button=True)
-                    tag_box = gr.Label(num_top_classes=250, show_label=False, show_heading=False)
-
-        with gr.Tab("Batch Processing"):
-            with gr.Row():
-                with gr.Column():
-                    batch_folder_input = gr.Textbox(
-                        label="Input Folder Path",
-                        placeholder="C:\\path\\to\\images",
-                        max_lines=1
-                    )
-                    batch_output_input = gr.Textbox(
-                        label="Output Folder Path (for text files)",
-                        placeholder="C:\\path\\to\\output (Defaults to Input if blank)",
-                        max_lines=1
-                    )
-                    
-                    with gr.Row():
-                        batch_threshold = gr.Slider(
-                            minimum=0.00, maximum=1.00, step=0.01, value=0.30,
-                            label="Tag Threshold"
+                        with gr.Row():
+                            batch_threshold = gr.Slider(
+                                minimum=0.00, maximum=1.00, step=0.01, value=0.30,
+                                label="Tag Threshold"
+                            )
+                            batch_cam_depth = gr.Slider(
+                                minimum=1, maximum=27, step=1, value=1,
+                                label="CAM Depth"
+                            )
+                        batch_cam_tag = gr.Dropdown(
+                            value="None",
+                            choices=["None"] + tag_list,
+                            label="CAM Attention Overlay (You can also click a tag on the right.)",
+                            show_label=True
+                        )
+
+                        with gr.Row():
+                            batch_append_tags = gr.Textbox(
+                                label="Append Tags (comma-separated)",
+                                placeholder="tag1, tag2, tag3",
+                                max_lines=1
+                            )
+                            batch_blacklist_tags = gr.Textbox(
+                                label="Blacklist Tags (comma-separated)",
+                                placeholder="tag1, tag2, tag3",
+                                max_lines=1
+                            )
+
+                        with gr.Row():
+                            batch_process_btn = gr.Button("Process Folder", variant="primary", size="lg", scale=3)
+                            batch_cancel_btn = gr.Button("Cancel", variant="stop", size="lg", scale=1)
+
+                        batch_timer = gr.Timer(1.0, active=False)
+
+                    with gr.Column():
+                        batch_summary = gr.Textbox(
+                            label="Processing Summary",
+                            lines=3,
+                            interactive=False
                         )
-                        batch_cam_depth = gr.Slider(
-                            minimum=1, maximum=27, step=1, value=1,
-                            label="CAM Depth"
+                        batch_image_preview = gr.Image(
+                            label="Batch Image",
+                            type="pil",
+                            interactive=False,
+                            show_download_button=False,
+                            show_share_button=False,
                         )
-                    batch_cam_tag = gr.Dropdown(
-                        value="None",
-                        choices=["None"] + tag_list,
-                        label="CAM Attention Overlay (You can also click a tag on the right.)",
-                        show_label=True
-                    )
-                    
-                    with gr.Row():
-                        batch_append_tags = gr.Textbox(
-                            label="Append Tags (comma-separated)",
-                            placeholder="tag1, tag2, tag3",
-                            max_lines=1
+                        batch_image_dropdown = gr.Dropdown(
+                            label="Select Image",
+                            choices=[],
+                            interactive=True
                         )
-                        batch_blacklist_tags = gr.Textbox(
-                            label="Blacklist Tags (comma-separated)",
-                            placeholder="tag1, tag2, tag3",
-                            max_lines=1
+                        batch_tag_string = gr.Textbox(
+                            lines=3,
+                            label="Tags",
+                            show_copy_button=True
                         )
-                    
-                    batch_process_btn = gr.Button("Process Folder", variant="primary", size="lg")
-                
-                with gr.Column():
-                    batch_summary = gr.Textbox(
-                        label="Processing Summary",
-                        lines=3,
-                        interactive=False
-                    )
-                    batch_image_preview = gr.Image(
-                        label="Batch Image",
-                        type="pil",
-                        interactive=False,
-                        show_download_button=False,
-                        show_share_button=False,
-                    )
-                    batch_image_dropdown = gr.Dropdown(
-                        label="Select Image",
-                        choices=[],
-                        interactive=True
-                    )
-                    batch_tag_string = gr.Textbox(
-                        lines=3,
-                        label="Tags",
-                        show_copy_button=True
-                    )
-                    batch_tag_box = gr.Label(
-                        num_top_classes=250,
-                        label="Batch Tags",
-                        show_label=True,
-                        show_heading=False
-                    )
-                    batch_results = gr.Markdown(label="Detailed Results")
-
-    image.upload(
-        fn=image_upload,
-        inputs=[image],
-        outputs=[
-            tag_string, tag_box, cam_tag, url,
-            image, display_image_state,
-            image_state,
-        ],
-        show_progress='minimal',
-        show_progress_on=[image]
-    ).then(
-        fn=image_changed,
-        inputs=[image_state, threshold_slider, calibration_state, cam_depth, append_tags_input, blacklist_tags_input],
-        outputs=[
-            tag_string, tag_box,
-            features_state, predictions_state,
-        ],
-        show_progress='minimal',
-        show_progress_on=[tag_box]
-    )
+                        batch_tag_box = gr.Label(
+                            num_top_classes=250,
+                            label="Batch Tags",
+                            show_label=True,
+                            show_heading=False
+                        )
+                        batch_results = gr.Markdown(label="Detailed Results")
+
+        image.upload(
+            fn=image_upload,
+            inputs=[image],
+            outputs=[
+                tag_string, tag_box, cam_tag, url,
+                image, display_image_state,
+                image_state,
+            ],
+            show_progress='minimal',
+            show_progress_on=[image]
+        ).then(
+            fn=image_changed,
+            inputs=[image_state, threshold_slider, calibration_state, cam_depth, append_tags_input, blacklist_tags_input],
+            outputs=[
+                tag_string, tag_box,
+                features_state, predictions_state,
+            ],
+            show_progress='minimal',
+            show_progress_on=[tag_box]
+        )
 
-    url.submit(
-        fn=url_submit,
-        inputs=[url],
-        outputs=[
-            tag_string, tag_box, cam_tag,
-            image, display_image_state,
-            image_state,
-        ],
-        show_progress='minimal',
-        show_progress_on=[url]
-    ).then(
-        fn=image_changed,
-        inputs=[image_state, threshold_slider, calibration_state, cam_depth, append_tags_input, blacklist_tags_input],
-        outputs=[
-            tag_string, tag_box,
-            features_state, predictions_state,
-        ],
-        show_progress='minimal',
-        show_progress_on=[tag_box]
-    )
+        url.submit(
+            fn=url_submit,
+            inputs=[url],
+            outputs=[
+                tag_string, tag_box, cam_tag,
+                image, display_image_state,
+                image_state,
+            ],
+            show_progress='minimal',
+            show_progress_on=[url]
+        ).then(
+            fn=image_changed,
+            inputs=[image_state, threshold_slider, calibration_state, cam_depth, append_tags_input, blacklist_tags_input],
+            outputs=[
+                tag_string, tag_box,
+                features_state, predictions_state,
+            ],
+            show_progress='minimal',
+            show_progress_on=[tag_box]
+        )
 
-    image.clear(
-        fn=image_clear,
-        inputs=[],
-        outputs=[
-            tag_string, tag_box, cam_tag, url,
-            image, display_image_state,
-            image_state, features_state, predictions_state,
-        ],
-        show_progress='hidden'
-    )
+        image.clear(
+            fn=image_clear,
+            inputs=[],
+            outputs=[
+                tag_string, tag_box, cam_tag, url,
+                image, display_image_state,
+                image_state, features_state, predictions_state,
+            ],
+            show_progress='hidden'
+        )
+
+        threshold_slider.input(
+            fn=threshold_input,
+            inputs=[predictions_state, threshold_slider, append_tags_input, blacklist_tags_input],
+            outputs=[tag_string, tag_box, calibration_state, threshold_slider, calibration_upload],
+            trigger_mode='always_last',
+            show_progress='hidden'
+        )
+
+        calibration_default.click(
+            fn=calibration_load,
+            inputs=[predictions_state, append_tags_input, blacklist_tags_input],
+            outputs=[tag_string, tag_box, calibration_state, threshold_slider, calibration_upload],
+            show_progress='hidden'
+        )
+
+        calibration_upload.upload(
+            fn=calibration_changed,
+            inputs=[predictions_state, calibration_upload, append_tags_input, blacklist_tags_input],
+            outputs=[tag_string, tag_box, calibration_state, threshold_slider, calibration_upload],
+            trigger_mode='always_last',
+            show_progress='minimal',
+            show_progress_on=[calibration_upload],
+        )
+
+        for calibration_input in (calibration_metric, calibration_precision, calibration_recall):
+            calibration_input.input(
+                fn=calibration_solved,
+                inputs=[
+                    predictions_state,
+                    calibration_metric, calibration_precision, calibration_recall,
+                    append_tags_input, blacklist_tags_input,
+                ],
+                outputs=[tag_string, tag_box, calibration_state, threshold_slider, calibration_upload],
+                trigger_mode='always_last',
+                show_progress='hidden'
+            )
 
-    threshold_slider.input(
+        cam_tag.input(
+            fn=cam_changed,
+            inputs=[
+                display_image_state,
+                image_state, features_state,
+                cam_tag, cam_depth,
+            ],
+            outputs=[image, features_state],
+            trigger_mode='always_last',
+            show_progress='minimal',
+            show_progress_on=[cam_tag]
+        )
+
+        cam_depth.input(
+            fn=cam_changed,
+            inputs=[
+                display_image_state,
+                image_state, features_state,
+                cam_tag, cam_depth,
+            ],
+            outputs=[image, features_state],
+            trigger_mode='always_last',
+            show_progress='minimal',
+            show_progress_on=[cam_depth]
+        )
+
+        tag_box.select(
+            fn=tag_box_select,
+            inputs=[],
+            outputs=[cam_tag],
+            trigger_mode='always_last',
+            show_progress='hidden',
+        ).then(
+            fn=cam_changed,
+            inputs=[
+                display_image_state,
+                image_state, features_state,
+                cam_tag, cam_depth,
+            ],
+            outputs=[image, features_state],
+            show_progress='minimal',
+            show_progress_on=[cam_tag]
+        )
+
+        scan_timer = gr.Timer()
+        scan_timer.tick(
+            fn=lambda: gr.Button(interactive=os.path.exists("calibration.csv")),
+            outputs=[calibration_default],
+            show_progress='hidden'
+        )
+        # Event handlers for append/blacklist tags
+        append_tags_input.input(
         fn=threshold_input,
         inputs=[predictions_state, threshold_slider, append_tags_input, blacklist_tags_input],
         outputs=[tag_string, tag_box, calibration_state, threshold_slider, calibration_upload],
@@ -938,148 +1566,113 @@ with gr.Blocks(
         show_progress='hidden'
     )
 
-    calibration_default.click(
-        fn=calibration_load,
-        inputs=[predictions_state, append_tags_input, blacklist_tags_input],
-        outputs=[tag_string, tag_box, calibration_state, threshold_slider, calibration_upload],
-        show_progress='hidden'
-    )
-
-    calibration_upload.upload(
-        fn=calibration_changed,
-        inputs=[predictions_state, calibration_upload, append_tags_input, blacklist_tags_input],
+        blacklist_tags_input.input(
+        fn=threshold_input,
+        inputs=[predictions_state, threshold_slider, append_tags_input, blacklist_tags_input],
         outputs=[tag_string, tag_box, calibration_state, threshold_slider, calibration_upload],
         trigger_mode='always_last',
-        show_progress='minimal',
-        show_progress_on=[calibration_upload],
-    )
-
-    cam_tag.input(
-        fn=cam_changed,
-        inputs=[
-            display_image_state,
-            image_state, features_state,
-            cam_tag, cam_depth,
-        ],
-        outputs=[image, features_state],
-        trigger_mode='always_last',
-        show_progress='minimal',
-        show_progress_on=[cam_tag]
+        show_progress='hidden'
     )
 
-    cam_depth.input(
-        fn=cam_changed,
-        inputs=[
-            display_image_state,
-            image_state, features_state,
-            cam_tag, cam_depth,
-        ],
-        outputs=[image, features_state],
-        trigger_mode='always_last',
-        show_progress='minimal',
-        show_progress_on=[cam_depth]
-    )
+        # Batch processing event handlers
+        batch_process_btn.click(
+            fn=process_folder_batch,
+            inputs=[
+                batch_folder_input,
+                batch_threshold,
+                calibration_state,
+                batch_append_tags,
+                batch_blacklist_tags,
+                batch_output_input,
+            ],
+            outputs=[
+                batch_job_state,
+                batch_shown_state,
+                batch_summary,
+                batch_results,
+                batch_image_dropdown,
+                batch_timer,
+            ],
+            show_progress='minimal',
+            show_progress_on=[batch_summary],
+        )
 
-    tag_box.select(
-        fn=tag_box_select,
-        inputs=[],
-        outputs=[cam_tag],
-        trigger_mode='always_last',
-        show_progress='hidden',
-    ).then(
-        fn=cam_changed,
-        inputs=[
-            display_image_state,
-            image_state, features_state,
-            cam_tag, cam_depth,
-        ],
-        outputs=[image, features_state],
-        show_progress='minimal',
-        show_progress_on=[cam_tag]
-    )
+        batch_timer.tick(
+            fn=poll_batch_job,
+            inputs=[batch_job_state, batch_shown_state],
+            outputs=[
+                batch_shown_state,
+                batch_summary,
+                batch_results,
+                batch_image_dropdown,
+                batch_image_preview,
+                batch_tag_box,
+                batch_tag_string,
+                batch_timer,
+            ],
+            show_progress='hidden',
+        )
 
-    scan_timer = gr.Timer()
-    scan_timer.tick(
-        fn=lambda: gr.Button(interactive=os.path.exists("calibration.csv")),
-        outputs=[calibration_default],
-        show_progress='hidden'
-    )
-    # Event handlers for append/blacklist tags
-    append_tags_input.input(
-    fn=threshold_input,
-    inputs=[predictions_state, threshold_slider, append_tags_input, blacklist_tags_input],
-    outputs=[tag_string, tag_box, calibration_state, threshold_slider, calibration_upload],
-    trigger_mode='always_last',
-    show_progress='hidden'
-)
+        batch_cancel_btn.click(
+            fn=cancel_batch_job,
+            inputs=[batch_job_state],
+            outputs=[],
+            show_progress='hidden',
+        )
 
-    blacklist_tags_input.input(
-    fn=threshold_input,
-    inputs=[predictions_state, threshold_slider, append_tags_input, blacklist_tags_input],
-    outputs=[tag_string, tag_box, calibration_state, threshold_slider, calibration_upload],
-    trigger_mode='always_last',
-    show_progress='hidden'
-)
+        demo.load(
+            fn=restore_batch_job,
+            inputs=[],
+            outputs=[batch_job_state, batch_shown_state, batch_timer],
+            show_progress='hidden',
+        )
 
-    # Batch processing event handler
-    batch_process_btn.click(
-        fn=process_folder_batch,
-        inputs=[
-            batch_folder_input,
-            batch_threshold,
-            calibration_state,
-            batch_append_tags,
-            batch_blacklist_tags,
-            batch_output_input,
-            batch_cam_depth
-        ],
-        outputs=[
-            batch_summary,
-            batch_results,
-            batch_predictions_state,
-            batch_tag_strings_state,
-            batch_image_dropdown,
-            batch_folder_state,
-            batch_image_preview,
-            batch_tag_box,
-            batch_tag_string,
-        ],
-        show_progress='full'
-    )
+        batch_image_dropdown.input(
+            fn=batch_image_changed,
+            inputs=[batch_image_dropdown, batch_job_state],
+            outputs=[batch_image_preview, batch_tag_box, batch_tag_string],
+            trigger_mode='always_last',
+            show_progress='hidden'
+        )
 
-    batch_image_dropdown.input(
-        fn=batch_image_changed,
-        inputs=[batch_image_dropdown, batch_predictions_state, batch_tag_strings_state, batch_folder_state],
-        outputs=[batch_image_preview, batch_tag_box, batch_tag_string],
-        trigger_mode='always_last',
-        show_progress='hidden'
-    )
+        batch_tag_box.select(
+            fn=tag_box_select,
+            inputs=[],
+            outputs=[batch_cam_tag],
+            trigger_mode='always_last',
+            show_progress='hidden',
+        ).then(
+            fn=batch_cam_changed,
+            inputs=[batch_image_dropdown, batch_job_state, batch_cam_tag, batch_cam_depth],
+            outputs=[batch_image_preview],
+            show_progress='minimal',
+            show_progress_on=[batch_cam_tag],
+        )
 
-    batch_tag_box.select(
-        fn=tag_box_select,
-        inputs=[],
-        outputs=[batch_cam_tag],
-        trigger_mode='always_last',
-        show_progress='hidden',
-    ).then(
-        fn=batch_cam_changed,
-        inputs=[batch_image_dropdown, batch_folder_state, batch_cam_tag, batch_cam_depth],
-        outputs=[batch_image_preview],
-        show_progress='minimal',
-        show_progress_on=[batch_cam_tag],
-    )
+        batch_cam_tag.input(
+            fn=batch_cam_changed,
+            inputs=[batch_image_dropdown, batch_job_state, batch_cam_tag, batch_cam_depth],
+            outputs=[batch_image_preview],
+            trigger_mode='always_last',
+            show_progress='minimal'
+        )
 
-    batch_cam_tag.input(
-        fn=batch_cam_changed,
-        inputs=[batch_image_dropdown, batch_folder_state, batch_cam_tag, batch_cam_depth],
-        outputs=[batch_image_preview],
-        trigger_mode='always_last',
-        show_progress='minimal'
-    )
+    return demo
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    app = gr.mount_gradio_app(fastapi_app, demo, path="/")
+    if HEADLESS:
+        app = fastapi_app
+    else:
+        demo = build_ui()
+        demo.queue(default_concurrency_limit=MAX_STREAMS)
+        app = gr.mount_gradio_app(fastapi_app, demo, path="/")
+        startup_phase("ui")
+
+    print("Startup: " + ", ".join(
+        f"{phase} {seconds:.2f}s" for phase, seconds in startup_seconds.items()
+    ) + f", total {sum(startup_seconds.values()):.2f}s")
+
     uvicorn.run(app, host="127.0.0.1", port=7860)
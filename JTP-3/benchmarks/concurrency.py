@@ -0,0 +1,131 @@
+import argparse
+import base64
+import json
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from statistics import median
+from threading import Barrier
+from time import perf_counter
+from typing import Any, Callable
+
+import numpy as np
+
+from PIL import Image
+
+def _synthetic_payloads(count: int, seed: int) -> list[dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    payloads = []
+
+    for _ in range(count):
+        w, h = rng.integers(256, 1536, size=2)
+        pixels = rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8)
+
+        buffer = BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+
+        payloads.append({
+            "image": "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii"),
+            "confidence": 0.25,
+        })
+
+    return payloads
+
+def _http_client(url: str) -> Callable[[dict[str, Any]], None]:
+    import requests
+
+    session = requests.Session()
+
+    def post(payload: dict[str, Any]) -> None:
+        response = session.post(f"{url.rstrip('/')}/predict", json=payload, timeout=600)
+        response.raise_for_status()
+
+    return post
+
+def _local_client() -> Callable[[dict[str, Any]], None]:
+    from fastapi.testclient import TestClient
+
+    from app import fastapi_app
+
+    client = TestClient(fastapi_app)
+
+    def post(payload: dict[str, Any]) -> None:
+        response = client.post("/api/e6/predict", json=payload)
+        response.raise_for_status()
+
+    return post
+
+def _percentile(values: list[float], pct: float) -> float:
+    return float(np.percentile(values, pct)) if values else 0.0
+
+def run(post: Callable[[dict[str, Any]], None], payloads: list[dict[str, Any]], n_clients: int, requests_per_client: int) -> dict[str, Any]:
+    latencies: list[float] = []
+    barrier = Barrier(n_clients)
+
+    def client(idx: int) -> list[float]:
+        timings = []
+        barrier.wait()
+
+        for n in range(requests_per_client):
+            payload = payloads[(idx * requests_per_client + n) % len(payloads)]
+            start = perf_counter()
+            post(payload)
+            timings.append(perf_counter() - start)
+
+        return timings
+
+    start = perf_counter()
+    with ThreadPoolExecutor(n_clients) as pool:
+        for timings in pool.map(client, range(n_clients)):
+            latencies.extend(timings)
+    elapsed = perf_counter() - start
+
+    return {
+        "clients": n_clients,
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "latency_p50": median(latencies),
+        "latency_p95": _percentile(latencies, 95),
+        "latency_max": max(latencies),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark /api/e6/predict with parallel clients.")
+    parser.add_argument("--url", type=str,
+        help="Base URL of a running API, such as http://127.0.0.1:7860/api/e6. If not specified, app.py is loaded in-process.")
+    parser.add_argument("-c", "--clients", type=int, nargs="+", default=[1, 2, 4, 8],
+        help="Numbers of parallel clients to test. (Default: 1 2 4 8)")
+    parser.add_argument("-n", "--requests", type=int, default=8,
+        help="Requests per client. (Default: 8)")
+    parser.add_argument("--images", type=int, default=16,
+        help="Number of distinct synthetic images. (Default: 16)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=str,
+        help="Write results as JSON to the specified path.")
+    args = parser.parse_args()
+
+    payloads = _synthetic_payloads(args.images, args.seed)
+    post = _http_client(args.url) if args.url else _local_client()
+
+    post(payloads[0]) # warm up
+
+    results = []
+    for n_clients in args.clients:
+        result = run(post, payloads, n_clients, args.requests)
+        results.append(result)
+
+        print(
+            f"{n_clients:3d} clients  {result['throughput']:7.2f} req/s  "
+            f"p50 {result['latency_p50'] * 1000:8.1f} ms  "
+            f"p95 {result['latency_p95'] * 1000:8.1f} ms",
+            file=sys.stderr
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import sys
+
+from collections import defaultdict
+from time import perf_counter
+from typing import Iterable, cast
+
+import torch
+from torch import Tensor
+
+from hydra_pool import HydraPool, IndexedAdd
+
+def _reference_load_indices(module: IndexedAdd, indices: Iterable[tuple[int, int]], *, mean: bool = False) -> None:
+    groups: dict[int, list[int]] = defaultdict(list)
+
+    with torch.no_grad():
+        idx = -1
+        for idx, (src, dst) in enumerate(indices):
+            module.index[0, idx] = src
+            module.index[1, idx] = dst
+
+            if mean:
+                groups[dst].append(idx)
+
+        if (idx + 1) != module.index.size(1):
+            raise IndexError(f"Expected {module.index.size(1)} indices, but got {idx + 1}.")
+
+        if not mean:
+            return
+
+        assert module.weight is not None
+
+        for idxs in groups.values():
+            if len(idxs) < 2:
+                continue
+
+            module.weight.index_fill_(
+                module.dim,
+                torch.tensor(idxs, device=module.weight.device, dtype=torch.int64),
+                1.0 / len(idxs)
+            )
+
+def _reference_prune_roots(pool: HydraPool, retain_classes: set[int]) -> tuple[list[int], list[int]]:
+    assert pool.clsroots is not None
+
+    used_roots: set[int] = set()
+    used_clsroots: list[int] = []
+
+    clsroots = [
+        cast(list[int], clsroot.tolist())
+        for clsroot in pool.clsroots.index.cpu().unbind(1)
+    ]
+
+    for idx, (src, dest) in enumerate(clsroots):
+        if dest in retain_classes:
+            used_roots.add(src)
+            used_clsroots.append(idx)
+
+    sorted_roots = sorted(used_roots)
+    rootmap = { root: idx for idx, root in enumerate(sorted_roots) }
+    clsmap = { cls: idx for idx, cls in enumerate(sorted(retain_classes)) }
+
+    with torch.no_grad():
+        for idx in used_clsroots:
+            src, dest = clsroots[idx]
+            pool.clsroots.index[0, idx] = rootmap[src]
+            pool.clsroots.index[1, idx] = clsmap[dest]
+
+    return sorted_roots, used_clsroots
+
+def _synthetic_indices(n_classes: int, n_roots: int, n_links: int, seed: int) -> Tensor:
+    gen = torch.Generator().manual_seed(seed)
+    return torch.stack((
+        torch.randint(0, n_roots, (n_links,), generator=gen),
+        torch.randint(0, n_classes, (n_links,), generator=gen),
+    ))
+
+def _timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        best = min(best, perf_counter() - start)
+
+    return best
+
+def _pool(n_classes: int, n_roots: int, n_links: int) -> HydraPool:
+    return HydraPool(
+        64, 16, n_classes,
+        roots=(n_roots, n_links, 0), ff_ratio=0.0,
+        dtype=torch.float32,
+    )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark IndexedAdd.load_indices and HydraPool.prune_roots.")
+    parser.add_argument("--classes", type=int, default=8000)
+    parser.add_argument("--roots", type=int, default=2000)
+    parser.add_argument("--links", type=int, default=40000)
+    parser.add_argument("--retain", type=float, default=0.9,
+        help="Fraction of classes retained when pruning. (Default: 0.9)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    indices = _synthetic_indices(args.classes, args.roots, args.links, args.seed)
+    pairs = [cast(tuple[int, int], tuple(pair)) for pair in indices.T.tolist()]
+
+    reference = _pool(args.classes, args.roots, args.links)
+    vectorized = _pool(args.classes, args.roots, args.links)
+    assert reference.clsroots is not None and vectorized.clsroots is not None
+
+    ref_time = _timed(lambda: _reference_load_indices(reference.clsroots, pairs, mean=True), args.repeat)
+    vec_time = _timed(lambda: vectorized.clsroots.load_indices(indices, mean=True), args.repeat)
+    pairs_time = _timed(lambda: vectorized.clsroots.load_indices(pairs, mean=True), args.repeat)
+
+    assert torch.equal(reference.clsroots.index, vectorized.clsroots.index), "index buffers differ"
+    assert reference.clsroots.weight is not None and vectorized.clsroots.weight is not None
+    assert torch.equal(reference.clsroots.weight, vectorized.clsroots.weight), "mean weights differ"
+
+    print(f"load_indices  {args.links} links")
+    print(f"  reference   {ref_time * 1000:10.2f} ms")
+    print(f"  tensor      {vec_time * 1000:10.2f} ms  ({ref_time / vec_time:.1f}x)")
+    print(f"  pairs       {pairs_time * 1000:10.2f} ms  ({ref_time / pairs_time:.1f}x)")
+
+    gen = torch.Generator().manual_seed(args.seed + 1)
+    retain = set(torch.randperm(args.classes, generator=gen)[:int(args.classes * args.retain)].tolist())
+
+    def prune(pool: HydraPool, fn) -> tuple[float, tuple[list[int], list[int]]]:
+        assert pool.clsroots is not None
+        result: list[tuple[list[int], list[int]]] = []
+
+        def run() -> None:
+            pool.clsroots.load_indices(indices)
+            start = perf_counter()
+            result.append(fn(pool, retain))
+            timings.append(perf_counter() - start)
+
+        timings: list[float] = []
+        for _ in range(args.repeat):
+            run()
+
+        return min(timings), result[-1]
+
+    ref_time, ref_result = prune(reference, _reference_prune_roots)
+    vec_time, vec_result = prune(vectorized, HydraPool.prune_roots)
+
+    assert ref_result == vec_result, "pruned roots differ"
+    assert torch.equal(reference.clsroots.index, vectorized.clsroots.index), "pruned index buffers differ"
+
+    print(f"prune_roots   {len(retain)} retained classes")
+    print(f"  reference   {ref_time * 1000:10.2f} ms")
+    print(f"  tensor      {vec_time * 1000:10.2f} ms  ({ref_time / vec_time:.1f}x)")
+    print("Buffers and weights are identical.", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+from time import perf_counter
+from typing import Any, Callable
+
+import numpy as np
+
+import torch
+
+from PIL import Image
+
+from benchmarks.synthetic import IMAGE_CASES, N_TAGS, SHRUNKEN_BACKBONE, make_images, synthetic_metadata, synthetic_model
+from inference import TagClassifier, _output_writer, batched, classify_output
+from loader import Loader
+from model import patchify_image, prepare_batch, process_image
+
+PATCH_SIZE = 16
+
+def _stats(timings: list[float], items: int | None = None) -> dict[str, Any]:
+    total = sum(timings)
+    items = len(timings) if items is None else items
+
+    return {
+        "count": items,
+        "seconds": total,
+        "mean_ms": total / len(timings) * 1000 if timings else 0.0,
+        "p50_ms": float(np.percentile(timings, 50)) * 1000 if timings else 0.0,
+        "p95_ms": float(np.percentile(timings, 95)) * 1000 if timings else 0.0,
+        "per_second": items / total if total > 0 else 0.0,
+    }
+
+def _sync(device: str) -> None:
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+
+def _timed(fn: Callable[[], Any]) -> tuple[float, Any]:
+    start = perf_counter()
+    result = fn()
+    return perf_counter() - start, result
+
+def bench_images(paths: dict[str, list[str]], seqlen: int) -> dict[str, Any]:
+    """Time decoding, process_srgb and patchify_image separately for each image case."""
+
+    results: dict[str, Any] = {}
+
+    for case, case_paths in paths.items():
+        decode: list[float] = []
+        process: list[float] = []
+        patchify: list[float] = []
+
+        for path in case_paths:
+            with Image.open(path) as img:
+                elapsed, _ = _timed(img.load)
+                decode.append(elapsed)
+
+                elapsed, processed = _timed(lambda: process_image(img, PATCH_SIZE, seqlen))
+                process.append(elapsed)
+
+            elapsed, _ = _timed(lambda: patchify_image(processed, PATCH_SIZE, seqlen))
+            patchify.append(elapsed)
+
+        results[case] = {
+            "bytes": sum(os.path.getsize(path) for path in case_paths) // len(case_paths),
+            "decode": _stats(decode),
+            "process_srgb": _stats(process),
+            "patchify_image": _stats(patchify),
+        }
+
+    return results
+
+def bench_loader(paths: list[str], n_workers: int, seqlen: int, batch_size: int) -> tuple[dict[str, Any], list[tuple[torch.Tensor, ...]]]:
+    start = perf_counter()
+    loader = Loader(n_workers, patch_size=PATCH_SIZE, max_seqlen=seqlen)
+    loader.load(paths[:1]) # workers import torch on first use
+    start_time = perf_counter() - start
+
+    loaded: list[tuple[torch.Tensor, ...]] = []
+    timings: list[float] = []
+
+    try:
+        for batch in batched(paths, batch_size):
+            elapsed, results = _timed(lambda: loader.load(batch))
+            timings.append(elapsed)
+
+            for result in results.values():
+                if isinstance(result, Exception):
+                    raise result
+
+                loaded.append(result)
+    finally:
+        loader.shutdown()
+
+    return {
+        "workers": n_workers,
+        "startup_seconds": start_time,
+        **_stats(timings, len(paths)),
+    }, loaded
+
+def bench_forward(model, loaded: list[tuple[torch.Tensor, ...]], batch_size: int, device: str, repeat: int) -> tuple[dict[str, Any], list[torch.Tensor]]:
+    batches = [
+        prepare_batch(*(list(items) for items in zip(*batch)), device)
+        for batch in batched(loaded, batch_size)
+    ]
+
+    with torch.inference_mode():
+        model(*batches[0]) # warm up
+        _sync(device)
+
+        timings: list[float] = []
+        outputs: list[torch.Tensor] = []
+        for _ in range(repeat):
+            outputs = []
+            for p_d, pc_d, pv_d in batches:
+                start = perf_counter()
+                outputs.append(model(p_d, pc_d, pv_d).float().sigmoid())
+                _sync(device)
+                timings.append(perf_counter() - start)
+
+    return {"batch_size": batch_size, **_stats(timings, len(loaded) * repeat)}, outputs
+
+def bench_classify(outputs: list[torch.Tensor], tags: list[str], implications: str, device: str) -> dict[str, Any]:
+    metadata = synthetic_metadata(tags)
+    exclude = frozenset({ 7 })
+    n_images = sum(output.size(0) for output in outputs)
+
+    per_image: list[float] = []
+    for output in outputs:
+        for row in output.cpu():
+            elapsed, _ = _timed(lambda: classify_output(
+                row, tags, 0.5,
+                metadata=metadata, implications=implications, exclude_categories=exclude
+            ))
+            per_image.append(elapsed)
+
+    compile_time, classifier = _timed(lambda: TagClassifier(
+        tags, 0.5,
+        metadata=metadata, implications=implications, exclude_categories=exclude,
+        device=device,
+    ))
+
+    batched_timings: list[float] = []
+    for output in outputs:
+        start = perf_counter()
+        classifier(output)
+        _sync(device)
+        batched_timings.append(perf_counter() - start)
+
+    return {
+        "implications": implications,
+        "classify_output": _stats(per_image),
+        "tag_classifier": {"compile_seconds": compile_time, **_stats(batched_timings, n_images)},
+    }
+
+def bench_output(outputs: list[torch.Tensor], tags: list[str], directory: str, device: str) -> dict[str, Any]:
+    n_images = sum(output.size(0) for output in outputs)
+    paths = [os.path.join(directory, f"output-{idx}.png") for idx in range(n_images)]
+
+    results: dict[str, Any] = {}
+    for name in ("captions", "csv"):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if name == "csv" else None
+
+        write_output = _output_writer(
+            tags=tags, metadata={}, implications="off", exclude=set(),
+            threshold=0.5, writer=writer, prefix="", device=device,
+        )
+
+        timings: list[float] = []
+        offset = 0
+        for output in outputs:
+            batch_paths = paths[offset:offset + output.size(0)]
+            offset += output.size(0)
+
+            elapsed, _ = _timed(lambda: write_output(batch_paths, output))
+            timings.append(elapsed)
+
+        results[name] = _stats(timings, n_images)
+
+    return results
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def _print_comparison(results: dict[str, Any], baseline: dict[str, Any], prefix: str = "") -> None:
+    for key, value in results.items():
+        base = baseline.get(key)
+        if isinstance(value, dict) and isinstance(base, dict):
+            _print_comparison(value, base, f"{prefix}{key}.")
+        elif key == "per_second" and isinstance(base, (int, float)) and base > 0:
+            print(f"  {prefix[:-1]:60s} {value:10.2f}/s  ({value / base:.2f}x)", file=sys.stderr)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the tagging pipeline with a synthetic model and images.")
+    parser.add_argument("--shrink", action="store_true",
+        help=f"Use a shrunken backbone ({', '.join(f'{k}={v}' for k, v in SHRUNKEN_BACKBONE.items())}) instead of the full size.")
+    parser.add_argument("--depth", type=int,
+        help="Override the backbone depth.")
+    parser.add_argument("--tags", type=int, default=N_TAGS,
+        help=f"Number of tags. (Default: {N_TAGS})")
+    parser.add_argument("--images", type=int, default=4,
+        help=f"Images per case, over {len(IMAGE_CASES)} cases. (Default: 4)")
+    parser.add_argument("--image-dir", type=str,
+        help="Directory for synthetic images. If not specified, a temporary directory is used.")
+    parser.add_argument("-b", "--batch", type=int, default=8)
+    parser.add_argument("-w", "--workers", type=int, default=-1,
+        help="Number of dataloader workers. (Default: number of cores)")
+    parser.add_argument("-S", "--seqlen", type=int, default=1024)
+    parser.add_argument("-d", "--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--repeat", type=int, default=1,
+        help="Forward passes over the whole set. (Default: 1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=str,
+        help="Write results as JSON to the specified path.")
+    parser.add_argument("--compare", type=str,
+        help="Print throughput relative to a previous JSON result.")
+    args = parser.parse_args()
+
+    backbone_args = dict(SHRUNKEN_BACKBONE) if args.shrink else {}
+    if args.depth is not None:
+        backbone_args["depth"] = args.depth
+
+    with tempfile.TemporaryDirectory(prefix="jtp-bench-") as tmp:
+        image_dir = args.image_dir or os.path.join(tmp, "images")
+
+        print("Generating images ...", file=sys.stderr)
+        paths = make_images(image_dir, per_case=args.images, seed=args.seed)
+        all_paths = [path for case_paths in paths.values() for path in case_paths]
+
+        print("Building model ...", file=sys.stderr)
+        build_time, (model, tags) = _timed(lambda: synthetic_model(
+            args.tags, backbone_args=backbone_args, device=args.device, seed=args.seed
+        ))
+
+        print("Timing stages ...", file=sys.stderr)
+        images = bench_images(paths, args.seqlen)
+        loader, loaded = bench_loader(all_paths, args.workers, args.seqlen, args.batch)
+        forward, outputs = bench_forward(model, loaded, args.batch, args.device, args.repeat)
+        classify = {
+            mode: bench_classify(outputs, tags, mode, args.device)
+            for mode in ("off", "inherit")
+        }
+        output = bench_output(outputs, tags, tmp, args.device)
+
+    results = {
+        "config": {
+            "commit": _git_commit(),
+            "torch": torch.__version__,
+            "python": platform.python_version(),
+            "device": args.device,
+            "backbone_args": backbone_args,
+            "tags": args.tags,
+            "images": len(all_paths),
+            "batch_size": args.batch,
+            "seqlen": args.seqlen,
+            "model_build_seconds": build_time,
+        },
+        "images": images,
+        "loader": loader,
+        "forward": forward,
+        "classify": classify,
+        "output": output,
+    }
+
+    print(f"loader   {loader['per_second']:8.2f} images/s ({loader['workers']} workers)", file=sys.stderr)
+    print(f"forward  {forward['per_second']:8.2f} images/s", file=sys.stderr)
+    for mode, result in classify.items():
+        print(
+            f"classify {result['classify_output']['per_second']:8.2f} images/s per image, "
+            f"{result['tag_classifier']['per_second']:8.2f} images/s batched (implications {mode})",
+            file=sys.stderr
+        )
+    print(
+        f"output   {output['captions']['per_second']:8.2f} images/s captions, "
+        f"{output['csv']['per_second']:8.2f} images/s csv",
+        file=sys.stderr
+    )
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+
+        print(f"Compared to {args.compare} ({baseline.get('config', {}).get('commit')}):", file=sys.stderr)
+        _print_comparison(results, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import os
+import random
+
+from typing import Any, NamedTuple
+
+import numpy as np
+
+import torch
+
+import timm
+from timm.models import NaFlexVit
+
+from PIL import Image
+from PIL.ImageCms import ImageCmsProfile, createProfile
+
+from hydra_pool import HydraPool
+from model import _build_model
+
+ARCHITECTURE = "naflexvit_so400m_patch16_siglip+rr_hydra"
+N_TAGS = 7504
+
+# backbone overrides for a model that runs quickly on a CPU, with the same structure
+SHRUNKEN_BACKBONE: dict[str, Any] = { "embed_dim": 384, "depth": 4, "num_heads": 6 }
+
+def synthetic_tags(n_tags: int = N_TAGS) -> list[str]:
+    return [f"tag_{idx}" for idx in range(n_tags)]
+
+def synthetic_metadata(tags: list[str], seed: int = 0) -> dict[str, tuple[int, list[str]]]:
+    """Random categories, and an acyclic implication graph with a few consequents per tag."""
+
+    rng = random.Random(seed)
+    order = list(range(len(tags)))
+    rng.shuffle(order)
+
+    metadata: dict[str, tuple[int, list[str]]] = {}
+    for pos, idx in enumerate(order):
+        later = order[pos + 1:]
+        consequents = rng.sample(later, min(len(later), rng.choice((0, 0, 1, 1, 2, 3))))
+        metadata[tags[idx]] = (rng.choice((0, 3, 4, 5, 7, 8)), [tags[c] for c in consequents])
+
+    return metadata
+
+def synthetic_model(
+    n_tags: int = N_TAGS,
+    *,
+    backbone_args: dict[str, Any] | None = None,
+    head_dim: int = 64,
+    device: torch.device | str | None = None,
+    seed: int = 0,
+) -> tuple[NaFlexVit, list[str]]:
+    """
+    Build a randomly initialized model in inference form, through the same path as `load_model`.
+
+    The backbone may be shrunken with `backbone_args`, such as `SHRUNKEN_BACKBONE`.
+    """
+
+    torch.manual_seed(seed)
+    backbone_args = backbone_args or {}
+
+    backbone = timm.create_model(
+        'naflexvit_so400m_patch16_siglip',
+        pretrained=False, num_classes=0,
+        pos_embed_interp_mode="bilinear",
+        weight_init="", fix_init=False,
+        device="cpu", dtype=torch.bfloat16,
+        **backbone_args,
+    )
+
+    pool = HydraPool(backbone.num_features, head_dim, n_tags, dtype=torch.bfloat16).inference()
+    backbone.attn_pool = pool
+    backbone.head = pool.create_head()
+
+    state_dict = {
+        key: value.contiguous()
+        for key, value in backbone.state_dict().items()
+        if isinstance(value, torch.Tensor)
+    }
+    del backbone, pool
+
+    tags = synthetic_tags(n_tags)
+    metadata = {
+        "modelspec.architecture": ARCHITECTURE,
+        "classifier.labels": "\n".join(tags),
+    }
+
+    return _build_model(metadata, state_dict, device, backbone_args=backbone_args)
+
+class ImageCase(NamedTuple):
+    name: str
+    size: tuple[int, int]
+    format: str
+    mode: str = "RGB"
+    exif_rotation: bool = False
+    icc_profile: bool = False
+
+IMAGE_CASES = (
+    ImageCase("jpeg-small", (512, 384), "JPEG"),
+    ImageCase("jpeg-large", (3000, 2000), "JPEG"),
+    ImageCase("jpeg-exif-rotated", (2000, 1500), "JPEG", exif_rotation=True),
+    ImageCase("jpeg-icc", (1600, 1200), "JPEG", icc_profile=True),
+    ImageCase("png-rgb", (1024, 1024), "PNG"),
+    ImageCase("png-alpha", (1024, 768), "PNG", mode="RGBA"),
+    ImageCase("png-palette", (800, 800), "PNG", mode="P"),
+    ImageCase("png-grayscale", (1200, 900), "PNG", mode="L"),
+    ImageCase("webp", (1280, 720), "WEBP"),
+    ImageCase("webp-alpha", (1000, 1000), "WEBP", mode="RGBA"),
+    ImageCase("wide", (4000, 200), "JPEG"),
+    ImageCase("tall", (150, 3000), "PNG"),
+)
+
+_EXTENSIONS = { "JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp" }
+
+def _pixels(size: tuple[int, int], rng: np.random.Generator) -> np.ndarray:
+    w, h = size
+    y = np.linspace(0.0, 1.0, h, dtype=np.float32)[:, None, None]
+    x = np.linspace(0.0, 1.0, w, dtype=np.float32)[None, :, None]
+    phase = rng.uniform(0.0, 6.28, size=(1, 1, 3)).astype(np.float32)
+
+    # smooth content compresses like a photo, unlike pure noise
+    img = 0.5 + 0.35 * np.sin(x * 7.0 + y * 5.0 + phase)
+    img += rng.normal(0.0, 0.05, size=(h, w, 1)).astype(np.float32)
+    return (np.clip(img, 0.0, 1.0) * 255.0).astype(np.uint8)
+
+def make_image(case: ImageCase, path: str, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    img = Image.fromarray(_pixels(case.size, rng), "RGB")
+
+    match case.mode:
+        case "RGBA":
+            alpha = Image.linear_gradient("L").resize(case.size)
+            img.putalpha(alpha)
+        case "P":
+            img = img.quantize(64)
+        case "L":
+            img = img.convert("L")
+
+    save_args: dict[str, Any] = {}
+    if case.format in ("JPEG", "WEBP"):
+        save_args["quality"] = 90
+
+    if case.exif_rotation:
+        exif = Image.Exif()
+        exif[0x0112] = 6 # rotated 90 degrees clockwise
+        save_args["exif"] = exif
+
+    if case.icc_profile:
+        save_args["icc_profile"] = ImageCmsProfile(createProfile("sRGB")).tobytes()
+
+    img.save(path, format=case.format, **save_args)
+
+def make_images(
+    directory: str,
+    cases: tuple[ImageCase, ...] = IMAGE_CASES,
+    per_case: int = 4,
+    seed: int = 0,
+) -> dict[str, list[str]]:
+    """Write `per_case` images of each case to a directory, returning their paths by case name."""
+
+    os.makedirs(directory, exist_ok=True)
+    paths: dict[str, list[str]] = {}
+
+    for case_idx, case in enumerate(cases):
+        paths[case.name] = []
+
+        for idx in range(per_case):
+            path = os.path.join(directory, f"{case.name}-{idx}{_EXTENSIONS[case.format]}")
+            make_image(case, path, seed=seed * 1000003 + case_idx * 1009 + idx)
+            paths[case.name].append(path)
+
+    return paths
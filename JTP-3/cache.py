@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterable
+
+import torch
+from torch import Tensor
+
+class SpillCache:
+    """
+    LRU cache of tensor dicts within a memory budget.
+
+    Entries evicted from memory are written to a temporary directory and read back
+    on their next access. Once the spilled entries exceed `disk_budget` bytes, the oldest
+    of them are deleted and lost.
+    """
+
+    def __init__(self, budget: int, *, disk_budget: int | None = None, prefix: str = "jtp-cache-") -> None:
+        self.budget = budget
+        self.disk_budget = disk_budget
+        self.prefix = prefix
+
+        self._entries: OrderedDict[str, dict[str, Tensor]] = OrderedDict()
+        self._spilled: dict[str, tuple[str, int]] = {}
+        self._size = 0
+        self._disk_size = 0
+        self._spill_dir: str | None = None
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def disk_size(self) -> int:
+        return self._disk_size
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._spilled)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries or key in self._spilled
+
+    @staticmethod
+    def _nbytes(value: dict[str, Tensor]) -> int:
+        return sum(tensor.nbytes for tensor in value.values())
+
+    def put(self, key: str, value: dict[str, Tensor]) -> None:
+        with self._lock:
+            self._discard(key)
+
+            self._entries[key] = value
+            self._size += self._nbytes(value)
+            self._evict()
+
+    def get(self, key: str) -> dict[str, Tensor] | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+            spilled = self._spilled.pop(key, None)
+            if spilled is None:
+                return None
+
+            path, nbytes = spilled
+            self._disk_size -= nbytes
+
+            self.misses += 1
+            value = torch.load(path, map_location="cpu", weights_only=True)
+            os.remove(path)
+
+            self._entries[key] = value
+            self._size += self._nbytes(value)
+            self._evict(keep=key)
+            return value
+
+    def discard(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._discard(key)
+
+    def close(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._spilled.clear()
+            self._size = 0
+            self._disk_size = 0
+
+            if self._spill_dir is not None:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+                self._spill_dir = None
+
+    def _discard(self, key: str) -> None:
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self._size -= self._nbytes(value)
+
+        spilled = self._spilled.pop(key, None)
+        if spilled is not None:
+            path, nbytes = spilled
+            self._disk_size -= nbytes
+            os.remove(path)
+
+    def _evict(self, keep: str | None = None) -> None:
+        while self._size > self.budget and self._entries:
+            key, value = next(iter(self._entries.items()))
+            if key == keep:
+                if len(self._entries) == 1:
+                    break
+
+                self._entries.move_to_end(key)
+                continue
+
+            del self._entries[key]
+            self._size -= self._nbytes(value)
+
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.mkdtemp(prefix=self.prefix)
+
+            path = os.path.join(self._spill_dir, f"{len(self._spilled)}-{os.urandom(4).hex()}.pt")
+            torch.save(value, path)
+
+            nbytes = os.path.getsize(path)
+            self._spilled[key] = (path, nbytes)
+            self._disk_size += nbytes
+
+        # spilled entries are kept in the order they were written, oldest first
+        while self.disk_budget is not None and self._disk_size > self.disk_budget and self._spilled:
+            self._discard(next(iter(self._spilled)))
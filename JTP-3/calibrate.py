@@ -3,25 +3,70 @@
 
 import argparse
 import csv
+import os
 import sys
+import tempfile
 
-from typing import Any, Callable, Iterable, TypeAlias
+from typing import Any, Callable, Iterable, NamedTuple, TypeAlias
+
+import numpy as np
 
 Metric: TypeAlias = Callable[[str, float, float, float, float, float], float | None]
 Filter: TypeAlias = Callable[[str, float, float, float, float, float, float], bool]
 
+VALIDATION_CACHE_VERSION = 2
+
+class ValidationData(NamedTuple):
+    """
+    Columns of a validation data file, one entry per tag and threshold.
+
+    Rows are grouped by tag in order of first appearance, and sorted by threshold
+    within each tag, so every tag's precision-recall curve is a contiguous range.
+    """
+
+    tags: np.ndarray # unique tag names
+    tag_idx: np.ndarray # index into tags
+    threshold: np.ndarray
+    tp: np.ndarray
+    fp: np.ndarray
+    tn: np.ndarray
+    fn: np.ndarray
+
+# Metrics and filters may have a `vectorized` attribute, which computes the same
+# values over all rows of ValidationData at once, with NaN scores in place of None.
+ArrayMetric: TypeAlias = Callable[[ValidationData], np.ndarray]
+ArrayFilter: TypeAlias = Callable[[ValidationData, np.ndarray], np.ndarray]
+
+def _vectorized(array_fn: Callable[..., np.ndarray]) -> Callable[[Any], Any]:
+    def decorate(fn: Any) -> Any:
+        fn.vectorized = array_fn
+        return fn
+
+    return decorate
+
+def _div(n: np.ndarray, d: np.ndarray, guard: np.ndarray) -> np.ndarray:
+    """Compute `n / d if guard else 0.0` element-wise."""
+    out = np.zeros_like(n)
+    np.divide(n, d, out=out, where=guard != 0.0)
+    return out
+
 def custom_metric(
     tag: str, threshold: float,
     tp: float, fp: float, tn: float, fn: float
 ) -> float | None:
     raise NotImplementedError("Edit this function to define a custom metric.")
 
+def _cti(tp: np.ndarray, fp: np.ndarray, fn: np.ndarray) -> np.ndarray:
+    return _div(tp, tp + fp + fn, tp)
+
+@_vectorized(lambda d: _cti(d.tp, d.fp, d.fn))
 def cti_metric(
     _tag: str, _threshold: float,
     tp: float, fp: float, _tn: float, fn: float
 ) -> float:
     return tp / (tp + fp + fn) if tp else 0.0
 
+@_vectorized(lambda d: (_div(d.tp, d.tp + d.fn, d.tp) + _div(d.tn, d.tn + d.fp, d.tn)) - 1.0)
 def j_metric(
     _tag: str, _threshold: float,
     tp: float, fp: float, tn: float, fn: float
@@ -32,6 +77,11 @@ def j_metric(
         1.0
     )
 
+def _p4(d: ValidationData) -> np.ndarray:
+    n = 4.0 * d.tp * d.tn
+    return _div(n, n + (d.tp + d.tn) * (d.fp + d.fn), n)
+
+@_vectorized(_p4)
 def p4_metric(
     _tag: str, _threshold: float,
     tp: float, fp: float, tn: float, fn: float
@@ -46,6 +96,7 @@ def f_score(beta: float = 1.0) -> Metric:
     w_fn = beta * beta
     w_tp = 1.0 + w_fn
 
+    @_vectorized(lambda d: _cti(d.tp * w_tp, d.fp, d.fn * w_fn))
     def _f_beta_metric(
         tag: str, threshold: float,
         tp: float, fp: float, tn: float, fn: float
@@ -55,6 +106,7 @@ def f_score(beta: float = 1.0) -> Metric:
     return _f_beta_metric
 
 def score_filter(min_score: float) -> Filter:
+    @_vectorized(lambda _d, score: score >= min_score)
     def _score_filter(
         _tag: str, _threshold: float, score: float,
         _tp: float, _fp: float, _tn: float, _fn: float
@@ -63,7 +115,17 @@ def score_filter(min_score: float) -> Filter:
 
     return _score_filter
 
+def _pr_mask(d: ValidationData, min_precision: float, min_recall: float) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mask = (
+            ((d.tp / (d.tp + d.fp)) >= min_precision)
+            & ((d.tp / (d.tp + d.fn)) >= min_recall)
+        )
+
+    return np.where(d.tp == 0.0, min_precision <= 0.0 and min_recall <= 0.0, mask)
+
 def pr_filter(min_precision: float, min_recall: float) -> Filter:
+    @_vectorized(lambda d, _score: _pr_mask(d, min_precision, min_recall))
     def _pr_filter(
         _tag: str, _threshold: float, _score: float,
         tp: float, fp: float, _tn: float, fn: float
@@ -79,6 +141,7 @@ def pr_filter(min_precision: float, min_recall: float) -> Filter:
     return _pr_filter
 
 def threshold_filter(min_threshold: float, max_threshold: float) -> Filter:
+    @_vectorized(lambda d, _score: (min_threshold <= d.threshold) & (d.threshold <= max_threshold))
     def _threshold_filter(
         _tag: str, threshold: float, _score: float,
         _tp: float, _fp: float, _tn: float, _fn: float
@@ -91,6 +154,7 @@ def tag_filter(blocked_tags: Iterable[str]) -> Filter:
     if not isinstance(blocked_tags, set | frozenset):
         blocked_tags = set(blocked_tags)
 
+    @_vectorized(lambda d, _score: ~np.isin(d.tags, list(blocked_tags))[d.tag_idx])
     def _tag_filter(
         tag: str, _threshold: float, _score: float,
         _tp: float, _fp: float, _tn: float, _fn: float
@@ -115,31 +179,173 @@ def apply_filter(metric: Metric, filter_fn: Filter) -> Metric:
 
     return filtered
 
-def calibrate(
-    data_path: str,
-    metric: Metric = cti_metric,
-    filters: Iterable[Filter] = (),
-) -> dict[str, tuple[float, float]]:
-    for f in filters:
-        metric = apply_filter(metric, f)
+def _read_validation_csv(data_path: str) -> ValidationData:
+    tag_idx: list[int] = []
+    columns: list[list[str]] = [[], [], [], [], []]
+    tag_ids: dict[str, int] = {}
 
-    best: dict[str, tuple[float, float]] = {}
     with open(data_path, "r", encoding="utf-8", newline="") as data_file:
-        for row in csv.DictReader(data_file):
-            tag = row["tag"]
-            threshold = float(row["threshold"])
+        reader = csv.reader(data_file)
+        header = next(reader)
+        fields = [header.index(name) for name in ("tag", "threshold", "tp", "fp", "tn", "fn")]
+
+        for row in reader:
+            tag_idx.append(tag_ids.setdefault(row[fields[0]], len(tag_ids)))
+            for column, field in zip(columns, fields[1:]):
+                column.append(row[field])
+
+    data = ValidationData(
+        np.array(list(tag_ids), dtype=np.str_),
+        np.array(tag_idx, dtype=np.int32),
+        *(np.array(column, dtype=np.float64) for column in columns)
+    )
+
+    # stable, so rows with equal thresholds keep their order
+    order = np.lexsort((data.threshold, data.tag_idx))
+    return ValidationData(data.tags, *(column[order] for column in data[1:]))
+
+def load_validation_data(data_path: str) -> ValidationData:
+    """
+    Load a validation data file into columns.
 
-            score = metric(
-                tag, threshold,
-                float(row["tp"]), float(row["fp"]), float(row["tn"]), float(row["fn"]),
+    The columns are cached next to the file as `.npz`, and the cache is
+    reused for as long as the size and modification time of the file match.
+    """
+
+    stat = os.stat(data_path)
+    source = np.array([VALIDATION_CACHE_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    cache_path = data_path + ".npz"
+
+    # a damaged cache, such as one truncated by a crash, is read again from the file
+    try:
+        with np.load(cache_path) as cache:
+            if np.array_equal(cache["source"], source):
+                return ValidationData(*(cache[name] for name in ValidationData._fields))
+    except Exception:
+        pass
+
+    data = _read_validation_csv(data_path)
+
+    # a unique name, so processes writing the cache at once do not write into each other's file
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or ".", prefix=f"{os.path.basename(cache_path)}.", suffix=".tmp")
+    except OSError:
+        return data
+
+    try:
+        with os.fdopen(fd, "wb") as cache_file:
+            np.savez(cache_file, source=source, **data._asdict())
+
+        os.replace(tmp_path, cache_path)
+    except BaseException as ex:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+        if not isinstance(ex, OSError):
+            raise
+
+    return data
+
+def _scores(data: ValidationData, metric: Metric, filters: Iterable[Filter]) -> np.ndarray:
+    array_metric: ArrayMetric | None = getattr(metric, "vectorized", None)
+
+    if array_metric is not None:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = np.asarray(array_metric(data), dtype=np.float64)
+    else:
+        tags = data.tags.tolist()
+        scores = np.array([
+            np.nan if score is None else score
+            for score in (
+                metric(tags[tag_idx], *row)
+                for tag_idx, *row in zip(
+                    data.tag_idx.tolist(), data.threshold.tolist(),
+                    data.tp.tolist(), data.fp.tolist(), data.tn.tolist(), data.fn.tolist()
+                )
             )
+        ], dtype=np.float64)
+
+    valid = ~np.isnan(scores)
+    for filter_fn in filters:
+        array_filter: ArrayFilter | None = getattr(filter_fn, "vectorized", None)
+
+        if array_filter is not None:
+            with np.errstate(invalid="ignore"):
+                valid &= array_filter(data, scores)
+        else:
+            tags = data.tags.tolist()
+            for row in np.flatnonzero(valid).tolist():
+                valid[row] = filter_fn(
+                    tags[data.tag_idx[row]], data.threshold[row].item(), scores[row].item(),
+                    data.tp[row].item(), data.fp[row].item(), data.tn[row].item(), data.fn[row].item()
+                )
+
+    scores[~valid] = np.nan
+    return scores
+
+def _first_in_group(tag_idx: np.ndarray) -> np.ndarray:
+    first = np.ones(len(tag_idx), dtype=np.bool_)
+    first[1:] = tag_idx[1:] != tag_idx[:-1]
+    return first
+
+def calibrate_data(
+    data: ValidationData,
+    metric: Metric = cti_metric,
+    filters: Iterable[Filter] = (),
+) -> dict[str, tuple[float, float]]:
+    if len(data.tag_idx) == 0:
+        return {}
+
+    scores = _scores(data, metric, filters)
+    valid = ~np.isnan(scores)
+    scores[~valid] = -np.inf
+
+    # per tag, the highest score, then the lowest threshold, then the first row,
+    # which is the first row reaching the maximum since rows are sorted by threshold
+    starts = np.flatnonzero(_first_in_group(data.tag_idx))
+    best = np.maximum.reduceat(scores, starts)
+
+    rows = np.flatnonzero(valid & (scores == np.repeat(best, np.diff(starts, append=len(scores)))))
+    best_rows = rows[_first_in_group(data.tag_idx[rows])]
+
+    return {
+        tag: (threshold, score)
+        for tag, threshold, score in zip(
+            data.tags[data.tag_idx[best_rows]].tolist(),
+            data.threshold[best_rows].tolist(),
+            scores[best_rows].tolist(),
+        )
+    }
 
-            if score is not None:
-                tag_best = best.get(tag)
-                if tag_best is None or (score, -threshold) > (tag_best[1], -tag_best[0]):
-                    best[tag] = (threshold, score)
+def calibrate(
+    data_path: str,
+    metric: Metric = cti_metric,
+    filters: Iterable[Filter] = (),
+) -> dict[str, tuple[float, float]]:
+    return calibrate_data(load_validation_data(data_path), metric, filters)
+
+def get_metric(name: str) -> Metric:
+    """Look up a metric by name, as accepted by `--metric`."""
+
+    name = name.lower()
+
+    if name == "custom":
+        return custom_metric
+    elif name in ("ts", "csi", "cti"):
+        return cti_metric
+    elif name in ("j", "bmi"):
+        return j_metric
+    elif name == "p4":
+        return p4_metric
+    elif name.startswith("f"):
+        try:
+            return f_score(float(name[1:]))
+        except ValueError:
+            raise ValueError("Beta for F-score metric must be a positive number.") from None
 
-    return best
+    raise ValueError("Unrecognized metric.")
 
 if __name__ == "__main__":
     def main() -> None:
@@ -184,22 +390,10 @@ if __name__ == "__main__":
         args = parser.parse_args()
         args.metric = args.metric.lower()
 
-        metric: Metric
-        if args.metric == "custom":
-            metric = custom_metric
-        elif args.metric in ("ts", "csi", "cti"):
-            metric = cti_metric
-        elif args.metric in ("j", "bmi"):
-            metric = j_metric
-        elif args.metric == "p4":
-            metric = p4_metric
-        elif args.metric.startswith("f"):
-            try:
-                metric = f_score(float(args.metric[1:]))
-            except ValueError:
-                parser.error("Beta for F-score metric must be a positive number.")
-        else:
-            parser.error("Unrecognized metric.")
+        try:
+            metric = get_metric(args.metric)
+        except ValueError as ex:
+            parser.error(str(ex))
 
         filters: list[Filter] = []
 
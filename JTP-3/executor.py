@@ -0,0 +1,79 @@
+import os
+
+from contextlib import contextmanager, nullcontext
+from queue import SimpleQueue
+from threading import Lock
+from typing import Any, Iterator
+
+import torch
+
+from metrics import metrics
+
+class ModelExecutor:
+    """
+    Bounds how many model calls run at once.
+
+    Each call checks out one of `max_streams` slots for its duration. On CUDA each slot
+    owns a separate stream, so concurrent calls overlap on the device; on the CPU the
+    intra-op thread pool is divided between slots. Model calls made inside a slot must
+    not modify module state, since other slots share the same modules.
+    """
+
+    def __init__(self, device: torch.device | str, max_streams: int = 1) -> None:
+        if max_streams < 1:
+            raise ValueError("At least one stream is required.")
+
+        self.device = torch.device(device)
+        self.max_streams = max_streams
+
+        self._slots: SimpleQueue[Any] = SimpleQueue()
+        self._waiting = 0
+        self._running = 0
+        self._lock = Lock()
+
+        if self.device.type == "cuda":
+            for _ in range(max_streams):
+                self._slots.put(torch.cuda.Stream(self.device))
+        else:
+            if max_streams > 1:
+                n_cores = os.process_cpu_count() if hasattr(os, "process_cpu_count") else os.cpu_count()
+                torch.set_num_threads(max(1, (n_cores or 1) // max_streams))
+
+            for _ in range(max_streams):
+                self._slots.put(None)
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @contextmanager
+    def stream(self) -> Iterator[None]:
+        with self._lock:
+            self._waiting += 1
+
+        try:
+            with metrics.stage("queue"):
+                slot = self._slots.get()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        with self._lock:
+            self._running += 1
+
+        try:
+            with torch.cuda.stream(slot) if slot is not None else nullcontext():
+                yield
+
+            # results may be consumed outside of this stream
+            if slot is not None:
+                slot.synchronize()
+        finally:
+            with self._lock:
+                self._running -= 1
+
+            self._slots.put(slot)
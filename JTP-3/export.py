@@ -0,0 +1,34 @@
+import argparse
+import os
+import sys
+
+from model import HEAD_DTYPES, export_inference_model
+
+if __name__ == "__main__":
+    def main() -> None:
+        parser = argparse.ArgumentParser(
+            description="Export a JTP-3 Hydra model in a precomputed, inference-only form."
+        )
+        parser.add_argument(
+            "-M", "--model", default="models/jtp-3-hydra.safetensors",
+            help="Path to model file. (Default: models/jtp-3-hydra.safetensors)"
+        )
+        parser.add_argument(
+            "-o", "--output", default="models/jtp-3-hydra-inference.safetensors",
+            help="Path to output model file. (Default: models/jtp-3-hydra-inference.safetensors)"
+        )
+        parser.add_argument(
+            "--head-dtype", choices=HEAD_DTYPES, default="bf16",
+            help="Storage type for classifier head weights in the file. They are converted back to bf16 on load, so this only changes the file size. (Default: bf16)"
+        )
+
+        args = parser.parse_args()
+
+        if os.path.abspath(args.model) == os.path.abspath(args.output):
+            parser.error("--output must be different from --model")
+
+        print(f"Exporting {repr(args.model)} to {repr(args.output)} ...", end="", file=sys.stderr)
+        export_inference_model(args.model, args.output, head_dtype=args.head_dtype)
+        print(f" {os.path.getsize(args.output) / (1024 * 1024):.0f} MiB", file=sys.stderr)
+
+    main()
@@ -0,0 +1,177 @@
+import csv
+import json
+import os
+
+from typing import Any, Iterable, Iterator, Self
+
+import numpy as np
+
+import torch
+from torch import Tensor
+
+FEATURE_STORE_VERSION = 1
+
+class FeatureStore:
+    """
+    Append-only store of backbone token features, memory-mapped for reading.
+
+    Only the valid (non-padding) tokens of each image are stored, so an entry
+    occupies `length * dim` bfloat16 values in `tokens.bin`. The index maps each
+    source path to its row offset and length.
+    """
+
+    def __init__(self, path: str, mode: str = "r", *, dim: int | None = None, model: str = "") -> None:
+        if mode not in ("r", "w", "a"):
+            raise ValueError(f"Invalid feature store mode: {mode}")
+
+        self.path = path
+        self.mode = mode
+
+        self._paths: list[str] = []
+        self._offsets: list[int] = []
+        self._lengths: list[int] = []
+        self._rows = 0
+
+        self._tokens: np.ndarray | None = None
+        self._tokens_file: Any = None
+        self._index_file: Any = None
+        self._index_writer: Any = None
+
+        meta_path = os.path.join(path, "meta.json")
+        if mode == "w" or (mode == "a" and not os.path.exists(meta_path)):
+            if dim is None:
+                raise ValueError("Feature dimension is required to create a feature store.")
+
+            os.makedirs(path, exist_ok=True)
+            self.meta = {
+                "version": FEATURE_STORE_VERSION,
+                "dim": dim,
+                "dtype": "bfloat16",
+                "model": model,
+            }
+
+            with open(meta_path, "w", encoding="utf-8") as file:
+                json.dump(self.meta, file)
+
+            open(os.path.join(path, "tokens.bin"), "wb").close()
+            with open(os.path.join(path, "index.csv"), "w", encoding="utf-8", newline="") as file:
+                csv.writer(file).writerow(("path", "offset", "length"))
+        else:
+            with open(meta_path, "r", encoding="utf-8") as file:
+                self.meta = json.load(file)
+
+            if self.meta.get("version") != FEATURE_STORE_VERSION:
+                raise RuntimeError(f"Unsupported feature store version: {self.meta.get('version')}")
+
+            if dim is not None and dim != self.meta["dim"]:
+                raise RuntimeError(f"Feature store has dimension {self.meta['dim']}, but expected {dim}.")
+
+            with open(os.path.join(path, "index.csv"), "r", encoding="utf-8", newline="") as file:
+                for row in csv.DictReader(file):
+                    self._paths.append(row["path"])
+                    self._offsets.append(int(row["offset"]))
+                    self._lengths.append(int(row["length"]))
+
+            if self._offsets:
+                self._rows = self._offsets[-1] + self._lengths[-1]
+
+        self.dim: int = self.meta["dim"]
+
+        if mode != "r":
+            self._tokens_file = open(os.path.join(path, "tokens.bin"), "r+b")
+            self._tokens_file.seek(self._rows * self.dim * 2)
+            self._tokens_file.truncate()
+
+            self._index_file = open(
+                os.path.join(path, "index.csv"), "a",
+                encoding="utf-8", newline=""
+            )
+            self._index_writer = csv.writer(self._index_file)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        self.close()
+
+    @property
+    def paths(self) -> list[str]:
+        return self._paths
+
+    def append(self, path: str, tokens: Tensor) -> None:
+        if self._tokens_file is None:
+            raise RuntimeError("Feature store is not open for writing.")
+
+        if tokens.ndim != 2 or tokens.size(1) != self.dim:
+            raise ValueError(f"Expected tokens of shape (length, {self.dim}), but got {tuple(tokens.shape)}.")
+
+        data = tokens.detach().to(device="cpu", dtype=torch.bfloat16).contiguous()
+        self._tokens_file.write(data.view(torch.int16).numpy().tobytes())
+
+        self._index_writer.writerow((path, self._rows, data.size(0)))
+        self._paths.append(path)
+        self._offsets.append(self._rows)
+        self._lengths.append(data.size(0))
+        self._rows += data.size(0)
+
+        self._tokens = None
+
+    def flush(self) -> None:
+        if self._tokens_file is not None:
+            self._tokens_file.flush()
+            self._index_file.flush()
+
+    def _mapped(self) -> np.ndarray:
+        if self._tokens is None:
+            self.flush()
+
+            if self._rows:
+                self._tokens = np.memmap(
+                    os.path.join(self.path, "tokens.bin"),
+                    dtype=np.int16, mode="r",
+                    shape=(self._rows, self.dim)
+                )
+            else:
+                self._tokens = np.empty((0, self.dim), dtype=np.int16)
+
+        return self._tokens
+
+    def get(self, idx: int) -> Tensor:
+        offset = self._offsets[idx]
+        tokens = self._mapped()[offset:offset + self._lengths[idx]]
+        return torch.from_numpy(np.array(tokens)).view(torch.bfloat16)
+
+    def get_batch(self, idxs: Iterable[int]) -> tuple[Tensor, Tensor]:
+        idxs = list(idxs)
+        seqlen = max((self._lengths[idx] for idx in idxs), default=0)
+
+        tokens = torch.zeros(len(idxs), seqlen, self.dim, dtype=torch.int16)
+        valid = torch.zeros(len(idxs), seqlen, dtype=torch.bool)
+
+        mapped = self._mapped()
+        for row, idx in enumerate(idxs):
+            offset, length = self._offsets[idx], self._lengths[idx]
+            tokens[row, :length] = torch.from_numpy(np.array(mapped[offset:offset + length]))
+            valid[row, :length] = True
+
+        return tokens.view(torch.bfloat16), valid
+
+    def batches(self, batch_size: int) -> Iterator[tuple[list[str], Tensor, Tensor]]:
+        for start in range(0, len(self._paths), batch_size):
+            idxs = range(start, min(start + batch_size, len(self._paths)))
+            yield [self._paths[idx] for idx in idxs], *self.get_batch(idxs)
+
+    def close(self) -> None:
+        self._tokens = None
+
+        if self._tokens_file is not None:
+            self._tokens_file.close()
+            self._tokens_file = None
+
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+            self._index_writer = None
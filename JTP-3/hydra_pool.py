@@ -1,7 +1,8 @@
 import re
-from collections import defaultdict
 from math import sqrt
-from typing import Any, Iterable, Self, cast
+from typing import Any, Iterable, Self
+
+import numpy as np
 
 import torch
 from torch import Tensor
@@ -66,38 +67,49 @@ class IndexedAdd(Module):
                     destination[index_key] = index.to(dtype=torch.uint16)
 
     @torch.no_grad()
-    def load_indices(self, indices: Iterable[tuple[int, int]], *, mean: bool = False) -> None:
-        if mean:
-            if self.weight is None:
-                raise ValueError("No weights to initialize with means.")
-
-            groups: dict[int, list[int]] = defaultdict(list)
-
-        idx = -1
-        for idx, (src, dst) in enumerate(indices):
-            self.index[0, idx] = src
-            self.index[1, idx] = dst
+    def load_indices(
+        self,
+        indices: Iterable[tuple[int, int]] | Tensor | np.ndarray,
+        *,
+        mean: bool = False
+    ) -> None:
+        if mean and self.weight is None:
+            raise ValueError("No weights to initialize with means.")
+
+        # arrays share the (2, n) layout of the index buffer, iterables yield pairs
+        if isinstance(indices, Tensor | np.ndarray):
+            index = torch.as_tensor(indices, device="cpu")
+            if index.ndim != 2 or index.size(0) != 2:
+                raise ValueError(f"Expected indices of shape (2, n), but got {tuple(index.shape)}.")
+        else:
+            index = torch.tensor(list(indices), device="cpu", dtype=torch.int64).view(-1, 2).T
 
-            if mean:
-                groups[dst].append(idx)
+        if index.size(1) != self.index.size(1):
+            raise IndexError(f"Expected {self.index.size(1)} indices, but got {index.size(1)}.")
 
-        if (idx + 1) != self.index.size(1):
-            raise IndexError(f"Expected {self.index.size(1)} indices, but got {idx + 1}.")
+        index = index.to(dtype=torch.int64)
+        self.index.copy_(index)
 
         if not mean:
             return
 
         assert self.weight is not None
 
-        for idxs in groups.values():
-            if len(idxs) < 2:
-                continue
+        counts = torch.bincount(index[1])[index[1]]
+        idxs = (counts >= 2).nonzero().squeeze(1)
+        if idxs.numel() == 0:
+            return
 
-            self.weight.index_fill_(
-                self.dim,
-                torch.tensor(idxs, device=self.weight.device, dtype=torch.int64),
-                1.0 / len(idxs)
-            )
+        shape = [1] * self.weight.ndim
+        shape[self.dim] = -1
+
+        means = counts[idxs].double().reciprocal().to(dtype=self.weight.dtype).view(shape)
+        idxs = idxs.to(device=self.weight.device)
+
+        self.weight.index_copy_(
+            self.dim, idxs,
+            means.to(device=self.weight.device).expand_as(self.weight.index_select(self.dim, idxs))
+        )
 
     def forward(self, dst: Tensor, src: Tensor) -> Tensor:
         src = src.index_select(self.dim, self.index[0])
@@ -149,15 +161,24 @@ class BatchLinear(Module):
 
         self.bias_inplace = bias_inplace
 
-    def forward(self, x: Tensor) -> Tensor:
+    def forward(self, x: Tensor, index: Tensor | None = None) -> Tensor:
+        weight = self.weight
+        bias = self.bias
+
+        if index is not None: # select along the first batch dimension
+            weight = weight.index_select(0, index)
+
+            if bias is not None:
+                bias = bias.index_select(0, index)
+
         # ... B... 1 I @ B... I O -> ... B... O
-        x = torch.matmul(x.unsqueeze(-2), self.weight).squeeze(-2)
+        x = torch.matmul(x.unsqueeze(-2), weight).squeeze(-2)
 
-        if self.bias is not None:
+        if bias is not None:
             if self.bias_inplace:
-                x.add_(self.bias)
+                x.add_(bias)
             else:
-                x = x + self.bias
+                x = x + bias
 
         if self.flatten:
             x = x.flatten(self.flatten)
@@ -226,21 +247,28 @@ class _MidBlock(Module):
             device=device, dtype=dtype
         )
 
-    def _forward_q(self, x: Tensor) -> Tensor:
+    def _forward_q(self, x: Tensor, classes: Tensor | None) -> Tensor:
         x = self.q_proj(x)
 
+        q_cls = self.q_cls if classes is None else self.q_cls.index_select(0, classes)
+
         if self.q_cls_inplace:
-            x.add_(self.q_cls)
+            x.add_(q_cls)
         else:
-            x = x + self.q_cls
+            x = x + q_cls
 
         x = self.q_norm(x)
         x = rearrange(x, "... s (h e) -> ... h s e", e=self.head_dim)
         return x
 
-    def _forward_attn(self, x: Tensor, k: Tensor, v: Tensor, attn_mask: Tensor | None) -> Tensor:
+    def _forward_attn(
+        self,
+        x: Tensor, k: Tensor, v: Tensor,
+        attn_mask: Tensor | None,
+        classes: Tensor | None,
+    ) -> Tensor:
         a = scaled_dot_product_attention(
-            self._forward_q(x), k, v,
+            self._forward_q(x, classes), k, v,
             attn_mask=attn_mask
         )
         a = rearrange(a, "... h s e -> ... s (h e)")
@@ -255,8 +283,13 @@ class _MidBlock(Module):
         f = self.ff_out(f)
         return x + f
 
-    def forward(self, x: Tensor, k: Tensor, v: Tensor, attn_mask: Tensor | None = None) -> Tensor:
-        x = self._forward_attn(x, k, v, attn_mask)
+    def forward(
+        self,
+        x: Tensor, k: Tensor, v: Tensor,
+        attn_mask: Tensor | None = None,
+        classes: Tensor | None = None,
+    ) -> Tensor:
+        x = self._forward_attn(x, k, v, attn_mask, classes)
         x = self._forward_ff(x)
         return x
 
@@ -453,8 +486,17 @@ class HydraPool(Module):
             case True:
                 return self.q
 
-    def _forward_attn(self, x: Tensor, attn_mask: Tensor | None) -> tuple[Tensor, Tensor, Tensor]:
-        q = self._forward_q().expand(*x.shape[:-2], -1, -1, -1)
+    def _forward_attn(
+        self,
+        x: Tensor,
+        attn_mask: Tensor | None,
+        classes: Tensor | None = None,
+    ) -> tuple[Tensor, Tensor, Tensor]:
+        q = self._forward_q()
+        if classes is not None:
+            q = q.index_select(-2, classes)
+
+        q = q.expand(*x.shape[:-2], -1, -1, -1)
 
         x = self.kv(x)
         k, v = rearrange(x, "... s (n h e) -> n ... h s e", n=2, e=self.head_dim).unbind(0)
@@ -474,19 +516,24 @@ class HydraPool(Module):
         f = self.ff_out(f)
         return x + f
 
-    def _forward_out(self, x: Tensor) -> Tensor:
-        x = self.out_proj(x)
+    def _forward_out(self, x: Tensor, classes: Tensor | None = None) -> Tensor:
+        x = self.out_proj(x, classes)
         x = self.out_act(x)
         return x
 
-    def forward(self, x: Tensor, attn_mask: Tensor | None = None) -> Tensor:
-        x, k, v = self._forward_attn(x, attn_mask)
+    def forward(
+        self,
+        x: Tensor,
+        attn_mask: Tensor | None = None,
+        classes: Tensor | None = None,
+    ) -> Tensor:
+        x, k, v = self._forward_attn(x, attn_mask, classes)
         x = self._forward_ff(x)
 
         for block in self.mid_blocks:
-            x = block(x, k, v, attn_mask)
+            x = block(x, k, v, attn_mask, classes)
 
-        x = self._forward_out(x)
+        x = self._forward_out(x, classes)
         return x
 
     def prune_roots(self, retain_classes: set[int]) -> tuple[list[int], list[int]]:
@@ -496,39 +543,26 @@ class HydraPool(Module):
         if self.clscls is not None:
             raise TypeError("Subclass roots cannot be pruned.")
 
-        used_roots: set[int] = set()
-        used_clsroots: list[int] = []
-
         assert self.clsroots is not None
-        clsroots = [
-            cast(list[int], clsroot.tolist())
-            for clsroot in self.clsroots.index.cpu().unbind(1)
-        ]
-
-        for idx, (src, dest) in enumerate(clsroots):
-            if dest in retain_classes:
-                used_roots.add(src)
-                used_clsroots.append(idx)
-
-        sorted_roots = sorted(used_roots)
-        del used_roots
-
-        rootmap = {
-            root: idx
-            for idx, root in enumerate(sorted_roots)
-        }
-
-        clsmap = {
-            cls: idx
-            for idx, cls in enumerate(sorted(retain_classes))
-        }
-
-        for idx in used_clsroots:
-            src, dest = clsroots[idx]
-            self.clsroots.index[0, idx] = rootmap[src]
-            self.clsroots.index[1, idx] = clsmap[dest]
-
-        return sorted_roots, used_clsroots
+        index = self.clsroots.index.to(device="cpu", dtype=torch.int64)
+
+        retain = torch.tensor(sorted(retain_classes), dtype=torch.int64)
+        used_clsroots = torch.isin(index[1], retain).nonzero().squeeze(1)
+
+        src = index[0, used_clsroots]
+        dest = index[1, used_clsroots]
+
+        sorted_roots = src.unique(sorted=True)
+
+        buffer = self.clsroots.index
+        with torch.no_grad():
+            pruned = torch.stack((
+                torch.searchsorted(sorted_roots, src),
+                torch.searchsorted(retain, dest),
+            ))
+            buffer[:, used_clsroots.to(device=buffer.device)] = pruned.to(device=buffer.device, dtype=buffer.dtype)
+
+        return sorted_roots.tolist(), used_clsroots.tolist()
 
     @staticmethod
     def for_state(
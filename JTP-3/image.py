@@ -17,6 +17,8 @@ from PIL.ImageCms import (
 )
 from PIL.ImageOps import exif_transpose
 
+from metrics import metrics
+
 try:
     import pillow_jxl
 except ImportError:
@@ -86,12 +88,13 @@ def process_srgb(
     crop: Callable[[tuple[int, int]], tuple[int, int, int, int] | None] | tuple[int, int, int, int] | None = None,
     expect: tuple[int, int] | None = None,
 ) -> Image:
-    img.load()
+    with metrics.stage("decode"):
+        img.load()
 
-    try:
-        exif_transpose(img, in_place=True)
-    except Exception:
-        pass # corrupt EXIF metadata is fine
+        try:
+            exif_transpose(img, in_place=True)
+        except Exception:
+            pass # corrupt EXIF metadata is fine
 
     size = (img.width, img.height)
 
@@ -102,61 +105,62 @@ def process_srgb(
         )
 
     if (icc_raw := img.info.get("icc_profile")) is not None:
-        cms_info: dict[str, Any] = {
-            "native_mode": img.mode,
-            "transparency": img.has_transparency_data,
-        }
+        with metrics.stage("icc"):
+            cms_info: dict[str, Any] = {
+                "native_mode": img.mode,
+                "transparency": img.has_transparency_data,
+            }
 
-        try:
-            profile = ImageCmsProfile(BytesIO(icc_raw))
-            _add_info(cms_info, profile.profile, "profile_description")
-            _add_info(cms_info, profile.profile, "target")
-            _add_info(cms_info, profile.profile, "xcolor_space")
-            _add_info(cms_info, profile.profile, "connection_space")
-            _add_info(cms_info, profile.profile, "colorimetric_intent")
-            _add_info(cms_info, profile.profile, "rendering_intent")
-
-            working_mode = img.mode
-            if img.mode.startswith(("RGB", "BGR", "P")):
-                working_mode = "RGBA" if img.has_transparency_data else "RGB"
-            elif img.mode.startswith(("L", "I", "F")) or img.mode == "1":
-                working_mode = "LA" if img.has_transparency_data else "L"
-
-            if img.mode != working_mode:
-                cms_info["working_mode"] = working_mode
-                img = img.convert(working_mode)
-
-            mode = "RGBA" if img.has_transparency_data else "RGB"
-
-            intent = Intent.RELATIVE_COLORIMETRIC
-            if isIntentSupported(profile, intent, Direction.INPUT) != 1:
-                intent = _coalesce_intent(getDefaultIntent(profile))
-
-            cms_info["conversion_intent"] = intent
-
-            if (flags := _INTENT_FLAGS.get(intent)) is None:
-                raise RuntimeError("Unsupported intent")
-
-            if img.mode == mode:
-                profileToProfile(
-                    img,
-                    profile,
-                    _SRGB,
-                    renderingIntent=intent,
-                    inPlace=True,
-                    flags=flags
-                )
-            else:
-                img = cast(Image, profileToProfile(
-                    img,
-                    profile,
-                    _SRGB,
-                    renderingIntent=intent,
-                    outputMode=mode,
-                    flags=flags
-                ))
-        except Exception as ex:
-            pass
+            try:
+                profile = ImageCmsProfile(BytesIO(icc_raw))
+                _add_info(cms_info, profile.profile, "profile_description")
+                _add_info(cms_info, profile.profile, "target")
+                _add_info(cms_info, profile.profile, "xcolor_space")
+                _add_info(cms_info, profile.profile, "connection_space")
+                _add_info(cms_info, profile.profile, "colorimetric_intent")
+                _add_info(cms_info, profile.profile, "rendering_intent")
+
+                working_mode = img.mode
+                if img.mode.startswith(("RGB", "BGR", "P")):
+                    working_mode = "RGBA" if img.has_transparency_data else "RGB"
+                elif img.mode.startswith(("L", "I", "F")) or img.mode == "1":
+                    working_mode = "LA" if img.has_transparency_data else "L"
+
+                if img.mode != working_mode:
+                    cms_info["working_mode"] = working_mode
+                    img = img.convert(working_mode)
+
+                mode = "RGBA" if img.has_transparency_data else "RGB"
+
+                intent = Intent.RELATIVE_COLORIMETRIC
+                if isIntentSupported(profile, intent, Direction.INPUT) != 1:
+                    intent = _coalesce_intent(getDefaultIntent(profile))
+
+                cms_info["conversion_intent"] = intent
+
+                if (flags := _INTENT_FLAGS.get(intent)) is None:
+                    raise RuntimeError("Unsupported intent")
+
+                if img.mode == mode:
+                    profileToProfile(
+                        img,
+                        profile,
+                        _SRGB,
+                        renderingIntent=intent,
+                        inPlace=True,
+                        flags=flags
+                    )
+                else:
+                    img = cast(Image, profileToProfile(
+                        img,
+                        profile,
+                        _SRGB,
+                        renderingIntent=intent,
+                        outputMode=mode,
+                        flags=flags
+                    ))
+            except Exception as ex:
+                pass
 
     if img.has_transparency_data:
         if img.mode != "RGBa":
@@ -178,12 +182,14 @@ def process_srgb(
         resize = resize(size)
 
     if resize is not None and size != resize:
-        img = img.resize(
-            resize,
-            Resampling.LANCZOS,
-            box=crop,
-            reducing_gap=3.0
-        )
+        with metrics.stage("resize"):
+            img = img.resize(
+                resize,
+                Resampling.LANCZOS,
+                box=crop,
+                reducing_gap=3.0
+            )
+
         crop = None
 
     if crop is not None:
@@ -191,6 +197,68 @@ def process_srgb(
 
     return img
 
+FRAME_SAMPLING = ("even", "scene")
+
+# decoded pixels allowed per animation, about 16 frames of 1024x1024
+FRAME_PIXEL_BUDGET = 16 * 1024 * 1024
+
+def _frame_signature(frame: Image) -> np.ndarray:
+    return np.asarray(frame.convert("L").resize((32, 32), Resampling.BOX), dtype=np.float32)
+
+def sample_frames(
+    img: Image,
+    count: int,
+    *,
+    sampling: str = "even",
+    max_pixels: int = FRAME_PIXEL_BUDGET,
+) -> list[Image]:
+    """
+    Decode up to `count` frames of an animated image, returning copies in frame order.
+
+    With "even" sampling, the frames are the centers of `count` equal spans, so a blank
+    first frame or title card is skipped. With "scene" sampling, three times as many
+    evenly spaced candidates are decoded, and the ones that differ most from their
+    predecessor are kept. A still image returns itself.
+
+    Seeking decodes every frame before its target, so the frames are sampled from the
+    first frames of the animation that fit in `max_pixels` pixels. Long or large
+    animations are therefore sampled from their beginning, with fewer frames if even
+    `count` do not fit.
+    """
+
+    if sampling not in FRAME_SAMPLING:
+        raise ValueError(f"Unrecognized frame sampling: {sampling}")
+
+    n_frames = getattr(img, "n_frames", 1)
+    if n_frames <= 1 or count <= 1:
+        return [img]
+
+    # every frame up to the last target is decoded, not only the ones kept
+    span = min(n_frames, max(1, max_pixels // max(1, img.width * img.height)))
+    count = min(count, span)
+
+    n_candidates = min(span, count * 3) if sampling == "scene" else count
+    idxs = [(2 * idx + 1) * span // (2 * n_candidates) for idx in range(n_candidates)]
+
+    frames: list[Image] = []
+    for idx in idxs:
+        img.seek(idx)
+        frames.append(img.copy())
+
+    img.seek(0)
+
+    if len(frames) > count:
+        signatures = [_frame_signature(frame) for frame in frames]
+        changes = [float("inf")] + [
+            float(np.abs(signatures[idx] - signatures[idx - 1]).mean())
+            for idx in range(1, len(frames))
+        ]
+
+        keep = sorted(sorted(range(len(frames)), key=lambda idx: changes[idx], reverse=True)[:count])
+        frames = [frames[idx] for idx in keep]
+
+    return frames
+
 def put_srgb(img: Image, tensor: Tensor) -> None:
     if img.mode not in ("RGB", "RGBA", "RGBa"):
         raise ValueError(f"Image has non-RGB mode {img.mode}.")
@@ -227,6 +295,26 @@ def put_srgb_patch(
     np.copyto(patch_coord[:n].numpy(), coords, casting="no")
     patch_valid[:n] = True
 
+def get_srgb_patch(
+    patch_data: Tensor,
+    patch_coord: Tensor,
+    patch_size: int
+) -> Image:
+    """Reassemble an RGB image from valid patches, the inverse of `put_srgb_patch`."""
+
+    coords = patch_coord.numpy().astype(np.intp)
+    h = int(coords[:, 0].max()) + 1
+    w = int(coords[:, 1].max()) + 1
+
+    patches = np.zeros((h, w, patch_data.size(1)), dtype=np.uint8)
+    patches[coords[:, 0], coords[:, 1]] = patch_data.numpy()
+
+    return image.fromarray(rearrange(
+        patches,
+        "h w (p1 p2 c) -> (h p1) (w p2) c",
+        p1=patch_size, p2=patch_size
+    ), "RGB")
+
 def unpatchify(seq: Tensor, coords: Tensor, valid: Tensor) -> Tensor:
     """
     Scatter valid patches from (seqlen, ...) to (H, W, ...), using coords and valid mask.
@@ -3,19 +3,38 @@
 
 import argparse
 import csv
+import hashlib
+import json
 import os
 import random
+import socket
+import socketserver
 import sys
 
-from typing import Any, Callable, Iterable, TypeAlias
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import SimpleQueue
+from threading import Thread
+from time import perf_counter
+from typing import Any, Callable, Iterable, Iterator, Mapping, TypeAlias, TypeVar
+
+import numpy as np
 
 import torch
 from torch import Tensor
 
 from timm.models import NaFlexVit
 
+from features import FeatureStore
 from loader import Loader
-from model import load_model, load_image
+from metrics import device_memory, metrics, process_memory
+from profiling import BatchProfiler
+from tagclient import DEFAULT_SOCKET
+from watch import FolderWatcher
+from tagtable import TagTable, load_tag_table
+from image import FRAME_SAMPLING
+from model import FRAME_REDUCTIONS, load_model, load_models, load_image, prepare_batch, reduce_frames
 
 try:
     from itertools import batched
@@ -28,9 +47,15 @@ except ImportError:
         while batch := tuple(islice(it, n)):
             yield batch
 
-Metadata: TypeAlias = dict[str, tuple[int, list[str]]]
+Metadata: TypeAlias = Mapping[str, tuple[int, list[str]]]
 Thresholds: TypeAlias = dict[str, float] | float
 
+# paths, per-row patches, coords and valid masks, and the number of rows (frames) of each path
+Batch: TypeAlias = tuple[list[str], list[Tensor], list[Tensor], list[Tensor], list[int]]
+
+T = TypeVar("T")
+R = TypeVar("R")
+
 PATCH_SIZE = 16
 
 TAG_CATEGORIES = {
@@ -131,6 +156,162 @@ def classify_output(
 
     return labels
 
+def _implication_closure(tags: list[str], metadata: Metadata) -> tuple[list[int], list[int]]:
+    """Return (antecedent, consequent) index pairs for all direct and indirect implications."""
+
+    tag_idx = { tag: idx for idx, tag in enumerate(tags) }
+    descendants: dict[str, set[str]] = {}
+
+    def closure(tag: str) -> set[str]:
+        result = descendants.get(tag)
+        if result is None:
+            result = set()
+            for consequent in metadata[tag][1] if tag in metadata else ():
+                result.add(consequent)
+                result |= closure(consequent)
+
+            descendants[tag] = result
+
+        return result
+
+    antecedents: list[int] = []
+    consequents: list[int] = []
+    for tag in tags:
+        for consequent in closure(tag):
+            idx = tag_idx.get(consequent)
+            if idx is not None:
+                antecedents.append(tag_idx[tag])
+                consequents.append(idx)
+
+    return antecedents, consequents
+
+def _table_closure(tags: list[str], table: TagTable, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """`_implication_closure` from the precomputed closure of a `TagTable`, given the table row of every tag."""
+
+    model_idx = np.full(len(table), -1, dtype=np.int64)
+    model_idx[rows] = np.arange(len(tags))
+
+    # gather every row's slice of the closure at once
+    starts = table.closure_ptr[rows].astype(np.int64)
+    counts = table.closure_ptr[rows + 1] - starts
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    antecedents = np.repeat(np.arange(len(tags)), counts)
+    consequents = model_idx[table.closure_idx[np.repeat(starts, counts) + offsets]]
+
+    kept = consequents >= 0
+    return antecedents[kept], consequents[kept]
+
+class TagClassifier:
+    """
+    Batched equivalent of `classify_output`.
+
+    Thresholds and excluded categories are compiled into one tensor of per-tag
+    thresholds in model tag order, and implications into index pairs of their
+    transitive closure, so a `(batch, n_tags)` output is classified with a few
+    tensor operations on its device. Only the surviving tags are copied back.
+    With a `TagTable` as metadata, the closure is read from the table instead of
+    being walked tag by tag.
+    """
+
+    def __init__(
+        self,
+        tags: list[str],
+        threshold: Thresholds = 0.0,
+        *,
+        metadata: Metadata = {},
+        implications: str = "off",
+        exclude_categories: set[int] | frozenset[int] = frozenset(),
+        exclude_tags: Iterable[str] = (),
+        device: torch.device | str | None = None,
+    ) -> None:
+        if implications not in IMPLICATION_MODES:
+            raise ValueError("Invalid implications mode.")
+
+        self.tags = tags
+        self.implications = implications
+
+        if isinstance(threshold, dict):
+            thresholds = np.array([threshold.get(tag, np.inf) for tag in tags], dtype=np.float64)
+        else:
+            thresholds = np.full(len(tags), threshold, dtype=np.float64)
+
+        table = metadata if isinstance(metadata, TagTable) and all(tag in metadata for tag in tags) else None
+        rows = np.array([table.index(tag) for tag in tags], dtype=np.int64) if table is not None else None
+
+        if exclude_categories and table is not None and rows is not None:
+            thresholds[np.isin(table.categories[rows], list(exclude_categories))] = np.inf
+        elif exclude_categories:
+            thresholds[[
+                idx for idx, tag in enumerate(tags)
+                if metadata[tag][0] in exclude_categories
+            ]] = np.inf
+
+        exclude_tags = set(exclude_tags)
+        if exclude_tags:
+            thresholds[[idx for idx, tag in enumerate(tags) if tag in exclude_tags]] = np.inf
+
+        # round up, so float32 outputs compare the same as they would against the float64 thresholds
+        thresholds_f32 = thresholds.astype(np.float32)
+        low = thresholds_f32 < thresholds
+        thresholds_f32[low] = np.nextafter(thresholds_f32[low], np.float32(np.inf))
+        self.thresholds = torch.from_numpy(thresholds_f32).to(device=device)
+
+        self._antecedents: Tensor | None = None
+        self._consequents: Tensor | None = None
+        if implications != "off" and metadata:
+            if table is not None and rows is not None:
+                antecedents, consequents = _table_closure(tags, table, rows)
+            else:
+                antecedents, consequents = _implication_closure(tags, metadata)
+
+            if len(antecedents):
+                self._antecedents = torch.as_tensor(antecedents, dtype=torch.int64).to(device=device)
+                self._consequents = torch.as_tensor(consequents, dtype=torch.int64).to(device=device)
+
+    def __call__(self, output: Tensor) -> list[dict[str, float]]:
+        output = output.float()
+        antecedents, consequents = self._antecedents, self._consequents
+
+        if antecedents is not None and consequents is not None:
+            batch_size = output.size(0)
+
+            match self.implications:
+                case "inherit":
+                    # each tag takes the highest probability of any tag implying it
+                    output = output.scatter_reduce(
+                        1, consequents.expand(batch_size, -1),
+                        output[:, antecedents], "amax"
+                    )
+
+                case "constrain" | "constrain-remove":
+                    # each tag takes the lowest probability of any tag it implies
+                    output = output.scatter_reduce(
+                        1, antecedents.expand(batch_size, -1),
+                        output[:, consequents], "amin"
+                    )
+
+        keep = output >= self.thresholds
+
+        if (
+            antecedents is not None and consequents is not None
+            and self.implications in ("remove", "constrain-remove")
+        ):
+            implied = torch.zeros_like(keep, dtype=torch.uint8).scatter_reduce(
+                1, consequents.expand(keep.size(0), -1),
+                keep[:, antecedents].to(dtype=torch.uint8), "amax"
+            )
+            keep &= implied == 0
+
+        rows, cols = keep.nonzero(as_tuple=True)
+        values = output[rows, cols].tolist()
+
+        labels: list[dict[str, float]] = [{} for _ in range(output.size(0))]
+        for row, col, value in zip(rows.tolist(), cols.tolist(), values):
+            labels[row][self.tags[col]] = value
+
+        return labels
+
 def _run_interactive(
     *,
     model: NaFlexVit,
@@ -259,12 +440,7 @@ def _run_interactive(
             print(ex)
             continue
 
-        p_d = p_t.unsqueeze(0).to(device=device, non_blocking=True)
-        pc_d = pc_t.unsqueeze(0).to(device=device, non_blocking=True)
-        pv_d = pv_t.unsqueeze(0).to(device=device, non_blocking=True)
-
-        p_d = p_d.to(dtype=torch.bfloat16).div_(127.5).sub_(1.0)
-        pc_d = pc_d.to(dtype=torch.int32)
+        p_d, pc_d, pv_d = prepare_batch([p_t], [pc_t], [pv_t], device)
 
         o_d = model(p_d, pc_d, pv_d).float().sigmoid()
         del p_d, pc_d, pv_d
@@ -282,109 +458,639 @@ def _run_interactive(
         del o_d
         del p_t, pc_t, pv_t
 
-def _run_batched(
+def _output_writer(
     *,
-    model: NaFlexVit,
     tags: list[str],
-    paths: list[str],
-    recursive: bool,
-    metadata: dict[str, tuple[int, list[str]]],
+    metadata: Metadata,
     implications: str,
     exclude: set[int],
-    threshold: dict[str, float] | float,
+    threshold: Thresholds,
     writer: Any,
     prefix: str,
+    device: str,
+) -> Callable[[list[str], Tensor], None]:
+    classifier = TagClassifier(
+        tags, threshold,
+        metadata=metadata, implications=implications, exclude_categories=exclude,
+        device=device,
+    ) if writer is None else None
+
+    def write_output(paths: list[str], outputs: Tensor) -> None:
+        if classifier is None:
+            for path, output in zip(paths, outputs.cpu()):
+                writer.writerow((path, *(f"{prob.item():.4f}" for prob in output)))
+
+            return
+
+        for path, labels in zip(paths, classifier(outputs)):
+            with open(
+                f"{os.path.splitext(path)[0]}.txt", "w",
+                encoding="utf-8"
+            ) as file:
+                classes = list(labels.keys())
+                random.shuffle(classes)
+
+                if prefix:
+                    try:
+                        classes.remove(prefix)
+                    except ValueError:
+                        pass
+
+                    classes.insert(0, prefix)
+
+                file.write(', '.join(classes))
+
+    return write_output
+
+def _save_features(
+    features: FeatureStore,
+    paths: list[str],
+    tokens: Tensor,
+    patch_valid: Tensor,
+    num_prefix_tokens: int,
+) -> None:
+    lengths = patch_valid.sum(dim=-1).add_(num_prefix_tokens).tolist()
+    tokens = tokens.cpu()
+
+    for path, length, seq in zip(paths, lengths, tokens):
+        features.append(path, seq[:length])
+
+    features.flush()
+
+def _sync_metrics(device: str) -> None:
+    """Wait for the model calls queued on a CUDA device, so their time is counted in the current metrics stage."""
+
+    if metrics.enabled and device.startswith("cuda"):
+        torch.cuda.synchronize(device)
+
+def _run_features(
+    *,
+    model: NaFlexVit,
+    features: FeatureStore,
+    write_output: Callable[[list[str], Tensor], None],
+    profiler: BatchProfiler,
+    batch_size: int,
+    device: str,
+) -> None:
+    for batch_paths, f_t, fv_t in features.batches(batch_size):
+        profiler.step()
+
+        with metrics.stage("forward"), profiler.stage("forward"):
+            f_d = f_t.to(device=device, non_blocking=True)
+            fv_d = fv_t[:, model.num_prefix_tokens:].to(device=device, non_blocking=True)
+
+            o_d = model.forward_head(f_d, patch_valid=fv_d).float().sigmoid()
+            del f_d, fv_d
+
+            _sync_metrics(device)
+
+        with metrics.stage("output"), profiler.stage("output"):
+            write_output(batch_paths, o_d)
+        del o_d
+
+        metrics.count("images", len(batch_paths))
+
+# files in directories that are never classified, such as the captions and CSV files written for them
+_SKIPPED_EXTENSIONS = (".txt", ".csv", ".json", ".py", ".safetensors")
+
+def _visible(name: str) -> bool:
+    return not name.startswith(".") and name != "__pycache__"
+
+def _dir_iter(path: str, recursive: bool) -> Iterable[str]:
+    for entry in os.scandir(path):
+        if _visible(entry.name):
+            if entry.is_file():
+                if not entry.name.endswith(_SKIPPED_EXTENSIONS):
+                    yield entry.path
+            elif recursive and entry.is_dir():
+                yield from _dir_iter(entry.path, recursive)
+
+def _dir_accepts(relpath: str) -> bool:
+    """Whether `_dir_iter` lists the file at `relpath` within its directory, when recursive."""
+
+    parts = relpath.split(os.sep)
+    return all(_visible(part) for part in parts) and not parts[-1].endswith(_SKIPPED_EXTENSIONS)
+
+def _make_batch(loaded: Iterable[tuple[str, tuple[Tensor, Tensor, Tensor]]]) -> Batch:
+    patches: list[Tensor] = []
+    patch_coords: list[Tensor] = []
+    patch_valid: list[Tensor] = []
+    batch_paths: list[str] = []
+    counts: list[int] = []
+
+    for path, result in loaded:
+        batch_paths.append(path)
+
+        if result[0].dim() == 3: # one row per sampled frame
+            patches.extend(result[0].unbind(0))
+            patch_coords.extend(result[1].unbind(0))
+            patch_valid.extend(result[2].unbind(0))
+            counts.append(result[0].size(0))
+        else:
+            patches.append(result[0])
+            patch_coords.append(result[1])
+            patch_valid.append(result[2])
+            counts.append(1)
+
+    return batch_paths, patches, patch_coords, patch_valid, counts
+
+def shard_of(key: str, shard_count: int) -> int:
+    """
+    Assign a path to one of `shard_count` shards by a stable hash.
+
+    Directory entries are keyed by their path relative to the listed directory, so
+    machines that mount the same archive in different places agree on the split.
+    """
+
+    digest = hashlib.blake2b(key.replace(os.sep, "/").encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % shard_count
+
+class Replica:
+    """A model on one device, with the images it classified and the time it spent doing so."""
+
+    def __init__(self, model: NaFlexVit, device: str) -> None:
+        self.model = model
+        self.device = device
+        self.images = 0
+        self.seconds = 0.0
+
+class ReplicaPool:
+    """
+    Replicas of a model, each lent to one caller at a time.
+
+    A replica's model calls and statistics are only touched while it is checked out, so
+    threads sharing the pool never run the same replica at once.
+    """
+
+    def __init__(self, replicas: list[Replica]) -> None:
+        self.replicas = replicas
+        self._free: SimpleQueue[Replica] = SimpleQueue()
+        for replica in replicas:
+            self._free.put(replica)
+
+    def __len__(self) -> int:
+        return len(self.replicas)
+
+    def __iter__(self) -> Iterator[Replica]:
+        return iter(self.replicas)
+
+    @contextmanager
+    def checkout(self) -> Iterator[Replica]:
+        """Wait for a free replica, and return it when done."""
+
+        replica = self._free.get()
+        try:
+            yield replica
+        finally:
+            self._free.put(replica)
+
+class Cascade:
+    """
+    Decides which images of a low sequence length pass to classify again at full resolution,
+    and counts how often it did so.
+
+    An image is escalated when any tag is within `margin` of its threshold, where a little
+    more detail could flip it, or when no tag clears its threshold by `margin`, so the image
+    has no confident tags at all. With `check`, every image is also classified at full
+    resolution, to measure how often the images kept at low resolution get the same tags.
+    """
+
+    def __init__(self, thresholds: Tensor, *, seqlen: int, margin: float, check: bool = False) -> None:
+        self.thresholds = thresholds
+        self.seqlen = seqlen
+        self.margin = margin
+        self.check = check
+
+        self.images = 0
+        self.escalated = 0
+
+        # images kept at low resolution, and their tags, compared with full resolution
+        self.kept = 0
+        self.kept_same = 0
+        self.tags_both = 0
+        self.tags_low = 0
+        self.tags_full = 0
+
+    def escalate(self, outputs: Tensor) -> Tensor:
+        distance = outputs - self.thresholds.to(device=outputs.device)
+        near = (distance.abs() < self.margin).any(dim=1)
+        unsure = ~(distance >= self.margin).any(dim=1)
+        return near | unsure
+
+    def record(self, low: Tensor, full: Tensor | None, escalated: Tensor) -> None:
+        self.images += low.size(0)
+        self.escalated += int(escalated.sum())
+
+        if full is None:
+            return
+
+        thresholds = self.thresholds.to(device=low.device)
+        kept = ~escalated
+        low_tags = low[kept] >= thresholds
+        full_tags = full[kept] >= thresholds
+
+        self.kept += int(kept.sum())
+        self.kept_same += int((low_tags == full_tags).all(dim=1).sum())
+        self.tags_both += int((low_tags & full_tags).sum())
+        self.tags_low += int(low_tags.sum())
+        self.tags_full += int(full_tags.sum())
+
+    def report(self) -> str:
+        lines = [
+            f"Cascade: {self.escalated} of {self.images} images"
+            f" ({self.escalated / max(self.images, 1) * 100:.1f}%) escalated from seqlen {self.seqlen}."
+        ]
+
+        if self.check:
+            same = self.kept_same + self.escalated
+            lines.append(
+                f"  {same} of {self.images} images ({same / max(self.images, 1) * 100:.1f}%) have the same tags as at full resolution;"
+                f" {self.kept_same} of the {self.kept} kept at seqlen {self.seqlen}."
+            )
+
+        if self.check and self.kept:
+            precision = self.tags_both / max(self.tags_low, 1)
+            recall = self.tags_both / max(self.tags_full, 1)
+            lines.append(
+                f"  Tags of images kept at seqlen {self.seqlen}, against full resolution:"
+                f" precision {precision:.4f}, recall {recall:.4f}."
+            )
+
+        return "\n".join(lines)
+
+def _replica_map(
+    replicas: ReplicaPool,
+    fn: Callable[[Replica, T], R],
+    items: Iterable[T],
+) -> Iterator[tuple[T, R]]:
+    """
+    Apply `fn` to each item on whichever replica is free, yielding results in the order of `items`.
+
+    Items are consumed on the calling thread, so loading the next batch overlaps the model calls
+    of the previous ones. A single replica runs inline.
+    """
+
+    if len(replicas) == 1:
+        for item in items:
+            with replicas.checkout() as replica:
+                result = fn(replica, item)
+
+            yield item, result
+
+        return
+
+    @torch.inference_mode()
+    def run(item: T) -> R:
+        with replicas.checkout() as replica:
+            return fn(replica, item)
+
+    with ThreadPoolExecutor(len(replicas), thread_name_prefix="jtp-replica") as pool:
+        pending: deque[tuple[T, Future[R]]] = deque()
+
+        for item in items:
+            pending.append((item, pool.submit(run, item)))
+
+            # keep every replica busy with one more batch loaded ahead
+            while len(pending) > len(replicas) * 2:
+                item, future = pending.popleft()
+                yield item, future.result()
+
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+def _run_batched(
+    *,
+    replicas: ReplicaPool,
+    paths: list[str],
+    recursive: bool,
+    write_output: Callable[[list[str], Tensor], None],
+    features: FeatureStore | None,
+    profiler: BatchProfiler,
+    shard: tuple[int, int] = (0, 1),
+    frames: int = 1,
+    frame_sampling: str = "even",
+    frame_reduce: str = "max",
+    video_frames: int = 8,
+    video_time_budget: float | None = None,
+    cascade: Cascade | None = None,
+    watch: FolderWatcher | None = None,
     batch_size: int,
     seqlen: int,
     n_workers: int,
     share_memory: bool,
     device: str,
 ) -> None:
+    """With `watch`, files are taken from it instead of `paths`, until interrupted."""
+
     loader = Loader(
         n_workers,
-        patch_size=PATCH_SIZE, max_seqlen=seqlen,
-        share_memory=share_memory
+        patch_size=PATCH_SIZE, max_seqlen=seqlen if cascade is None else cascade.seqlen,
+        share_memory=share_memory,
+        frames=frames, frame_sampling=frame_sampling,
+        video_frames=video_frames, video_time_budget=video_time_budget,
     )
 
-    def dir_iter(path: str) -> Iterable[str]:
-        for entry in os.scandir(path):
-            if (
-                not entry.name.startswith(".")
-                and entry.name != "__pycache__"
-            ):
-                if entry.is_file():
-                    if not entry.name.endswith((
-                        ".txt", ".csv", ".json",
-                        ".py", ".safetensors",
-                    )):
-                        yield entry.path
-                elif recursive and entry.is_dir():
-                    yield from dir_iter(entry.path)
+    shard_index, shard_count = shard
 
     def paths_iter() -> Iterable[str]:
         for path in paths:
             if os.path.isdir(path):
-                yield from dir_iter(path)
-            else:
+                for entry in _dir_iter(path, recursive):
+                    if shard_count == 1 or shard_of(os.path.relpath(entry, path), shard_count) == shard_index:
+                        yield entry
+            elif shard_count == 1 or shard_of(path, shard_count) == shard_index:
                 yield path
 
-    for batch in batched(paths_iter(), batch_size):
-        patches: list[Tensor] = []
-        patch_coords: list[Tensor] = []
-        patch_valid: list[Tensor] = []
-        batch_paths: list[str] = []
+    def collect(results: dict[str, tuple[Tensor, Tensor, Tensor] | Exception]) -> Batch:
+        loaded: list[tuple[str, tuple[Tensor, Tensor, Tensor]]] = []
 
-        for path, result in loader.load(batch).items():
+        for path, result in results.items():
             if isinstance(result, Exception):
                 print(f"{repr(path)}: {result}", file=sys.stderr)
+                metrics.count("errors", stage="load")
                 continue
 
-            batch_paths.append(path)
-            patches.append(result[0])
-            patch_coords.append(result[1])
-            patch_valid.append(result[2])
+            if result[0].dim() == 3 and features is not None:
+                print(f"{repr(path)}: Features of animations and videos cannot be stored.", file=sys.stderr)
+                metrics.count("errors", stage="load")
+                continue
 
-        if not patches:
-            continue
+            loaded.append((path, result))
 
-        p_d = torch.stack(patches).to(device=device, non_blocking=True)
-        pc_d = torch.stack(patch_coords).to(device=device, non_blocking=True)
-        pv_d = torch.stack(patch_valid).to(device=device, non_blocking=True)
+        return _make_batch(loaded)
 
-        p_d = p_d.to(dtype=torch.bfloat16).div_(127.5).sub_(1.0)
-        pc_d = pc_d.to(dtype=torch.int32)
+    def load_batches() -> Iterable[Batch]:
+        for batch in watch.batches(batch_size) if watch is not None else batched(paths_iter(), batch_size):
+            profiler.step()
 
-        o_d = model(p_d, pc_d, pv_d).float().sigmoid()
-        del p_d, pc_d, pv_d
+            with metrics.stage("load"), profiler.stage("load"):
+                results = loader.load(batch)
+
+            if (collected := collect(results))[0]:
+                yield collected
+
+    def forward(replica: Replica, batch: Batch) -> tuple[Tensor, dict[str, Tensor] | None]:
+        batch_paths, patches, patch_coords, patch_valid, counts = batch
+        model = replica.model
+        start = perf_counter()
+
+        with metrics.stage("forward"), profiler.stage("forward"):
+            p_d, pc_d, pv_d = prepare_batch(patches, patch_coords, patch_valid, replica.device)
 
-        for path, output in zip(batch_paths, o_d.cpu()):
-            if writer is None:
-                with open(
-                    f"{os.path.splitext(path)[0]}.txt", "w",
-                    encoding="utf-8"
-                ) as file:
-                    classes = list(classify_output(
-                        output, tags, threshold,
-                        metadata=metadata, implications=implications, exclude_categories=exclude
-                    ).keys())
-                    random.shuffle(classes)
-
-                    if prefix:
-                        try:
-                            classes.remove(prefix)
-                        except ValueError:
-                            pass
-
-                        classes.insert(0, prefix)
-
-                    file.write(', '.join(classes))
+            f_d: dict[str, Tensor] | None = None
+            if features is None:
+                o_d = model(p_d, pc_d, pv_d).float().sigmoid()
             else:
-                writer.writerow((path, *(f"{prob.item():.4f}" for prob in output)))
+                f_d = model.forward_features(p_d, pc_d, pv_d)
+                o_d = model.forward_head(**f_d).float().sigmoid()
+
+            del p_d, pc_d, pv_d
+
+            o_d = reduce_frames(o_d, counts, frame_reduce)
+
+            # replica statistics, like metrics, need the model calls finished to time them
+            if len(replicas) > 1 and replica.device.startswith("cuda"):
+                torch.cuda.synchronize(replica.device)
+            else:
+                _sync_metrics(replica.device)
+
+        replica.images += len(batch_paths)
+        replica.seconds += perf_counter() - start
+
+        return o_d, f_d
+
+    def refine(batch_paths: list[str], o_d: Tensor) -> Tensor:
+        assert cascade is not None
+
+        escalated = cascade.escalate(o_d)
+        refine_paths = batch_paths if cascade.check else [
+            path for path, escalate in zip(batch_paths, escalated.tolist()) if escalate
+        ]
+
+        full: Tensor | None = None
+        if refine_paths:
+            with metrics.stage("load"), profiler.stage("load"):
+                refined = collect(loader.load(refine_paths, max_seqlen=seqlen))
 
+            if refined[0]:
+                with replicas.checkout() as replica:
+                    f_o, _ = forward(replica, refined)
+
+                f_o = f_o.to(device=o_d.device)
+
+                # images that failed to load again keep their low resolution outputs
+                rows = { path: idx for idx, path in enumerate(batch_paths) }
+                full = o_d.clone()
+                full[[rows[path] for path in refined[0]]] = f_o
+
+        cascade.record(o_d, full if cascade.check else None, escalated)
+        metrics.count("escalated", int(escalated.sum()))
+
+        if full is None:
+            return o_d
+
+        return torch.where(escalated.unsqueeze(1), full, o_d)
+
+    for (batch_paths, *_), (o_d, f_d) in _replica_map(replicas, forward, load_batches()):
+        if cascade is not None:
+            with profiler.stage("refine"):
+                o_d = refine(batch_paths, o_d)
+
+        if f_d is not None and features is not None:
+            _save_features(features, batch_paths, f_d["patches"], f_d["patch_valid"], replicas.replicas[0].model.num_prefix_tokens)
+            del f_d
+
+        with metrics.stage("output"), profiler.stage("output"):
+            write_output(batch_paths, o_d.to(device=device))
         del o_d
 
+        metrics.count("images", len(batch_paths))
+
     loader.shutdown()
 
+    if cascade is not None:
+        print(cascade.report(), file=sys.stderr)
+
+    if len(replicas) > 1:
+        for idx, replica in enumerate(replicas):
+            print(
+                f"Replica {idx} ({replica.device}): {replica.images} images in {replica.seconds:.1f}s"
+                f" ({replica.images / max(replica.seconds, 1e-9):.2f} images/s)",
+                file=sys.stderr
+            )
+
+def _run_daemon(
+    *,
+    model: NaFlexVit,
+    tags: list[str],
+    classifier: TagClassifier,
+    socket_path: str,
+    frames: int = 1,
+    frame_sampling: str = "even",
+    frame_reduce: str = "max",
+    video_frames: int = 8,
+    video_time_budget: float | None = None,
+    batch_size: int,
+    seqlen: int,
+    n_workers: int,
+    share_memory: bool,
+    device: str,
+) -> None:
+    """
+    Classify paths sent by tagclient.py over a Unix socket until interrupted.
+
+    Each connection is answered by its own thread, which queues the files of its
+    request and waits for them. One loop takes up to `batch_size` queued files, from
+    any number of connections, and classifies them together, so clients submitting
+    at the same time share batches.
+    """
+
+    loader = Loader(
+        n_workers,
+        patch_size=PATCH_SIZE, max_seqlen=seqlen,
+        share_memory=share_memory,
+        frames=frames, frame_sampling=frame_sampling,
+        video_frames=video_frames, video_time_budget=video_time_budget,
+    )
+
+    submissions: SimpleQueue[tuple[str, Future[tuple[dict[str, float], Tensor]]]] = SimpleQueue()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def send(self, message: dict[str, Any]) -> None:
+            self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+
+        def handle(self) -> None:
+            try:
+                self.respond()
+            except (BrokenPipeError, ConnectionResetError): # the client went away
+                pass
+
+        def respond(self) -> None:
+            if not (line := self.rfile.readline()): # a connection test, see below
+                return
+
+            try:
+                request = json.loads(line)
+                recursive = bool(request.get("recursive", False))
+                probabilities = bool(request.get("probabilities", False))
+
+                paths: list[str] = []
+                for path in request["paths"]:
+                    if not isinstance(path, str):
+                        raise TypeError("paths must be strings")
+
+                    paths.extend(_dir_iter(path, recursive) if os.path.isdir(path) else (path,))
+            except (ValueError, KeyError, TypeError, AttributeError, OSError) as ex:
+                self.send({ "error": f"Invalid request: {ex}" })
+                return
+
+            futures: list[Future[tuple[dict[str, float], Tensor]]] = []
+            for path in paths:
+                futures.append(future := Future())
+                submissions.put((path, future))
+
+            if probabilities:
+                self.send({ "tags": tags })
+
+            for path, future in zip(paths, futures):
+                try:
+                    labels, output = future.result()
+                except Exception as ex:
+                    self.send({ "path": path, "error": str(ex) })
+                    continue
+
+                message: dict[str, Any] = { "path": path, "tags": labels }
+                if probabilities:
+                    message["probabilities"] = output.tolist()
+
+                self.send(message)
+
+            self.send({ "done": True })
+
+    if os.path.exists(socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(socket_path)
+            except OSError: # left behind by a daemon that did not exit cleanly
+                os.remove(socket_path)
+            else:
+                raise RuntimeError(f"Another daemon is already listening on {repr(socket_path)}.")
+
+    # the daemon reads any file its clients name, so only this user may connect, from the moment the socket exists
+    umask = os.umask(0o077)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    finally:
+        os.umask(umask)
+
+    server.daemon_threads = True
+
+    Thread(target=server.serve_forever, name="daemon-server", daemon=True).start()
+    print(f"Listening on {repr(socket_path)}. Press Ctrl+C to stop.", file=sys.stderr)
+
+    try:
+        while True:
+            batch = [submissions.get()]
+            while len(batch) < batch_size and not submissions.empty():
+                batch.append(submissions.get())
+
+            # the same file may be submitted by several clients at once
+            pending: dict[str, list[Future[tuple[dict[str, float], Tensor]]]] = {}
+            for path, future in batch:
+                pending.setdefault(path, []).append(future)
+
+            with metrics.stage("load"):
+                results = loader.load(pending)
+
+            loaded: list[tuple[str, tuple[Tensor, Tensor, Tensor]]] = []
+            for path, result in results.items():
+                if isinstance(result, Exception):
+                    metrics.count("errors", stage="load")
+                    for future in pending[path]:
+                        future.set_exception(result)
+                else:
+                    loaded.append((path, result))
+
+            if not loaded:
+                continue
+
+            batch_paths, patches, patch_coords, patch_valid, counts = _make_batch(loaded)
+
+            try:
+                with metrics.stage("forward"):
+                    p_d, pc_d, pv_d = prepare_batch(patches, patch_coords, patch_valid, device)
+                    o_d = reduce_frames(model(p_d, pc_d, pv_d).float().sigmoid(), counts, frame_reduce)
+                    del p_d, pc_d, pv_d
+
+                    _sync_metrics(device)
+
+                with metrics.stage("output"):
+                    labels = classifier(o_d)
+                    outputs = o_d.cpu()
+                del o_d
+            except Exception as ex:
+                for path in batch_paths:
+                    for future in pending[path]:
+                        future.set_exception(ex)
+
+                continue
+
+            for path, path_labels, output in zip(batch_paths, labels, outputs):
+                for future in pending[path]:
+                    future.set_result((path_labels, output))
+
+            metrics.count("images", len(batch_paths))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.remove(socket_path)
+
+        # Ctrl+C also interrupts the loader workers, which then cannot acknowledge a shutdown
+        loader.shutdown(wait=False)
+
 def load_calibration(path: str, rewrite_tag: Callable[[str], str] = lambda tag: tag) -> dict[str, float]:
     thresholds = {}
     with open(path, "r", encoding="utf-8", newline="") as thresholds_file:
@@ -433,6 +1139,16 @@ def load_metadata(path: str, rewrite_tag: Callable[[str], str] = lambda tag: tag
 def _if_exists(path: str, default: str = "") -> str:
     return path if os.path.exists(path) else default
 
+def _start_metrics(path: str, interval: float, device: str) -> Callable[[], None]:
+    metrics.enabled = True
+    metrics.describe("images", "Images classified.")
+    metrics.describe("errors", "Stages that raised an exception, or images that failed to load.")
+    metrics.describe("escalated", "Images classified again at full resolution by --cascade.")
+    metrics.gauge("process_memory_bytes", "Memory used by this process.", process_memory)
+    metrics.gauge("device_memory_bytes", "Memory used on the model device.", lambda: device_memory(device))
+
+    return metrics.dump_every(path, interval)
+
 @torch.inference_mode()
 def main() -> None:
     if hasattr(torch.backends, "fp32_precision"):
@@ -444,6 +1160,7 @@ def main() -> None:
     default_device = "cuda" if torch.cuda.is_available() else "cpu"
     default_threshold = _if_exists("calibration.csv", "0.5")
     default_metadata = _if_exists("data/jtp-3-hydra-tags.csv")
+    default_model = _if_exists("models/jtp-3-hydra-inference.safetensors", "models/jtp-3-hydra.safetensors")
 
     parser = argparse.ArgumentParser(
         description="JTP-3 Hydra Classifier by Project RedRocket",
@@ -487,29 +1204,94 @@ def main() -> None:
         help="Path for CSV output, or '-' for standard output. If not specified, individual .txt caption files are written.")
     parser.add_argument("-O", "--original-tags", action="store_true",
         help="Do not rewrite tags for compatibility with diffusion models.")
+    parser.add_argument("--save-features", type=str,
+        metavar="PATH",
+        help="Also store backbone features for each image in the specified directory, for later use with --features.")
+    parser.add_argument("--features", type=str,
+        metavar="PATH",
+        help="Classify previously stored backbone features instead of images, running only the classifier head.")
 
     # RESOURCE ARGUMENTS
-    parser.add_argument("-M", "--model", type=str, default="models/jtp-3-hydra.safetensors",
+    parser.add_argument("-M", "--model", type=str, default=default_model,
         metavar="PATH",
-        help="Path to model file.")
+        help=f"Path to model file. (Default: {default_model})")
     parser.add_argument("-m", "--metadata", type=str, default=default_metadata,
         metavar="PATH",
         help=f"Path to CSV file with additional tag metadata. (Default: {default_metadata or '<none>'})")
 
     # EXECITION ARGUMENTS
-    parser.add_argument("-b", "--batch", type=int, default=1,
+    parser.add_argument("-b", "--batch", type=int,
         metavar="BATCH_SIZE",
-        help="Batch size.")
+        help="Batch size. (Default: 1, or 8 with --serve)")
     parser.add_argument("-w", "--workers", type=int, default=-1,
         metavar="N_WORKERS",
         help="Number of dataloader workers. (Default: number of cores)")
+    parser.add_argument("--shard-index", type=int, default=0,
+        metavar="INDEX",
+        help="Classify only the images of this shard, numbered from 0. (Default: 0)")
+    parser.add_argument("--shard-count", type=int, default=1,
+        metavar="COUNT",
+        help="Split images into this many shards by a stable hash of their paths, to be merged with merge.py. (Default: 1)")
+    parser.add_argument("--frames", type=int, default=1,
+        metavar="N",
+        help="Classify up to N sampled frames of animated GIF, WebP and PNG images, combining their probabilities. (Default: 1)")
+    parser.add_argument("--frame-sampling", choices=FRAME_SAMPLING, default="even",
+        metavar="MODE",
+        help="Sample frames evenly over the animation, or prefer scene changes. (Default: even)")
+    parser.add_argument("--frame-reduce", choices=FRAME_REDUCTIONS, default="max",
+        metavar="MODE",
+        help="Combine the probabilities of frames by their maximum, tagging what appears in any frame, or their mean. (Default: max)")
+    parser.add_argument("--video-frames", type=int, default=8,
+        metavar="N",
+        help="Classify up to N keyframes of WebM, MP4, MKV and MOV videos, combined like --frame-reduce. Requires PyAV. (Default: 8)")
+    parser.add_argument("--video-budget", type=float,
+        metavar="SECONDS",
+        help="Stop decoding more keyframes of a video after this many seconds, classifying those decoded so far.")
+    parser.add_argument("--cascade", type=int,
+        metavar="SEQLEN",
+        help="Classify every image at this lower sequence length first, and again at --seqlen only if a tag is close to its threshold or no tag is confident.")
+    parser.add_argument("--cascade-margin", type=float, default=0.1,
+        metavar="MARGIN",
+        help="Distance from a threshold, on the -1.0 to 1.0 scale, within which a tag escalates its image to --seqlen. (Default: 0.1)")
+    parser.add_argument("--cascade-check", action="store_true",
+        help="Also classify every image at --seqlen, and report how often the cascade gives the same tags.")
     parser.add_argument("--no-shm", dest="shm", action="store_false",
         help="Disable shared memory between workers.")
     parser.add_argument("-S", "--seqlen", type=int, default=1024,
         help="NaFlex sequence length. (Default: 1024)")
     parser.add_argument("-d", "--device", type=str, default=default_device,
         metavar="TORCH_DEVICE",
-        help=f"Torch device. (Default: {default_device})")
+        help=f"Torch device, or a comma-separated list of devices to classify paths with one model replica each. (Default: {default_device})")
+    parser.add_argument("--metrics", type=str,
+        metavar="PATH",
+        help="Periodically write per-stage timings in the Prometheus text format to the specified path, or '-' for standard error.")
+    parser.add_argument("--metrics-interval", type=float, default=60.0,
+        metavar="SECONDS",
+        help="Seconds between writes of --metrics. (Default: 60)")
+    parser.add_argument("--profile", type=str,
+        metavar="PATH",
+        help="Profile a window of batches, writing a Chrome trace to PATH.json and a summary of top operators and Python functions to PATH.txt.")
+    parser.add_argument("--profile-batches", type=int, default=8,
+        metavar="N",
+        help="Number of batches to profile. (Default: 8)")
+    parser.add_argument("--profile-skip", type=int, default=2,
+        metavar="N",
+        help="Number of batches to run before profiling, to exclude warm up. (Default: 2)")
+
+    parser.add_argument("--watch", action="store_true",
+        help="After classifying the given directories, keep classifying files created or modified in them until interrupted.")
+    parser.add_argument("--watch-settle", type=float, default=1.0,
+        metavar="SECONDS",
+        help="Classify a new or modified file once it has not changed for this long, so partially written files are not read. (Default: 1)")
+    parser.add_argument("--watch-delay", type=float, default=0.5,
+        metavar="SECONDS",
+        help="Wait at most this long for more files to fill a batch once a file is ready. (Default: 0.5)")
+    parser.add_argument("--watch-poll", type=float, default=2.0,
+        metavar="SECONDS",
+        help="Seconds between scans of the directories when watchdog is not installed for filesystem notifications. (Default: 2)")
+    parser.add_argument("--serve", type=str, nargs="?", const=DEFAULT_SOCKET,
+        metavar="SOCKET",
+        help=f"Keep the model loaded and classify files sent by tagclient.py to this Unix socket, batching concurrent requests. (Default: {DEFAULT_SOCKET})")
 
     # POSITIONAL ARGUMENTS
     parser.add_argument("paths", nargs="*",
@@ -518,21 +1300,94 @@ def main() -> None:
 
     args = parser.parse_args()
 
+    captions = args.output is None and bool(args.paths or args.features)
+
     def rewrite_tag(tag: str) -> str:
         if not args.original_tags:
             tag = tag.replace("vulva", "pussy")
 
-        if args.output is None and args.paths: # caption files
+        if captions: # caption files
             tag = tag.replace("_", " ")
             tag = tag.replace("(", r"\(")
             tag = tag.replace(")", r"\)")
 
         return tag
 
+    if args.batch is None:
+        args.batch = 8 if args.serve is not None else 1
+
     if args.batch < 1:
         parser.error("--batch must be at least 1")
+    if args.features and args.paths:
+        parser.error("--features cannot be combined with paths")
+    if args.features and args.save_features:
+        parser.error("--features cannot be combined with --save-features")
+    if args.frames < 1:
+        parser.error("--frames must be at least 1")
+    if args.frames > 1 and args.save_features:
+        parser.error("--frames cannot be combined with --save-features")
+    if args.frames > 1 and args.features:
+        parser.error("--frames cannot be combined with --features")
+    if args.video_frames < 1:
+        parser.error("--video-frames must be at least 1")
+    if args.video_budget is not None and args.video_budget <= 0:
+        parser.error("--video-budget must be positive")
     if not 64 <= args.seqlen <= 2048:
         parser.error("--seqlen must be between 64 and 2048")
+    if args.cascade is not None and not 64 <= args.cascade < args.seqlen:
+        parser.error("--cascade must be at least 64 and less than --seqlen")
+    if args.cascade is not None and not args.paths:
+        parser.error("--cascade requires paths to classify")
+    if args.cascade is not None and args.save_features:
+        parser.error("--cascade cannot be combined with --save-features")
+    if not 0.0 < args.cascade_margin <= 2.0:
+        parser.error("--cascade-margin must be between 0.0 and 2.0")
+    if args.cascade_check and args.cascade is None:
+        parser.error("--cascade-check requires --cascade")
+    if args.metrics_interval <= 0:
+        parser.error("--metrics-interval must be positive")
+    if args.profile_batches < 1:
+        parser.error("--profile-batches must be at least 1")
+    if args.profile_skip < 0:
+        parser.error("--profile-skip must not be negative")
+    if args.profile and not (args.paths or args.features):
+        parser.error("--profile requires paths or --features")
+
+    if args.serve is not None:
+        if not hasattr(socket, "AF_UNIX"):
+            parser.error("--serve requires Unix domain sockets, which are not available on this platform")
+        if args.paths or args.features:
+            parser.error("--serve cannot be combined with paths or --features")
+        if args.output is not None or args.prefix:
+            parser.error("--serve cannot be combined with --output or --prefix; pass them to tagclient.py instead")
+        if args.save_features or args.cascade is not None or args.profile:
+            parser.error("--serve cannot be combined with --save-features, --cascade or --profile")
+
+    if args.watch:
+        if not args.paths or not all(os.path.isdir(path) for path in args.paths):
+            parser.error("--watch requires directories to classify")
+        if args.save_features or args.shard_count > 1:
+            parser.error("--watch cannot be combined with --save-features or --shard-count")
+        if "," in args.device:
+            parser.error("--watch requires a single device")
+    if args.watch_settle < 0 or args.watch_delay < 0 or args.watch_poll <= 0:
+        parser.error("--watch-settle and --watch-delay must not be negative, and --watch-poll must be positive")
+
+    if args.shard_count < 1:
+        parser.error("--shard-count must be at least 1")
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error("--shard-index must be between 0 and --shard-count - 1")
+    if args.shard_count > 1 and not args.paths:
+        parser.error("--shard-count requires paths to classify")
+
+    devices = [device.strip() for device in args.device.split(",") if device.strip()]
+    if not devices:
+        parser.error("--device must name at least one device")
+    if len(devices) > 1 and not args.paths:
+        parser.error("multiple devices require paths to classify")
+
+    # outputs are gathered and classified on the first device
+    args.device = devices[0]
 
     threshold: dict[str, float] | float
     try:
@@ -542,16 +1397,28 @@ def main() -> None:
 
         threshold = from_symmetric(threshold)
     except ValueError: # not a float, try to interpret as path to a calibration file
-        print(f"Loading {repr(args.threshold)} ...", end="", file=sys.stderr)
-        threshold = load_calibration(args.threshold, rewrite_tag)
-        print(f" {len(threshold)} tags", file=sys.stderr)
+        calibration_path = args.threshold
+    else:
+        calibration_path = None
 
+    # with metadata, the calibration is compiled into the same cached tag table
     metadata: Metadata = {}
     if args.metadata is not None:
         print(f"Loading {repr(args.metadata)} ...", end="", file=sys.stderr)
-        metadata = load_metadata(args.metadata, rewrite_tag)
+        metadata = load_tag_table(
+            args.metadata, calibration_path, rewrite_tag,
+            rewrite_key=f"original_tags={args.original_tags},captions={captions}",
+        )
         print(f" {len(metadata)} tags", file=sys.stderr)
 
+    if calibration_path is not None:
+        print(f"Loading {repr(calibration_path)} ...", end="", file=sys.stderr)
+        if isinstance(metadata, TagTable):
+            threshold = metadata.threshold_dict()
+        else:
+            threshold = load_calibration(calibration_path, rewrite_tag)
+        print(f" {len(threshold)} tags", file=sys.stderr)
+
     if args.implications is None:
         args.implications = "inherit" if metadata else "off"
     elif args.implications != "off" and not metadata:
@@ -561,9 +1428,19 @@ def main() -> None:
         parser.error("--exclude requires tag metadata")
 
     print(f"Loading {repr(args.model)} ...", end="", file=sys.stderr)
-    model, tags = load_model(args.model, device=args.device)
+    if len(devices) > 1:
+        models, tags = load_models(args.model, devices)
+        model = models[0]
+    else:
+        model, tags = load_model(args.model, device=args.device)
+        models = [model]
     print(f" {len(tags)} tags", file=sys.stderr)
 
+    if (n_cpu := sum(torch.device(device).type == "cpu" for device in devices)) > 1:
+        # replicas on the CPU divide its cores, like ModelExecutor streams
+        n_cores = os.process_cpu_count() if hasattr(os, "process_cpu_count") else os.cpu_count()
+        torch.set_num_threads(max(1, (n_cores or 1) // n_cpu))
+
     bad_metadata = False
     for idx in range(len(tags)):
         tag = rewrite_tag(tags[idx])
@@ -579,7 +1456,28 @@ def main() -> None:
 
     exclude = { TAG_CATEGORIES[category] for category in args.exclude }
 
-    if args.paths:
+    if args.serve is not None:
+        stop_metrics = _start_metrics(args.metrics, args.metrics_interval, args.device) if args.metrics is not None else None
+
+        try:
+            _run_daemon(
+                model=model, tags=tags,
+                classifier=TagClassifier(
+                    tags, threshold,
+                    metadata=metadata, implications=args.implications, exclude_categories=exclude,
+                    device=args.device,
+                ),
+                socket_path=args.serve,
+                frames=args.frames, frame_sampling=args.frame_sampling, frame_reduce=args.frame_reduce,
+                video_frames=args.video_frames, video_time_budget=args.video_budget,
+                batch_size=args.batch, seqlen=args.seqlen,
+                n_workers=args.workers, share_memory=args.shm,
+                device=args.device,
+            )
+        finally:
+            if stop_metrics is not None:
+                stop_metrics()
+    elif args.paths or args.features:
         file: Any = None
         writer: Any = None
 
@@ -588,31 +1486,110 @@ def main() -> None:
                 pass
 
             case "-":
+                if args.watch: # rows are written as files arrive
+                    sys.stdout.reconfigure(line_buffering=True)
+
                 writer = csv.writer(sys.stdout)
 
             case _:
                 file = open(
-                    args.file, "w",
-                    buffering=(1024 * 1024),
+                    args.output, "w",
+                    buffering=(1 if args.watch else 1024 * 1024),
                     encoding="utf-8",
                     newline="",
                 )
                 writer = csv.writer(file)
                 writer.writerow(("filename", *tags))
+
+        write_output = _output_writer(
+            tags=tags,
+            threshold=threshold,
+            metadata=metadata, implications=args.implications, exclude=exclude,
+            writer=writer, prefix=args.prefix,
+            device=args.device,
+        )
+
+        stop_metrics: Callable[[], None] | None = None
+        if args.metrics is not None:
+            stop_metrics = _start_metrics(args.metrics, args.metrics_interval, args.device)
+
+        profiler = BatchProfiler(
+            args.profile, device=args.device,
+            skip=args.profile_skip, batches=args.profile_batches,
+        )
+
+        features: FeatureStore | None = None
+        watch: FolderWatcher | None = None
         try:
-            _run_batched(
-                model=model, tags=tags,
-                threshold=threshold,
-                metadata=metadata, implications=args.implications, exclude=exclude,
-                paths=args.paths, recursive=args.recursive,
-                writer=writer, prefix=args.prefix,
-                batch_size=args.batch, seqlen=args.seqlen,
-                n_workers=args.workers, share_memory=args.shm,
-                device=args.device,
-            )
+            if args.features:
+                features = FeatureStore(args.features, "r", dim=model.num_features)
+                print(f"Classifying {len(features)} stored images ...", file=sys.stderr)
+
+                _run_features(
+                    model=model, features=features,
+                    write_output=write_output, profiler=profiler,
+                    batch_size=args.batch,
+                    device=args.device,
+                )
+            else:
+                if args.save_features:
+                    features = FeatureStore(
+                        args.save_features, "w",
+                        dim=model.num_features, model=os.path.basename(args.model)
+                    )
+
+                cascade: Cascade | None = None
+                if args.cascade is not None:
+                    # the thresholds that decide tags, without implications, in model tag order
+                    cascade = Cascade(
+                        TagClassifier(tags, threshold, metadata=metadata, exclude_categories=exclude, device=args.device).thresholds,
+                        seqlen=args.cascade, margin=args.cascade_margin / 2.0, check=args.cascade_check,
+                    )
+
+                if args.watch:
+                    watch = FolderWatcher(
+                        args.paths,
+                        scan=lambda path: _dir_iter(path, args.recursive), accept=_dir_accepts,
+                        recursive=args.recursive,
+                        settle=args.watch_settle, max_delay=args.watch_delay, poll_interval=args.watch_poll,
+                    )
+
+                    print(
+                        f"Watching {', '.join(map(repr, args.paths))} "
+                        + ("with filesystem notifications" if watch.notify else f"by scanning every {args.watch_poll:g}s; install watchdog for notifications")
+                        + ". Press Ctrl+C to stop.",
+                        file=sys.stderr,
+                    )
+
+                _run_batched(
+                    replicas=ReplicaPool([Replica(model, device) for model, device in zip(models, devices)]),
+                    paths=args.paths, recursive=args.recursive,
+                    write_output=write_output, features=features, profiler=profiler,
+                    shard=(args.shard_index, args.shard_count),
+                    frames=args.frames, frame_sampling=args.frame_sampling, frame_reduce=args.frame_reduce,
+                    video_frames=args.video_frames, video_time_budget=args.video_budget,
+                    cascade=cascade, watch=watch,
+                    batch_size=args.batch, seqlen=args.seqlen,
+                    n_workers=args.workers, share_memory=args.shm,
+                    device=args.device,
+                )
+        except KeyboardInterrupt:
+            if watch is None:
+                raise
         finally:
+            profiler.close()
+
+            if watch is not None:
+                watch.close()
+
+            if features is not None:
+                features.close()
+
             if file is not None:
                 file.close()
+
+            if stop_metrics is not None:
+                stop_metrics()
     else:
         _run_interactive(
             model=model, tags=tags, rewrite_tag=rewrite_tag,
@@ -0,0 +1,118 @@
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Any, Callable, Generic, TypeVar
+from uuid import uuid4
+
+T = TypeVar("T")
+
+class Job(Generic[T]):
+    """
+    A background task that produces results incrementally.
+
+    The target is called on a separate thread with the job as its only argument,
+    and reports results with `add_result` while checking `cancelled`.
+    """
+
+    def __init__(self, total: int, target: Callable[["Job[T]"], None]) -> None:
+        self.id = uuid4().hex
+        self.total = total
+
+        self.status = "pending"
+        self.error: str | None = None
+        self.started: float | None = None
+        self.finished: float | None = None
+
+        self._target = target
+        self._results: list[T] = []
+        self._lock = Lock()
+        self._cancel = Event()
+        self._thread = Thread(target=self._run, name=f"job-{self.id[:8]}", daemon=True)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def running(self) -> bool:
+        return self.status in ("pending", "running")
+
+    @property
+    def done(self) -> int:
+        return len(self._results)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+
+        return (self.finished or monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0.0 else 0.0
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def close(self) -> None:
+        """Release resources held for the results. Called when the job is discarded."""
+
+    def add_result(self, result: T) -> None:
+        with self._lock:
+            self._results.append(result)
+
+    def results(self, start: int = 0, stop: int | None = None) -> list[T]:
+        with self._lock:
+            return self._results[start:stop]
+
+    def _run(self) -> None:
+        self.started = monotonic()
+        self.status = "running"
+
+        try:
+            self._target(self)
+        except Exception as ex:
+            self.error = str(ex)
+            self.status = "failed"
+        else:
+            self.status = "cancelled" if self.cancelled else "completed"
+        finally:
+            self.finished = monotonic()
+
+class JobRegistry:
+    """Keeps jobs by id, discarding the oldest finished jobs beyond `max_jobs`."""
+
+    def __init__(self, max_jobs: int = 8) -> None:
+        self.max_jobs = max_jobs
+        self._jobs: OrderedDict[str, Job[Any]] = OrderedDict()
+        self._lock = Lock()
+
+    def submit(self, job: Job[Any]) -> Job[Any]:
+        with self._lock:
+            self._jobs[job.id] = job
+
+            for job_id in list(self._jobs):
+                if len(self._jobs) <= self.max_jobs:
+                    break
+
+                if not self._jobs[job_id].running:
+                    self._jobs.pop(job_id).close()
+
+        job.start()
+        return job
+
+    def get(self, job_id: str | None) -> Job[Any] | None:
+        if not job_id:
+            return None
+
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def latest(self) -> Job[Any] | None:
+        with self._lock:
+            return next(reversed(self._jobs.values()), None)
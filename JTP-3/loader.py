@@ -1,4 +1,5 @@
 import os
+import sys
 
 from threading import Thread
 from typing import Iterable, Self
@@ -9,7 +10,8 @@ from multiprocessing.queues import SimpleQueue
 from torch import Tensor
 from torch.multiprocessing.queue import SimpleQueue as TorchQueue
 
-from model import load_image
+from model import load_frames, load_image, load_video
+from video import is_video_path
 
 class EnvScope:
     __slots__ = ("env", "saved")
@@ -46,16 +48,61 @@ class EnvScope:
 
         del self.saved
 
+class MainScope:
+    """Hides the main script from spawned processes, so that it is not re-run in workers."""
+
+    __slots__ = ("saved",)
+
+    def __init__(self) -> None:
+        self.saved: dict[str, object]
+
+    def __enter__(self) -> Self:
+        if hasattr(self, "saved"):
+            raise RuntimeError("MainScope is already in use.")
+
+        main = sys.modules["__main__"]
+        self.saved = {
+            key: main.__dict__[key]
+            for key in ("__file__", "__spec__")
+            if key in main.__dict__
+        }
+
+        main.__dict__.pop("__file__", None)
+        main.__spec__ = None
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        main = sys.modules["__main__"]
+        if "__spec__" not in self.saved:
+            del main.__spec__
+
+        main.__dict__.update(self.saved)
+        del self.saved
+
 class Loader:
     def __init__(
         self, n_workers: int = -1, *,
         patch_size: int = 16, max_seqlen: int = 1024,
-        share_memory: bool = True
+        share_memory: bool = True,
+        frames: int = 1, frame_sampling: str = "even",
+        video_frames: int = 8, video_time_budget: float | None = None,
     ) -> None:
+        """
+        With `frames` above 1, up to that many frames of animated images are loaded, and
+        every result has a leading frame dimension, as from `load_frames`. Videos are always
+        loaded as up to `video_frames` keyframes with a leading frame dimension, spending at
+        most about `video_time_budget` seconds decoding each.
+        """
+
         ctx = multiprocessing.get_context("spawn")
 
         self.patch_size = patch_size
         self.max_seqlen = max_seqlen
+        self.frames = frames
+        self.frame_sampling = frame_sampling
+        self.video_frames = video_frames
+        self.video_time_budget = video_time_budget
 
         if n_workers < 0:
             if hasattr(os, "process_cpu_count"):
@@ -67,7 +114,7 @@ class Loader:
             self._workers = []
             return
 
-        self._submission_queue: SimpleQueue[str | None] = SimpleQueue(ctx=ctx)
+        self._submission_queue: SimpleQueue[tuple[str, int] | None] = SimpleQueue(ctx=ctx)
         self._completion_queue: SimpleQueue[tuple[str, tuple[Tensor, Tensor, Tensor] | Exception] | None] = TorchQueue(ctx=ctx)
         self._workers = [
             ctx.Process(
@@ -76,8 +123,11 @@ class Loader:
                     self._submission_queue,
                     self._completion_queue,
                     patch_size,
-                    max_seqlen,
                     share_memory,
+                    frames,
+                    frame_sampling,
+                    video_frames,
+                    video_time_budget,
                 ),
                 name=f"loader-{idx}",
                 daemon=True
@@ -94,7 +144,7 @@ class Loader:
             ) for proc in self._workers
         ]
 
-        with EnvScope({
+        with MainScope(), EnvScope({
             "OMP_NUM_THREADS": 1,
             "OPENBLAS_NUM_THREADS": 1,
             "CUDA_VISIBLE_DEVICES": "",
@@ -105,13 +155,19 @@ class Loader:
             for thread in threads:
                 thread.join()
 
-    def load(self, paths: Iterable[str]) -> dict[str, tuple[Tensor, Tensor, Tensor] | Exception]:
+    def load(
+        self, paths: Iterable[str], *,
+        max_seqlen: int | None = None,
+    ) -> dict[str, tuple[Tensor, Tensor, Tensor] | Exception]:
+        """Load `paths`, at `max_seqlen` instead of the loader's sequence length if given."""
+
         loaded: dict[str, tuple[Tensor, Tensor, Tensor] | Exception] = {}
+        max_seqlen = self.max_seqlen if max_seqlen is None else max_seqlen
 
         if self._workers:
             count = 0
             for path in paths:
-                self._submission_queue.put(path)
+                self._submission_queue.put((path, max_seqlen))
                 count += 1
 
             for _ in range(count):
@@ -121,7 +177,10 @@ class Loader:
         else:
             for path in paths:
                 try:
-                    loaded[path] = load_image(path, self.patch_size, self.max_seqlen, False)
+                    loaded[path] = _load(
+                        path, self.patch_size, max_seqlen, False,
+                        self.frames, self.frame_sampling, self.video_frames, self.video_time_budget,
+                    )
                 except Exception as ex:
                     loaded[path] = ex
 
@@ -137,16 +196,42 @@ class Loader:
 
         self._workers.clear()
 
+def _load(
+    path: str,
+    patch_size: int,
+    max_seqlen: int,
+    share_memory: bool,
+    frames: int,
+    frame_sampling: str,
+    video_frames: int,
+    video_time_budget: float | None,
+) -> tuple[Tensor, Tensor, Tensor]:
+    if is_video_path(path):
+        return load_video(path, patch_size, max_seqlen, share_memory, frames=video_frames, time_budget=video_time_budget)
+
+    if frames > 1:
+        return load_frames(path, patch_size, max_seqlen, share_memory, frames=frames, sampling=frame_sampling)
+
+    return load_image(path, patch_size, max_seqlen, share_memory)
+
 def _worker_fn(
-    submission_queue: SimpleQueue[str | None],
+    submission_queue: SimpleQueue[tuple[str, int] | None],
     completion_queue: SimpleQueue[tuple[str, tuple[Tensor, Tensor, Tensor] | Exception] | None],
     patch_size: int,
-    max_seqlen: int,
     share_memory: bool,
+    frames: int,
+    frame_sampling: str,
+    video_frames: int,
+    video_time_budget: float | None,
 ):
-    while (path := submission_queue.get()) is not None:
+    while (task := submission_queue.get()) is not None:
+        path, max_seqlen = task
+
         try:
-            completion_queue.put((path, load_image(path, patch_size, max_seqlen, share_memory)))
+            completion_queue.put((path, _load(
+                path, patch_size, max_seqlen, share_memory,
+                frames, frame_sampling, video_frames, video_time_budget,
+            )))
         except Exception as ex:
             completion_queue.put((path, ex))
 
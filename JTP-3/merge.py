@@ -0,0 +1,204 @@
+import argparse
+import csv
+import os
+import sys
+
+from typing import Any
+
+import torch
+
+from features import FeatureStore
+
+csv.field_size_limit(1 << 30)
+
+def read_csv_outputs(path: str) -> tuple[list[str], dict[str, list[str]]]:
+    """Read a CSV written by `inference.py -o`, returning its header and rows by filename."""
+
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+
+        rows: dict[str, list[str]] = {}
+        for row in reader:
+            if row[0] in rows:
+                raise RuntimeError(f"{repr(path)} lists {repr(row[0])} more than once.")
+
+            rows[row[0]] = row
+
+    return header, rows
+
+def merge_csv(paths: list[str]) -> tuple[list[str], list[list[str]]]:
+    """Merge the CSV outputs of several shards, in canonical order of filename."""
+
+    header: list[str] | None = None
+    merged: dict[str, list[str]] = {}
+
+    for path in paths:
+        shard_header, rows = read_csv_outputs(path)
+
+        if header is None:
+            header = shard_header
+        elif shard_header != header:
+            raise RuntimeError(f"{repr(path)} has different tags than {repr(paths[0])}.")
+
+        for filename, row in rows.items():
+            if filename in merged:
+                raise RuntimeError(f"{repr(filename)} appears in more than one shard.")
+
+            merged[filename] = row
+
+    return header or [], [merged[filename] for filename in sorted(merged)]
+
+def merge_features(paths: list[str], output: str) -> int:
+    """Merge the feature stores of several shards into a new store, in canonical order of path."""
+
+    shards = [FeatureStore(path, "r") for path in paths]
+
+    try:
+        dim = shards[0].dim
+        model = shards[0].meta.get("model", "")
+
+        entries: dict[str, tuple[FeatureStore, int]] = {}
+        for path, shard in zip(paths, shards):
+            if shard.dim != dim or shard.meta.get("model", "") != model:
+                raise RuntimeError(f"{repr(path)} was stored by a different model than {repr(paths[0])}.")
+
+            for idx, image_path in enumerate(shard.paths):
+                if image_path in entries:
+                    raise RuntimeError(f"{repr(image_path)} appears in more than one shard.")
+
+                entries[image_path] = (shard, idx)
+
+        with FeatureStore(output, "w", dim=dim, model=model) as merged:
+            for image_path in sorted(entries):
+                shard, idx = entries[image_path]
+                merged.append(image_path, shard.get(idx))
+
+        return len(entries)
+    finally:
+        for shard in shards:
+            shard.close()
+
+def compare_csv(header: list[str], rows: list[list[str]], reference: str) -> list[str]:
+    """Compare merged rows with a single-node CSV output, ignoring order. Returns a list of differences."""
+
+    ref_header, ref_rows = read_csv_outputs(reference)
+    if ref_header != header:
+        return ["tags differ"]
+
+    problems: list[str] = []
+    merged = { row[0]: row for row in rows }
+
+    for filename in sorted(ref_rows.keys() - merged.keys()):
+        problems.append(f"{repr(filename)} is missing")
+
+    for filename in sorted(merged.keys() - ref_rows.keys()):
+        problems.append(f"{repr(filename)} is not in the reference")
+
+    for filename in sorted(merged.keys() & ref_rows.keys()):
+        if merged[filename] != ref_rows[filename]:
+            problems.append(f"{repr(filename)} has different probabilities")
+
+    return problems
+
+def compare_features(path: str, reference: str) -> list[str]:
+    """Compare a merged feature store with a single-node one, ignoring order. Returns a list of differences."""
+
+    problems: list[str] = []
+
+    with FeatureStore(path, "r") as merged, FeatureStore(reference, "r") as ref:
+        if merged.dim != ref.dim:
+            return ["dimensions differ"]
+
+        merged_idx = { image_path: idx for idx, image_path in enumerate(merged.paths) }
+        ref_idx = { image_path: idx for idx, image_path in enumerate(ref.paths) }
+
+        for image_path in sorted(ref_idx.keys() - merged_idx.keys()):
+            problems.append(f"{repr(image_path)} is missing")
+
+        for image_path in sorted(merged_idx.keys() - ref_idx.keys()):
+            problems.append(f"{repr(image_path)} is not in the reference")
+
+        for image_path in sorted(merged_idx.keys() & ref_idx.keys()):
+            if not torch.equal(merged.get(merged_idx[image_path]), ref.get(ref_idx[image_path])):
+                problems.append(f"{repr(image_path)} has different features")
+
+    return problems
+
+if __name__ == "__main__":
+    def main() -> None:
+        parser = argparse.ArgumentParser(
+            description="Merge the outputs of inference.py runs with --shard-index and --shard-count."
+        )
+        parser.add_argument(
+            "shards", nargs="+",
+            help="Paths to the CSV outputs (-o) or feature stores (--save-features) of every shard."
+        )
+        parser.add_argument(
+            "-o", "--output", required=True,
+            help="Path to the merged .csv file, or '-' for standard output. With --features, the merged feature store directory."
+        )
+        parser.add_argument(
+            "--features", action="store_true",
+            help="Merge feature stores instead of CSV outputs."
+        )
+        parser.add_argument(
+            "--check", metavar="REFERENCE",
+            help="Verify the merged output against the output of an unsharded run, ignoring order."
+        )
+
+        args = parser.parse_args()
+
+        problems: list[str] = []
+
+        if args.features:
+            if args.output == "-":
+                parser.error("--features requires an output directory")
+            if os.path.exists(os.path.join(args.output, "meta.json")):
+                parser.error(f"{repr(args.output)} already contains a feature store")
+
+        # shards that overlap, or were written with different tags or models
+        try:
+            if args.features:
+                count = merge_features(args.shards, args.output)
+                print(f"Merged {count} images from {len(args.shards)} shards.", file=sys.stderr)
+
+                if args.check:
+                    problems = compare_features(args.output, args.check)
+            else:
+                header, rows = merge_csv(args.shards)
+                print(f"Merged {len(rows)} images from {len(args.shards)} shards.", file=sys.stderr)
+
+                out_file: Any = None
+                writer: Any
+
+                if args.output == "-":
+                    writer = csv.writer(sys.stdout)
+                else:
+                    out_file = open(args.output, "w", encoding="utf-8", newline="")
+                    writer = csv.writer(out_file)
+
+                try:
+                    writer.writerow(header)
+                    writer.writerows(rows)
+                finally:
+                    if out_file is not None:
+                        out_file.close()
+
+                if args.check:
+                    problems = compare_csv(header, rows, args.check)
+        except RuntimeError as ex:
+            print(ex, file=sys.stderr)
+            sys.exit(1)
+
+        if args.check:
+            for problem in problems[:20]:
+                print(f"  {problem}", file=sys.stderr)
+
+            if problems:
+                print(f"{len(problems)} differences from {repr(args.check)}.", file=sys.stderr)
+                sys.exit(1)
+
+            print(f"Identical to {repr(args.check)}.", file=sys.stderr)
+
+    main()
@@ -0,0 +1,240 @@
+import os
+import sys
+
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Any, Callable, ContextManager, Iterator
+
+# seconds; spans a patchify (~1ms) to a cold CPU forward pass with a slow image fetch
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_NULL = nullcontext()
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+def _value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, n_buckets: int) -> None:
+        self.counts = [0] * (n_buckets + 1)
+        self.sum = 0.0
+        self.count = 0
+
+class Metrics:
+    """
+    Stage latency histograms, counters and gauges, rendered in the Prometheus text format.
+
+    Disabled by default, in which case `stage` returns a shared no-op context manager and
+    `count` returns immediately, so instrumented code costs one attribute lookup per call.
+    Gauges are callbacks evaluated only when rendering.
+    """
+
+    def __init__(self, enabled: bool = False, buckets: tuple[float, ...] = STAGE_BUCKETS) -> None:
+        self.enabled = enabled
+        self.buckets = buckets
+
+        self._histograms: dict[str, _Histogram] = {}
+        self._counters: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+        self._gauges: dict[str, tuple[str, str, Callable[[], float | dict[tuple[tuple[str, str], ...], float] | None]]] = {}
+        self._help: dict[str, str] = {}
+        self._lock = Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        idx = bisect_left(self.buckets, seconds)
+
+        with self._lock:
+            if (hist := self._histograms.get(stage)) is None:
+                hist = self._histograms[stage] = _Histogram(len(self.buckets))
+
+            hist.counts[idx] += 1
+            hist.sum += seconds
+            hist.count += 1
+
+    @contextmanager
+    def _timed(self, stage: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.count("errors", stage=stage)
+            raise
+        finally:
+            self.observe(stage, perf_counter() - start)
+
+    def stage(self, stage: str) -> ContextManager[None]:
+        """Time a block as `stage`, counting it as an error if it raises."""
+
+        if not self.enabled:
+            return _NULL
+
+        return self._timed(stage)
+
+    def count(self, name: str, value: float = 1, **labels: str) -> None:
+        """Increment the counter `jtp_<name>_total`."""
+
+        if not self.enabled:
+            return
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        fn: Callable[[], float | dict[tuple[tuple[str, str], ...], float] | None],
+        *,
+        kind: str = "gauge",
+    ) -> None:
+        """
+        Register the metric `jtp_<name>`, evaluated by `fn` when rendering.
+
+        `fn` may return a single value, a dict of values by label tuples, or None to omit it.
+        Totals kept elsewhere, such as cache statistics, may be exported with `kind="counter"`.
+        """
+
+        self._gauges[name] = (help, kind, fn)
+
+    def describe(self, name: str, help: str) -> None:
+        self._help[name] = help
+
+    def render(self) -> str:
+        lines: list[str] = []
+
+        with self._lock:
+            histograms = {
+                stage: (list(hist.counts), hist.sum, hist.count)
+                for stage, hist in self._histograms.items()
+            }
+            counters = dict(self._counters)
+
+        lines.append("# HELP jtp_stage_seconds Time spent in each processing stage.")
+        lines.append("# TYPE jtp_stage_seconds histogram")
+        for stage, (counts, total, count) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, bucket in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'jtp_stage_seconds_bucket{_labels({"stage": stage, "le": le})} {cumulative}')
+
+            lines.append(f"jtp_stage_seconds_sum{_labels({'stage': stage})} {total!r}")
+            lines.append(f"jtp_stage_seconds_count{_labels({'stage': stage})} {count}")
+
+        for name in sorted({ name for name, _ in counters }):
+            lines.append(f"# HELP jtp_{name}_total {self._help.get(name, name.replace('_', ' ').capitalize() + '.')}")
+            lines.append(f"# TYPE jtp_{name}_total counter")
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f"jtp_{name}_total{_labels(dict(labels))} {_value(value)}")
+
+        for name, (help, kind, fn) in sorted(self._gauges.items()):
+            try:
+                values = fn()
+            except Exception:
+                continue
+
+            if values is None:
+                continue
+
+            if not isinstance(values, dict):
+                values = { (): values }
+
+            lines.append(f"# HELP jtp_{name} {help}")
+            lines.append(f"# TYPE jtp_{name} {kind}")
+            for labels, value in sorted(values.items()):
+                lines.append(f"jtp_{name}{_labels(dict(labels))} {_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str) -> None:
+        """Write the rendered metrics to a file atomically, or to standard error for '-'."""
+
+        text = self.render()
+
+        if path == "-":
+            print(text, end="", file=sys.stderr)
+            return
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(text)
+
+        os.replace(tmp_path, path)
+
+    def dump_every(self, path: str, interval: float) -> Callable[[], None]:
+        """Dump metrics every `interval` seconds in a background thread. Returns a function that stops it with a final dump."""
+
+        stop = Event()
+
+        def run() -> None:
+            while not stop.wait(interval):
+                self.dump(path)
+
+        thread = Thread(target=run, name="jtp-metrics", daemon=True)
+        thread.start()
+
+        def close() -> None:
+            stop.set()
+            thread.join()
+            self.dump(path)
+
+        return close
+
+def process_memory() -> dict[tuple[tuple[str, str], ...], float] | None:
+    """Resident and virtual memory of this process in bytes, where available."""
+
+    try:
+        with open("/proc/self/statm", "r") as file:
+            vms, rss = (int(value) for value in file.read().split()[:2])
+
+        page = os.sysconf("SC_PAGE_SIZE")
+        return { (("type", "rss"),): rss * page, (("type", "vms"),): vms * page }
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+
+        # max RSS, in kilobytes on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return { (("type", "max_rss"),): maxrss if sys.platform == "darwin" else maxrss * 1024 }
+    except ImportError:
+        return None
+
+def device_memory(device: Any) -> dict[tuple[tuple[str, str], ...], float] | None:
+    import torch
+
+    device = torch.device(device)
+    if device.type != "cuda":
+        return None
+
+    return {
+        (("type", "allocated"),): torch.cuda.memory_allocated(device),
+        (("type", "reserved"),): torch.cuda.memory_reserved(device),
+        (("type", "max_allocated"),): torch.cuda.max_memory_allocated(device),
+    }
+
+def device_utilization(device: Any) -> float | None:
+    import torch
+
+    device = torch.device(device)
+    if device.type != "cuda":
+        return None
+
+    # requires pynvml; raises without it, which omits the gauge
+    return torch.cuda.utilization(device)
+
+metrics = Metrics()
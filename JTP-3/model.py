@@ -2,6 +2,7 @@
 # Original file remains licensed under the Apache License, Version 2.0. See /LICENSE.
 
 from math import ceil
+from typing import Any, BinaryIO, Callable
 
 import torch
 from torch import Tensor
@@ -13,8 +14,11 @@ from timm.models import NaFlexVit
 from PIL import Image
 
 from safetensors import safe_open
+from safetensors.torch import save_file
 
-from image import process_srgb, put_srgb_patch
+from image import FRAME_PIXEL_BUDGET, process_srgb, put_srgb_patch, sample_frames
+from video import sample_video
+from metrics import metrics
 
 def sdpa_attn_mask(
     patch_valid: Tensor,
@@ -37,6 +41,25 @@ def sdpa_attn_mask(
 
 timm.models.naflexvit.create_attention_mask = sdpa_attn_mask
 
+def forward_head_classes(
+    model: NaFlexVit,
+    x: Tensor,
+    classes: Tensor,
+    patch_valid: Tensor | None = None,
+) -> Tensor:
+    """Equivalent to `model.forward_head` restricted to the selected classes of a hydra head."""
+
+    num_prefix_tokens = model.num_prefix_tokens if model.pool_include_prefix else 0
+    attn_mask = sdpa_attn_mask(patch_valid, num_prefix_tokens) if patch_valid is not None else None
+
+    if not model.pool_include_prefix:
+        x = x[:, model.num_prefix_tokens:]
+
+    x = model.attn_pool(x, attn_mask=attn_mask, classes=classes)
+    x = model.fc_norm(x)
+    x = model.head_drop(x)
+    return model.head(x)
+
 def get_image_size_for_seq(
     image_hw: tuple[int, int],
     patch_size: int = 16,
@@ -87,12 +110,15 @@ def get_image_size_for_seq(
     assert py >= 1 and px >= 1
     return py * patch_size, px * patch_size
 
-def process_image(img: Image.Image, patch_size: int, max_seq_len: int) -> Image.Image:
+def _seq_resize(patch_size: int, max_seq_len: int) -> Callable[[tuple[int, int]], tuple[int, int]]:
     def compute_resize(wh: tuple[int, int]) -> tuple[int, int]:
         h, w = get_image_size_for_seq((wh[1], wh[0]), patch_size, max_seq_len)
         return w, h
 
-    return process_srgb(img, resize=compute_resize)
+    return compute_resize
+
+def process_image(img: Image.Image, patch_size: int, max_seq_len: int) -> Image.Image:
+    return process_srgb(img, resize=_seq_resize(patch_size, max_seq_len))
 
 def patchify_image(img: Image.Image, patch_size: int, max_seq_len: int, share_memory: bool = False) -> tuple[Tensor, Tensor, Tensor]:
     patches = torch.zeros(max_seq_len, patch_size * patch_size * 3, device="cpu", dtype=torch.uint8)
@@ -104,9 +130,93 @@ def patchify_image(img: Image.Image, patch_size: int, max_seq_len: int, share_me
         patch_coords.share_memory_()
         patch_valid.share_memory_()
 
-    put_srgb_patch(img, patches, patch_coords, patch_valid, patch_size)
+    with metrics.stage("patchify"):
+        put_srgb_patch(img, patches, patch_coords, patch_valid, patch_size)
+
+    return patches, patch_coords, patch_valid
+
+def process_frames(
+    img: Image.Image,
+    patch_size: int,
+    max_seq_len: int,
+    *,
+    frames: int = 1,
+    sampling: str = "even",
+    max_pixels: int = FRAME_PIXEL_BUDGET,
+) -> list[Image.Image]:
+    """Process up to `frames` sampled frames of an animated image, or only the image if it is still."""
+
+    return [
+        process_image(frame, patch_size, max_seq_len)
+        for frame in sample_frames(img, frames, sampling=sampling, max_pixels=max_pixels)
+    ]
+
+def patchify_frames(
+    frames: list[Image.Image],
+    patch_size: int,
+    max_seq_len: int,
+    share_memory: bool = False,
+) -> tuple[Tensor, Tensor, Tensor]:
+    """Patchify processed frames into tensors with a leading frame dimension."""
+
+    patches = torch.zeros(len(frames), max_seq_len, patch_size * patch_size * 3, device="cpu", dtype=torch.uint8)
+    patch_coords = torch.zeros(len(frames), max_seq_len, 2, device="cpu", dtype=torch.int16)
+    patch_valid = torch.zeros(len(frames), max_seq_len, device="cpu", dtype=torch.bool)
+
+    if share_memory:
+        patches.share_memory_()
+        patch_coords.share_memory_()
+        patch_valid.share_memory_()
+
+    with metrics.stage("patchify"):
+        for idx, frame in enumerate(frames):
+            put_srgb_patch(frame, patches[idx], patch_coords[idx], patch_valid[idx], patch_size)
+
     return patches, patch_coords, patch_valid
 
+def process_video(
+    source: str | BinaryIO,
+    patch_size: int,
+    max_seq_len: int,
+    *,
+    frames: int = 8,
+    time_budget: float | None = None,
+) -> list[Image.Image]:
+    """Decode up to `frames` keyframes of a video, already sized for `max_seq_len`."""
+
+    return sample_video(source, frames, resize=_seq_resize(patch_size, max_seq_len), time_budget=time_budget)
+
+FRAME_REDUCTIONS = ("max", "mean")
+
+def reduce_frames(output: Tensor, counts: list[int], reduce: str = "max") -> Tensor:
+    """Combine the (frames, tags) outputs of consecutive runs of `counts` frames into one row each."""
+
+    if all(count == 1 for count in counts):
+        return output
+
+    match reduce:
+        case "max":
+            return torch.stack([chunk.amax(dim=0) for chunk in output.split(counts)])
+        case "mean":
+            return torch.stack([chunk.mean(dim=0) for chunk in output.split(counts)])
+        case _:
+            raise ValueError(f"Unrecognized frame reduction: {reduce}")
+
+def prepare_batch(
+    patches: list[Tensor],
+    patch_coords: list[Tensor],
+    patch_valid: list[Tensor],
+    device: torch.device | str | None = None,
+) -> tuple[Tensor, Tensor, Tensor]:
+    p_d = torch.stack(patches).to(device=device, non_blocking=True)
+    pc_d = torch.stack(patch_coords).to(device=device, non_blocking=True)
+    pv_d = torch.stack(patch_valid).to(device=device, non_blocking=True)
+
+    p_d = p_d.to(dtype=torch.bfloat16).div_(127.5).sub_(1.0)
+    pc_d = pc_d.to(dtype=torch.int32)
+
+    return p_d, pc_d, pv_d
+
 def load_image(
     path: str,
     patch_size: int = 16,
@@ -127,7 +237,49 @@ def load_image(
 
     return patchify_image(processed, patch_size, max_seq_len, share_memory)
 
-def load_model(path: str, device: torch.device | str | None = None) -> tuple[NaFlexVit, list[str]]:
+def load_frames(
+    path: str,
+    patch_size: int = 16,
+    max_seq_len: int = 1024,
+    share_memory: bool = False,
+    *,
+    frames: int = 1,
+    sampling: str = "even",
+) -> tuple[Tensor, Tensor, Tensor]:
+    """Like `load_image`, for up to `frames` sampled frames, with a leading frame dimension."""
+
+    with open(path, "rb", buffering=(1024 * 1024)) as file:
+        img: Image.Image = Image.open(file)
+
+        try:
+            processed = process_frames(img, patch_size, max_seq_len, frames=frames, sampling=sampling)
+        except:
+            img.close()
+            raise
+
+    if all(frame is not img for frame in processed):
+        img.close()
+
+    return patchify_frames(processed, patch_size, max_seq_len, share_memory)
+
+def load_video(
+    path: str,
+    patch_size: int = 16,
+    max_seq_len: int = 1024,
+    share_memory: bool = False,
+    *,
+    frames: int = 8,
+    time_budget: float | None = None,
+) -> tuple[Tensor, Tensor, Tensor]:
+    """Like `load_frames`, for up to `frames` keyframes of a video."""
+
+    processed = process_video(path, patch_size, max_seq_len, frames=frames, time_budget=time_budget)
+    return patchify_frames(processed, patch_size, max_seq_len, share_memory)
+
+INFERENCE_FORM = "inference"
+HEAD_DTYPES = ("bf16", "fp16", "int8")
+
+def _read_model_file(path: str) -> tuple[dict[str, str], dict[str, Tensor]]:
     with safe_open(path, framework="pt", device="cpu") as file:
         metadata = file.metadata()
 
@@ -136,18 +288,65 @@ def load_model(path: str, device: torch.device | str | None = None) -> tuple[NaF
             for key in file.keys()
         }
 
+    return metadata, state_dict
+
+def _quantize_dim(key: str) -> int:
+    # BatchLinear weights are (classes, in, out) with a tiny output dimension
+    return -2 if key.endswith("out_proj.weight") else -1
+
+def _quantize_head(state_dict: dict[str, Tensor], head_dtype: str) -> None:
+    for key in [key for key in state_dict if key.startswith("attn_pool.")]:
+        value = state_dict[key]
+        if value.ndim < 2 or not value.is_floating_point():
+            continue
+
+        match head_dtype:
+            case "bf16":
+                pass
+
+            case "fp16":
+                state_dict[key] = value.to(dtype=torch.float16)
+
+            case "int8":
+                value = value.float()
+                scale = value.abs().amax(_quantize_dim(key), keepdim=True).clamp_min_(1e-12).div_(127.0)
+
+                state_dict[key] = value.div(scale).round_().clamp_(-127, 127).to(dtype=torch.int8)
+                state_dict[f"{key}.scale"] = scale
+
+            case _:
+                raise ValueError(f"Unrecognized head dtype: {head_dtype}")
+
+def _dequantize_head(state_dict: dict[str, Tensor]) -> None:
+    # heads are stored quantized to make the file smaller, and run in bf16 like the rest of the model
+    for key in [key for key in state_dict if key.startswith("attn_pool.") and key.endswith(".scale")]:
+        scale = state_dict.pop(key)
+        weight_key = key[:-6]
+        state_dict[weight_key] = state_dict[weight_key].float().mul_(scale).to(dtype=torch.bfloat16)
+
+def _build_model(
+    metadata: dict[str, str],
+    state_dict: dict[str, Tensor],
+    device: torch.device | str | None = None,
+    *,
+    backbone_args: dict[str, Any] | None = None,
+) -> tuple[NaFlexVit, list[str]]:
     arch = metadata["modelspec.architecture"]
     if not arch.startswith("naflexvit_so400m_patch16_siglip"):
         raise ValueError(f"Unrecognized model architecture: {arch}")
 
     tags = metadata["classifier.labels"].split("\n")
 
+    if metadata.get("classifier.head_dtype") == "int8":
+        _dequantize_head(state_dict)
+
     model = timm.create_model(
         'naflexvit_so400m_patch16_siglip',
         pretrained=False, num_classes=0,
         pos_embed_interp_mode="bilinear",
         weight_init="", fix_init=False,
         device="cpu", dtype=torch.bfloat16,
+        **(backbone_args or {}),
     )
 
     match arch[31:]:
@@ -176,6 +375,7 @@ def load_model(path: str, device: torch.device | str | None = None) -> tuple[NaF
         case "+rr_hydra":
             from hydra_pool import HydraPool
 
+            # the inference form has no roots, so the stored q is used directly
             model.attn_pool = HydraPool.for_state(
                 state_dict, "attn_pool.",
                 device=device, dtype=torch.bfloat16
@@ -188,8 +388,63 @@ def load_model(path: str, device: torch.device | str | None = None) -> tuple[NaF
         case _:
             raise ValueError(f"Unrecognized model architecture: {arch}")
 
-    model.eval().to(dtype=torch.bfloat16)
+    # load before eval() so HydraPool sees the stored q and skips deriving it from roots
     model.load_state_dict(state_dict, strict=True)
+    model.eval().to(dtype=torch.bfloat16)
     model.to(device=device)
 
     return model, tags
+
+def load_model(path: str, device: torch.device | str | None = None) -> tuple[NaFlexVit, list[str]]:
+    metadata, state_dict = _read_model_file(path)
+    return _build_model(metadata, state_dict, device)
+
+def load_models(path: str, devices: list[str]) -> tuple[list[NaFlexVit], list[str]]:
+    """
+    Load one replica of a model per device, reading the file once.
+
+    Devices listed more than once share a replica, since model calls do not modify it.
+    """
+
+    metadata, state_dict = _read_model_file(path)
+
+    replicas: dict[torch.device, NaFlexVit] = {}
+    tags: list[str] = []
+
+    for device in map(torch.device, devices):
+        if device not in replicas:
+            # _build_model may modify the state dict it is given
+            replicas[device], tags = _build_model(metadata, dict(state_dict), device)
+
+    return [replicas[torch.device(device)] for device in devices], tags
+
+def export_inference_model(src_path: str, dst_path: str, *, head_dtype: str = "bf16") -> None:
+    if head_dtype not in HEAD_DTYPES:
+        raise ValueError(f"Unrecognized head dtype: {head_dtype}")
+
+    metadata, state_dict = _read_model_file(src_path)
+    if metadata.get("classifier.form") == INFERENCE_FORM:
+        raise ValueError(f"{src_path} is already in inference form.")
+
+    if not metadata["modelspec.architecture"].endswith("+rr_hydra"):
+        raise ValueError("Only hydra models can be exported in inference form.")
+
+    model, _ = _build_model(metadata, state_dict, "cpu")
+    del state_dict
+
+    model.attn_pool.inference()
+
+    state_dict = {
+        key: value.contiguous()
+        for key, value in model.state_dict().items()
+        if isinstance(value, Tensor)
+    }
+    del model
+
+    _quantize_head(state_dict, head_dtype)
+
+    save_file(state_dict, dst_path, metadata={
+        **metadata,
+        "classifier.form": INFERENCE_FORM,
+        "classifier.head_dtype": head_dtype,
+    })
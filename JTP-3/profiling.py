@@ -0,0 +1,208 @@
+import os
+import sys
+
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from threading import Event, Thread, get_ident
+from typing import ContextManager, Iterator
+
+import torch
+from torch.profiler import ProfilerActivity, profile, record_function
+
+_NULL = nullcontext()
+
+Frame = tuple[str, int, str]
+
+class StackSampler:
+    """
+    Samples the Python stack of one thread at a fixed interval, counting functions by stage.
+
+    The sampled thread labels what it is doing by setting `stage`. A function's self count is
+    how often it was on top of the stack, and its total count how often it was anywhere in it.
+    """
+
+    def __init__(self, interval: float = 0.005, thread_id: int | None = None) -> None:
+        self.interval = interval
+        self.thread_id = get_ident() if thread_id is None else thread_id
+        self.stage = "other"
+
+        self.samples: Counter[str] = Counter()
+        self.self_counts: Counter[tuple[str, Frame]] = Counter()
+        self.total_counts: Counter[tuple[str, Frame]] = Counter()
+
+        self._stop = Event()
+        self._thread: Thread | None = None
+
+    def _sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+
+        stage = self.stage
+        self.samples[stage] += 1
+
+        seen: set[Frame] = set()
+        top = True
+
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_filename, code.co_firstlineno, code.co_name)
+
+            if top:
+                self.self_counts[stage, key] += 1
+                top = False
+
+            if key not in seen:
+                seen.add(key)
+                self.total_counts[stage, key] += 1
+
+            frame = frame.f_back
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="jtp-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def summary(self, limit: int = 15) -> str:
+        lines: list[str] = []
+        n_samples = sum(self.samples.values())
+
+        for stage, count in self.samples.most_common():
+            lines.append(f"{stage}: {count} samples ({count / max(n_samples, 1) * 100:.1f}%), about {count * self.interval:.2f}s")
+            lines.append(f"  {'self':>6s} {'total':>6s}  function")
+
+            ranked = sorted(
+                ((key, total) for (s, key), total in self.total_counts.items() if s == stage),
+                key=lambda item: (self.self_counts[stage, item[0]], item[1]),
+                reverse=True,
+            )
+
+            for (filename, lineno, name), total in ranked[:limit]:
+                own = self.self_counts[stage, (filename, lineno, name)]
+                location = f"{os.path.relpath(filename) if not filename.startswith('<') else filename}:{lineno}"
+                lines.append(f"  {own / count * 100:5.1f}% {total / count * 100:5.1f}%  {name} ({location})")
+
+            lines.append("")
+
+        return "\n".join(lines)
+
+class BatchProfiler:
+    """
+    Profiles a window of batches: a torch profiler trace of the operators, and Python stack
+    samples labelled by stage, such as loading and output.
+
+    `skip` batches run first without profiling, so the window excludes warm up. Outside of
+    the window, and when `path` is None, `step` and `stage` do nothing. Results are written
+    to `<path>.json`, a Chrome trace for chrome://tracing or https://ui.perfetto.dev, and
+    `<path>.txt`, a summary of the top operators and Python functions.
+    """
+
+    def __init__(
+        self,
+        path: str | None,
+        *,
+        device: torch.device | str,
+        skip: int = 2,
+        batches: int = 8,
+        interval: float = 0.005,
+    ) -> None:
+        self.path = path
+        self.device = torch.device(device)
+        self.skip = skip
+        self.batches = batches
+        self.interval = interval
+
+        self.enabled = False
+        self._step = 0
+        self._profile: profile | None = None
+        self._sampler: StackSampler | None = None
+
+    def _start(self) -> None:
+        activities = [ProfilerActivity.CPU]
+        if self.device.type == "cuda":
+            activities.append(ProfilerActivity.CUDA)
+
+        self._profile = profile(activities=activities, record_shapes=True)
+        self._profile.start()
+
+        self._sampler = StackSampler(self.interval)
+        self._sampler.start()
+
+        self.enabled = True
+        print(f"Profiling {self.batches} batches ...", file=sys.stderr)
+
+    def _finish(self) -> None:
+        assert self.path is not None and self._profile is not None and self._sampler is not None
+
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+
+        self._sampler.stop()
+        self._profile.stop()
+        self.enabled = False
+
+        self._profile.export_chrome_trace(f"{self.path}.json")
+
+        sort_by = "self_cuda_time_total" if self.device.type == "cuda" else "self_cpu_time_total"
+        with open(f"{self.path}.txt", "w", encoding="utf-8") as file:
+            file.write(f"Top operators over {self._step - self.skip} batches, by {sort_by}:\n\n")
+            file.write(self._profile.key_averages().table(sort_by=sort_by, row_limit=25))
+            file.write(f"\n\nPython stack samples every {self.interval * 1000:.0f}ms, by stage:\n\n")
+            file.write(self._sampler.summary())
+
+        print(f"Wrote profile to {repr(self.path + '.json')} and {repr(self.path + '.txt')}", file=sys.stderr)
+        self._profile = None
+        self._sampler = None
+
+    def step(self) -> None:
+        """Mark the start of a batch."""
+
+        if self.path is None:
+            return
+
+        if self._step == self.skip:
+            self._start()
+        elif self._step == self.skip + self.batches and self.enabled:
+            self._finish()
+
+        self._step += 1
+
+    def close(self) -> None:
+        """Finish a window cut short by running out of batches."""
+
+        if self.enabled:
+            self._finish()
+
+    @contextmanager
+    def _stage(self, name: str) -> Iterator[None]:
+        assert self._sampler is not None
+
+        # other threads appear in the trace, but only the sampled thread labels samples
+        sampled = get_ident() == self._sampler.thread_id
+        previous = self._sampler.stage
+
+        if sampled:
+            self._sampler.stage = name
+
+        try:
+            with record_function(name):
+                yield
+        finally:
+            if sampled:
+                self._sampler.stage = previous
+
+    def stage(self, name: str) -> ContextManager[None]:
+        if not self.enabled:
+            return _NULL
+
+        return self._stage(name)
@@ -0,0 +1,238 @@
+import os
+
+from concurrent.futures import Future
+from io import BytesIO
+from itertools import count
+from threading import Event, Lock, Thread
+
+import multiprocessing
+from multiprocessing.connection import wait
+from multiprocessing.queues import SimpleQueue
+
+import torch
+from torch import Tensor
+from torch.multiprocessing.queue import SimpleQueue as TorchQueue
+
+from timm.models import NaFlexVit
+
+from PIL import Image
+
+from loader import EnvScope, MainScope
+from model import patchify_frames, prepare_batch, process_frames, process_video, reduce_frames
+from video import is_video_data
+
+class ModelWorkers:
+    """
+    Runs image preprocessing and model calls in worker processes that share one copy of the weights.
+
+    The model's parameters are moved to shared memory once, and each worker attaches them
+    instead of loading its own copy, so adding workers costs only their activations. Requests
+    go to whichever worker is free through a shared queue. Each worker runs with an equal
+    share of the cores, so Python preprocessing of concurrent requests does not contend on
+    one GIL. Only CPU models can be shared this way.
+
+    If a worker process dies, the workers are broken: every pending request fails, the
+    remaining workers are stopped, and later requests fail immediately.
+    """
+
+    def __init__(
+        self,
+        model: NaFlexVit,
+        n_workers: int,
+        *,
+        patch_size: int = 16,
+        max_seqlen: int = 1024,
+    ) -> None:
+        if n_workers < 1:
+            raise ValueError("At least one worker is required.")
+
+        if next(model.parameters()).device.type != "cpu":
+            raise ValueError("Only CPU models can be shared between worker processes.")
+
+        ctx = multiprocessing.get_context("spawn")
+
+        n_cores = os.process_cpu_count() if hasattr(os, "process_cpu_count") else os.cpu_count()
+        n_threads = max(1, (n_cores or 1) // n_workers)
+
+        model.share_memory()
+
+        self._submission_queue: SimpleQueue[tuple[int, bytes, int, float | None] | None] = SimpleQueue(ctx=ctx)
+        self._completion_queue: SimpleQueue[tuple[int, Tensor | Exception] | None] = TorchQueue(ctx=ctx)
+        self._pending: dict[int, Future[Tensor]] = {}
+        self._ids = count()
+        self._lock = Lock()
+        self._closing = Event()
+        self._broken: str | None = None
+
+        self._workers = [
+            ctx.Process(
+                target=_worker_fn,
+                args=(
+                    model,
+                    self._submission_queue,
+                    self._completion_queue,
+                    patch_size,
+                    max_seqlen,
+                    n_threads,
+                ),
+                name=f"model-{idx}",
+                daemon=True,
+            )
+            for idx in range(n_workers)
+        ]
+
+        with MainScope(), EnvScope({
+            "OMP_NUM_THREADS": n_threads,
+            "OPENBLAS_NUM_THREADS": n_threads,
+            "CUDA_VISIBLE_DEVICES": "",
+        }):
+            for proc in self._workers:
+                proc.start()
+
+        self._receiver = Thread(target=self._receive, name="model-workers", daemon=True)
+        self._receiver.start()
+
+        self._monitor = Thread(target=self._watch, name="model-workers-monitor", daemon=True)
+        self._monitor.start()
+
+    def __len__(self) -> int:
+        return len(self._workers)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def broken(self) -> bool:
+        return self._broken is not None
+
+    def _receive(self) -> None:
+        while (result := self._completion_queue.get()) is not None:
+            request_id, output = result
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+
+            if future is None: # timed out, or failed when the workers broke
+                continue
+
+            if isinstance(output, Exception):
+                future.set_exception(output)
+            else:
+                future.set_result(output)
+
+    def _watch(self) -> None:
+        sentinels = { proc.sentinel: proc for proc in self._workers }
+
+        while sentinels:
+            for sentinel in wait(list(sentinels)):
+                proc = sentinels.pop(sentinel) # type: ignore[call-overload]
+                proc.join()
+
+                if not self._closing.is_set() and self._broken is None:
+                    self._break(f"Worker process {proc.name} exited unexpectedly with code {proc.exitcode}.")
+
+        # every worker has exited, so nothing else will be put on the queue
+        self._completion_queue.put(None)
+
+    def _break(self, reason: str) -> None:
+        with self._lock:
+            self._broken = reason
+            pending = list(self._pending.values())
+            self._pending.clear()
+
+        for future in pending:
+            future.set_exception(RuntimeError(reason))
+
+        # a worker killed while waiting for a request may hold the submission queue's lock
+        for proc in self._workers:
+            if proc.is_alive():
+                proc.terminate()
+
+    def submit(self, image: bytes, frames: int = 1, time_budget: float | None = None) -> Future[Tensor]:
+        """
+        Classify an encoded image or video, resolving to its probabilities scaled to -1 to 1.
+
+        Animated images and videos are classified from up to `frames` sampled frames, combined
+        by their maximum. Videos stop decoding frames after `time_budget` seconds.
+        """
+
+        future: Future[Tensor] = Future()
+
+        with self._lock:
+            if self._broken is not None:
+                raise RuntimeError(self._broken)
+
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+
+        self._submission_queue.put((request_id, image, frames, time_budget))
+        return future
+
+    def predict(
+        self, image: bytes, frames: int = 1, time_budget: float | None = None, *,
+        timeout: float | None = None,
+    ) -> Tensor:
+        """Like `submit`, but waits for the result, raising `TimeoutError` after `timeout` seconds."""
+
+        future = self.submit(image, frames, time_budget)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            with self._lock:
+                for request_id, pending in self._pending.items():
+                    if pending is future:
+                        del self._pending[request_id]
+                        break
+
+            raise
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        if not self._workers:
+            return
+
+        self._closing.set()
+
+        if self._broken is None:
+            for _ in range(len(self._workers)):
+                self._submission_queue.put(None)
+
+        for proc in self._workers:
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+
+        self._monitor.join()
+        self._receiver.join()
+        self._workers.clear()
+
+@torch.inference_mode()
+def _worker_fn(
+    model: NaFlexVit,
+    submission_queue: SimpleQueue[tuple[int, bytes, int, float | None] | None],
+    completion_queue: SimpleQueue[tuple[int, Tensor | Exception] | None],
+    patch_size: int,
+    max_seqlen: int,
+    n_threads: int,
+) -> None:
+    torch.set_num_threads(n_threads)
+
+    while (task := submission_queue.get()) is not None:
+        request_id, data, n_frames, time_budget = task
+
+        try:
+            if is_video_data(data):
+                processed = process_video(BytesIO(data), patch_size, max_seqlen, frames=n_frames, time_budget=time_budget)
+            else:
+                processed = process_frames(Image.open(BytesIO(data)), patch_size, max_seqlen, frames=n_frames)
+
+            patches, patch_coords, patch_valid = patchify_frames(processed, patch_size, max_seqlen)
+            p_d, pc_d, pv_d = prepare_batch(list(patches), list(patch_coords), list(patch_valid), "cpu")
+
+            probits = reduce_frames(model(p_d, pc_d, pv_d).float().sigmoid_(), [len(processed)])[0]
+            probits.mul_(2.0).sub_(1.0) # scale to -1 to 1
+
+            del processed
+
+            completion_queue.put((request_id, probits))
+        except Exception as ex:
+            completion_queue.put((request_id, ex))
@@ -0,0 +1,151 @@
+"""
+Client for a resident classifier started with `python inference.py --serve`.
+
+Only the standard library is imported, so classifying a file costs starting Python and
+one round trip over the daemon's Unix socket, instead of importing torch and loading the
+model, tag metadata and loader workers every time.
+
+Requests and responses are single lines of JSON. A request is
+`{"paths": [...], "recursive": false, "probabilities": false}`. The daemon answers every
+file in order with `{"path": ..., "tags": {tag: probability}}`, with its thresholds,
+implications and exclusions applied, or `{"path": ..., "error": ...}`, and then
+`{"done": true}`. With `probabilities`, it first sends `{"tags": [...]}`, every model tag
+in order, and every answer also has the `probabilities` of all of them.
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+
+from typing import Any, Iterable, Iterator
+
+# the per-user runtime directory is private, unlike the shared temporary folder
+DEFAULT_SOCKET = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(), "jtp-3.sock")
+
+def caption_tag(tag: str) -> str:
+    """Rewrite a tag for a caption file, like inference.py does when writing them itself."""
+
+    return tag.replace("_", " ").replace("(", r"\(").replace(")", r"\)")
+
+def submit(
+    paths: Iterable[str], *,
+    socket_path: str = DEFAULT_SOCKET,
+    recursive: bool = False,
+    probabilities: bool = False,
+) -> Iterator[dict[str, Any]]:
+    """Send `paths` to the daemon, yielding its answers as they arrive, without the final `{"done": true}`."""
+
+    request = {
+        "paths": [os.path.abspath(path) for path in paths],
+        "recursive": recursive,
+        "probabilities": probabilities,
+    }
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as ex:
+            raise ConnectionError(
+                f"No daemon is listening on {repr(socket_path)}. Start one with 'python inference.py --serve'."
+            ) from ex
+
+        with sock.makefile("rwb") as stream:
+            stream.write(json.dumps(request).encode("utf-8") + b"\n")
+            stream.flush()
+
+            for line in stream:
+                message = json.loads(line)
+                if message.get("done"):
+                    return
+
+                if "error" in message and "path" not in message:
+                    raise RuntimeError(message["error"])
+
+                yield message
+
+    raise RuntimeError("The daemon closed the connection before answering every file.")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Classify images with a JTP-3 daemon started by 'python inference.py --serve'.",
+        allow_abbrev=False,
+    )
+
+    parser.add_argument("-s", "--socket", type=str, default=DEFAULT_SOCKET,
+        metavar="PATH",
+        help=f"Unix socket of the daemon. (Default: {DEFAULT_SOCKET})")
+    parser.add_argument("-r", "--recursive", action="store_true",
+        help="Classify directories recursively. Dotfiles will be ignored.")
+    parser.add_argument("-p", "--prefix", type=str, default="",
+        help="Prefix all .txt caption files with the specified text. If the prefix matches a tag, the tag will not be repeated.")
+    parser.add_argument("-o", "--output", type=str,
+        metavar="PATH",
+        help="Path for CSV output, or '-' for standard output. If not specified, individual .txt caption files are written.")
+    parser.add_argument("paths", nargs="+",
+        help="Path to files and directories to classify.")
+
+    args = parser.parse_args()
+
+    if not hasattr(socket, "AF_UNIX"):
+        parser.error("the daemon requires Unix domain sockets, which are not available on this platform")
+
+    file: Any = None
+    writer: Any = None
+    if args.output == "-":
+        writer = csv.writer(sys.stdout)
+    elif args.output is not None:
+        file = open(args.output, "w", buffering=(1024 * 1024), encoding="utf-8", newline="")
+        writer = csv.writer(file)
+
+    failed = False
+    try:
+        for message in submit(
+            args.paths, socket_path=args.socket,
+            recursive=args.recursive, probabilities=writer is not None,
+        ):
+            if "tags" in message and "path" not in message:
+                if file is not None:
+                    writer.writerow(("filename", *message["tags"]))
+
+                continue
+
+            path = message["path"]
+            if "error" in message:
+                print(f"{repr(path)}: {message['error']}", file=sys.stderr)
+                failed = True
+                continue
+
+            if writer is not None:
+                writer.writerow((path, *(f"{prob:.4f}" for prob in message["probabilities"])))
+                continue
+
+            with open(f"{os.path.splitext(path)[0]}.txt", "w", encoding="utf-8") as caption_file:
+                classes = [caption_tag(tag) for tag in message["tags"]]
+                random.shuffle(classes)
+
+                if args.prefix:
+                    try:
+                        classes.remove(args.prefix)
+                    except ValueError:
+                        pass
+
+                    classes.insert(0, args.prefix)
+
+                caption_file.write(', '.join(classes))
+    except (ConnectionError, RuntimeError) as ex:
+        print(ex, file=sys.stderr)
+        failed = True
+    finally:
+        if file is not None:
+            file.close()
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
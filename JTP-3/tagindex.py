@@ -0,0 +1,80 @@
+from bisect import bisect_left
+from heapq import nsmallest
+from typing import Iterable, NamedTuple
+
+from tagtable import load_tag_table
+
+class TagEntry(NamedTuple):
+    name: str
+    category: int
+    post_count: int | None = None
+
+# matches are ranked by where the query occurs in the tag, then popularity
+_PREFIX = 0
+_WORD = 1
+_SUBSTRING = 2
+
+def normalize_query(query: str) -> str:
+    return query.strip().lower().replace(" ", "_")
+
+class TagIndex:
+    """
+    Prefix and substring lookups over a fixed set of tags.
+
+    Tag names are kept sorted, so the tags starting with a query are one bisected range.
+    Every other suffix of every name is kept in a second sorted array, so the tags
+    containing a query are also one range. Matches at the start of the tag rank first,
+    then matches at the start of a word, then the rest, each by post count when known
+    and then by length.
+    """
+
+    def __init__(self, entries: Iterable[TagEntry]) -> None:
+        self.entries = sorted(entries, key=lambda entry: entry.name)
+        self._names = [entry.name for entry in self.entries]
+
+        suffixes: list[tuple[str, int, int]] = []
+        for idx, name in enumerate(self._names):
+            for start in range(1, len(name)):
+                kind = _WORD if name[start - 1] in "_(" else _SUBSTRING
+                suffixes.append((name[start:], idx, kind))
+
+        suffixes.sort()
+        self._suffixes = [suffix for suffix, _, _ in suffixes]
+        self._suffix_tags = [(idx, kind) for _, idx, kind in suffixes]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def search(self, query: str, limit: int = 10, *, substring: bool = True) -> list[TagEntry]:
+        query = normalize_query(query)
+        if not query or limit < 1:
+            return []
+
+        end = query + "\U0010ffff"
+        matches: dict[int, int] = {}
+
+        for idx in range(bisect_left(self._names, query), bisect_left(self._names, end)):
+            matches[idx] = _PREFIX
+
+        # a single character occurs in most tags, so only its prefix matches are useful
+        if substring and len(query) > 1:
+            for pos in range(bisect_left(self._suffixes, query), bisect_left(self._suffixes, end)):
+                idx, kind = self._suffix_tags[pos]
+                if kind < matches.get(idx, _SUBSTRING + 1):
+                    matches[idx] = kind
+
+        def rank(item: tuple[int, int]) -> tuple[int, int, int, str]:
+            entry = self.entries[item[0]]
+            return (item[1], -(entry.post_count or 0), len(entry.name), entry.name)
+
+        return [self.entries[idx] for idx, _ in nsmallest(limit, matches.items(), key=rank)]
+
+def load_tag_index(path: str) -> TagIndex:
+    """Build an index from a tag metadata CSV, using its `post_count` column for popularity if it has one."""
+
+    table = load_tag_table(path)
+
+    return TagIndex(
+        TagEntry(tag, category, post_count if post_count >= 0 else None)
+        for tag, category, post_count in zip(table.tags, table.categories.tolist(), table.post_counts.tolist())
+    )
@@ -0,0 +1,310 @@
+import csv
+import hashlib
+import json
+import os
+import tempfile
+
+from typing import Any, Callable, Iterator, Mapping
+
+import numpy as np
+
+TAG_TABLE_VERSION = 1
+
+_MAGIC = b"JTPTAGS\0"
+_ALIGN = 64
+
+class TagTable(Mapping[str, tuple[int, list[str]]]):
+    """
+    Tag metadata and calibration as arrays, indexed by position in the metadata CSV.
+
+    `implication_ptr` and `implication_idx` hold the direct implications of every tag in
+    compressed sparse row form: the tags implied by tag `i` are
+    `implication_idx[implication_ptr[i]:implication_ptr[i + 1]]`. `closure_ptr` and
+    `closure_idx` hold their transitive closure in the same form. `thresholds` is NaN for
+    uncalibrated tags, and `post_counts` is -1 where the CSV has none.
+
+    As a mapping, the table behaves like the dict returned by `inference.load_metadata`,
+    so code that looks up single tags can use it unchanged.
+    """
+
+    def __init__(
+        self,
+        tags: list[str],
+        categories: np.ndarray,
+        implication_ptr: np.ndarray,
+        implication_idx: np.ndarray,
+        closure_ptr: np.ndarray,
+        closure_idx: np.ndarray,
+        thresholds: np.ndarray,
+        post_counts: np.ndarray,
+    ) -> None:
+        self.tags = tags
+        self.categories = categories
+        self.implication_ptr = implication_ptr
+        self.implication_idx = implication_idx
+        self.closure_ptr = closure_ptr
+        self.closure_idx = closure_idx
+        self.thresholds = thresholds
+        self.post_counts = post_counts
+
+        self._ids = { tag: idx for idx, tag in enumerate(tags) }
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.tags)
+
+    def __contains__(self, tag: object) -> bool:
+        return tag in self._ids
+
+    def __getitem__(self, tag: str) -> tuple[int, list[str]]:
+        idx = self._ids[tag]
+        return int(self.categories[idx]), [self.tags[j] for j in self.implications(idx).tolist()]
+
+    def index(self, tag: str) -> int:
+        return self._ids[tag]
+
+    def implications(self, idx: int) -> np.ndarray:
+        return self.implication_idx[self.implication_ptr[idx]:self.implication_ptr[idx + 1]]
+
+    def implied(self, idx: int) -> np.ndarray:
+        """Every tag implied by tag `idx`, directly or indirectly."""
+
+        return self.closure_idx[self.closure_ptr[idx]:self.closure_ptr[idx + 1]]
+
+    @property
+    def calibrated(self) -> bool:
+        return bool((~np.isnan(self.thresholds)).any())
+
+    def threshold_dict(self) -> dict[str, float]:
+        """Calibrated thresholds by tag, as from `inference.load_calibration`."""
+
+        valid = np.flatnonzero(~np.isnan(self.thresholds))
+        return dict(zip((self.tags[idx] for idx in valid.tolist()), self.thresholds[valid].tolist()))
+
+    def _arrays(self) -> dict[str, np.ndarray]:
+        return {
+            "names": np.frombuffer("\n".join(self.tags).encode("utf-8"), dtype=np.uint8),
+            "categories": self.categories,
+            "implication_ptr": self.implication_ptr,
+            "implication_idx": self.implication_idx,
+            "closure_ptr": self.closure_ptr,
+            "closure_idx": self.closure_idx,
+            "thresholds": self.thresholds,
+            "post_counts": self.post_counts,
+        }
+
+    def save(self, path: str, key: dict[str, Any]) -> None:
+        """Write the table for `load`, which checks that its `key` is unchanged. Replaces `path` atomically."""
+
+        arrays = self._arrays()
+        layout: dict[str, tuple[int, str, list[int]]] = {}
+        offset = 0
+
+        for name, array in arrays.items():
+            layout[name] = (offset, array.dtype.str, list(array.shape))
+            offset += -(-array.nbytes // _ALIGN) * _ALIGN
+
+        header = json.dumps({ "key": key, "arrays": layout }).encode("utf-8")
+        start = -(-(len(_MAGIC) + 4 + len(header)) // _ALIGN) * _ALIGN
+
+        # a unique name, so processes compiling the same table at once do not write into each other's file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(_MAGIC)
+                file.write(len(header).to_bytes(4, "little"))
+                file.write(header)
+
+                for name, array in arrays.items():
+                    file.seek(start + layout[name][0])
+                    file.write(np.ascontiguousarray(array).tobytes())
+
+                file.truncate(start + offset)
+
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+            raise
+
+    @classmethod
+    def load(cls, path: str, key: dict[str, Any]) -> "TagTable | None":
+        """Memory-map a table written by `save`, or return None if it is missing, damaged or has a different key."""
+
+        try:
+            with open(path, "rb") as file:
+                if file.read(len(_MAGIC)) != _MAGIC:
+                    return None
+
+                header_len = int.from_bytes(file.read(4), "little")
+                header = json.loads(file.read(header_len))
+
+            if header["key"] != key:
+                return None
+
+            start = -(-(len(_MAGIC) + 4 + header_len) // _ALIGN) * _ALIGN
+            data = np.memmap(path, dtype=np.uint8, mode="r")
+
+            arrays: dict[str, np.ndarray] = {}
+            for name, (offset, dtype, shape) in header["arrays"].items():
+                dtype = np.dtype(dtype)
+                count = int(np.prod(shape))
+                arrays[name] = data[start + offset:start + offset + count * dtype.itemsize].view(dtype).reshape(shape)
+        except (OSError, KeyError, ValueError):
+            return None
+
+        names = arrays.pop("names")
+        return cls(bytes(names).decode("utf-8").split("\n") if names.size else [], **arrays)
+
+def _closure(n_tags: int, ptr: np.ndarray, idx: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    implied: list[list[int] | None] = [None] * n_tags
+
+    def visit(tag: int, path: set[int]) -> list[int]:
+        result = implied[tag]
+        if result is None:
+            seen: dict[int, None] = {}
+            for consequent in idx[ptr[tag]:ptr[tag + 1]].tolist():
+                if consequent in path: # cycles in bad metadata imply nothing further
+                    continue
+
+                seen[consequent] = None
+                for transitive in visit(consequent, path | {consequent}):
+                    seen[transitive] = None
+
+            result = implied[tag] = list(seen)
+
+        return result
+
+    lists = [visit(tag, {tag}) for tag in range(n_tags)]
+    closure_ptr = np.zeros(n_tags + 1, dtype=np.int32)
+    np.cumsum([len(tags) for tags in lists], out=closure_ptr[1:])
+
+    return closure_ptr, np.array([tag for tags in lists for tag in tags], dtype=np.int32)
+
+def compile_tag_table(
+    metadata_path: str,
+    calibration_path: str | None = None,
+    rewrite_tag: Callable[[str], str] = lambda tag: tag,
+) -> TagTable:
+    """Parse a tag metadata CSV, and optionally a calibration CSV, into a `TagTable`."""
+
+    raw_tags: list[str] = []
+    categories: list[int] = []
+    implications: list[list[str]] = []
+    post_counts: list[int] = []
+
+    with open(metadata_path, "r", encoding="utf-8", newline="") as metadata_file:
+        reader = csv.DictReader(metadata_file)
+        if (
+            reader.fieldnames is None
+            or "tag" not in reader.fieldnames
+            or "category" not in reader.fieldnames
+            or "implications" not in reader.fieldnames
+        ):
+            raise RuntimeError("CSV must have the columns 'tag', 'category', and 'implications'")
+
+        has_counts = "post_count" in reader.fieldnames
+
+        for row in reader:
+            raw_tags.append(row["tag"])
+            categories.append(int(row["category"]))
+            implications.append(row["implications"].split())
+            post_counts.append(int(row["post_count"]) if has_counts and row["post_count"] else -1)
+
+    raw_ids = { tag: idx for idx, tag in enumerate(raw_tags) }
+    tags = [rewrite_tag(tag) for tag in raw_tags]
+
+    # implications of tags missing from the metadata are dropped
+    resolved = [[raw_ids[tag] for tag in implied if tag in raw_ids] for implied in implications]
+    implication_ptr = np.zeros(len(tags) + 1, dtype=np.int32)
+    np.cumsum([len(implied) for implied in resolved], out=implication_ptr[1:])
+    implication_idx = np.array([idx for implied in resolved for idx in implied], dtype=np.int32)
+
+    closure_ptr, closure_idx = _closure(len(tags), implication_ptr, implication_idx)
+
+    thresholds = np.full(len(tags), np.nan, dtype=np.float32)
+    if calibration_path is not None:
+        ids = { tag: idx for idx, tag in enumerate(tags) }
+
+        with open(calibration_path, "r", encoding="utf-8", newline="") as thresholds_file:
+            reader = csv.DictReader(thresholds_file)
+            if (
+                reader.fieldnames is None
+                or "tag" not in reader.fieldnames
+                or "threshold" not in reader.fieldnames
+            ):
+                raise RuntimeError("CSV must have the columns 'tag' and 'threshold'")
+
+            for row in reader:
+                if not row["threshold"]:
+                    continue
+
+                try:
+                    value = float(row["threshold"])
+                except ValueError as ex:
+                    raise RuntimeError("'threshold' must be between 0.0 and 1.0, or blank") from ex
+
+                if not 0.0 <= value <= 1.0:
+                    raise RuntimeError("'threshold' must be between 0.0 and 1.0, or blank")
+
+                if (idx := ids.get(rewrite_tag(row["tag"]))) is not None:
+                    thresholds[idx] = value
+
+    return TagTable(
+        tags,
+        np.array(categories, dtype=np.int16),
+        implication_ptr, implication_idx,
+        closure_ptr, closure_idx,
+        thresholds,
+        np.array(post_counts, dtype=np.int64),
+    )
+
+def _source(path: str) -> list[Any]:
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+def load_tag_table(
+    metadata_path: str,
+    calibration_path: str | None = None,
+    rewrite_tag: Callable[[str], str] = lambda tag: tag,
+    rewrite_key: str = "",
+) -> TagTable:
+    """
+    Load a `TagTable`, compiling it on first use.
+
+    The compiled table is cached next to the metadata CSV, and reused for as long as the
+    size and modification time of both CSVs and `rewrite_key`, which must describe what
+    `rewrite_tag` does, are unchanged. Each calibration file and rewrite gets its own cache,
+    so tools with different rewrites don't invalidate each other's.
+    """
+
+    key = {
+        "version": TAG_TABLE_VERSION,
+        "metadata": _source(metadata_path),
+        "calibration": _source(calibration_path) if calibration_path is not None else None,
+        "rewrite": rewrite_key,
+    }
+
+    variant = hashlib.blake2b(
+        json.dumps([key["calibration"] and key["calibration"][0], rewrite_key]).encode("utf-8"),
+        digest_size=4,
+    ).hexdigest()
+    cache_path = f"{metadata_path}.{variant}.tags"
+
+    table = TagTable.load(cache_path, key)
+    if table is not None:
+        return table
+
+    table = compile_tag_table(metadata_path, calibration_path, rewrite_tag)
+
+    try:
+        table.save(cache_path, key)
+    except OSError:
+        pass
+
+    return table
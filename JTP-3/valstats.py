@@ -0,0 +1,232 @@
+import argparse
+import csv
+import os
+import sys
+
+from typing import Any, Iterable, Iterator
+
+import numpy as np
+
+csv.field_size_limit(1 << 30)
+
+def _normalize_tag(tag: str) -> str:
+    return tag.strip().replace(" ", "_").replace(r"\(", "(").replace(r"\)", ")")
+
+LABEL_SEPARATORS = ("auto", "comma", "space")
+
+def _split_tags(field: str, separator: str) -> list[str]:
+    tags = field.split("," if separator == "comma" else None)
+    return [tag for tag in map(_normalize_tag, tags) if tag]
+
+def _image_key(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+def load_labels(path: str, separator: str = "auto") -> dict[str, list[str]]:
+    """
+    Load ground truth tags from a CSV file with a filename and a tag list per row.
+
+    Tag lists are separated by commas, as in caption files, or by spaces, as in
+    e621 exports. With `separator` "auto", commas are used if any tag list in the
+    file has one. Images are matched to predictions by their name without
+    directories or extension.
+    """
+
+    if separator not in LABEL_SEPARATORS:
+        raise ValueError(f"Unrecognized label separator: {separator}")
+
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        next(reader, None) # header
+
+        rows = [(row[0], row[1]) for row in reader if len(row) >= 2]
+
+    # chosen once for the whole file, since a single tag like "blue eyes" has no comma to tell
+    if separator == "auto":
+        separator = "comma" if any("," in field for _, field in rows) else "space"
+
+    return { _image_key(filename): _split_tags(field, separator) for filename, field in rows }
+
+def make_thresholds(step: float) -> np.ndarray:
+    n = int(round(1.0 / step))
+    return np.array([float(f"{idx * step:.4f}") for idx in range(n + 1)], dtype=np.float64)
+
+class ConfusionCounts:
+    """
+    Confusion counts of every tag at every threshold, accumulated over chunks of images.
+
+    Each probability is binned by how many thresholds it reaches, so the counts at a
+    threshold are cumulative sums over the bins. Memory use does not depend on the
+    number of images.
+    """
+
+    def __init__(self, n_tags: int, thresholds: np.ndarray) -> None:
+        self.thresholds = thresholds
+        self.images = 0
+
+        self._bins = len(thresholds) + 1
+        self._offsets = np.arange(n_tags, dtype=np.int64) * self._bins
+        self._positive = np.zeros((n_tags, self._bins), dtype=np.int64)
+        self._negative = np.zeros((n_tags, self._bins), dtype=np.int64)
+
+    def update(self, probs: np.ndarray, labels: np.ndarray) -> None:
+        """Add a chunk of (images, tags) probabilities and boolean ground truth."""
+
+        # a prediction is positive at a threshold if prob >= threshold
+        bins = np.searchsorted(self.thresholds, probs, side="right") + self._offsets
+        size = self._positive.size
+
+        self._positive += np.bincount(bins[labels], minlength=size).reshape(self._positive.shape)
+        self._negative += np.bincount(bins[~labels], minlength=size).reshape(self._negative.shape)
+        self.images += probs.shape[0]
+
+    def counts(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Return (tags, thresholds) arrays of tp, fp, tn, fn."""
+
+        n = len(self.thresholds)
+        positives = self._positive.sum(axis=1, keepdims=True)
+        negatives = self._negative.sum(axis=1, keepdims=True)
+
+        tp = positives - np.cumsum(self._positive, axis=1)[:, :n]
+        fp = negatives - np.cumsum(self._negative, axis=1)[:, :n]
+
+        return tp, fp, negatives - fp, positives - tp
+
+def read_predictions(path: str, chunk_size: int) -> Iterator[tuple[list[str], list[str], np.ndarray]]:
+    """Read a CSV written by `inference.py -o` in chunks of (tags, filenames, probabilities)."""
+
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        reader = csv.reader(file)
+        tags = next(reader)[1:]
+
+        filenames: list[str] = []
+        rows: list[list[str]] = []
+
+        for row in reader:
+            filenames.append(row[0])
+            rows.append(row[1:])
+
+            if len(rows) >= chunk_size:
+                yield tags, filenames, np.array(rows, dtype=np.float64)
+                filenames, rows = [], []
+
+        if rows:
+            yield tags, filenames, np.array(rows, dtype=np.float64)
+
+def generate(
+    predictions: Iterable[tuple[list[str], list[str], np.ndarray]],
+    labels: dict[str, list[str]],
+    thresholds: np.ndarray,
+) -> tuple[list[str], ConfusionCounts, int]:
+    """Accumulate confusion counts, returning the tags, counts, and number of unlabeled images."""
+
+    tags: list[str] = []
+    counts: ConfusionCounts | None = None
+    tag_idx: dict[str, int] = {}
+    missing = 0
+
+    for chunk_tags, filenames, probs in predictions:
+        if counts is None:
+            tags = chunk_tags
+            tag_idx = { tag: idx for idx, tag in enumerate(tags) }
+            counts = ConfusionCounts(len(tags), thresholds)
+
+        truth = np.zeros(probs.shape, dtype=np.bool_)
+        keep = np.ones(probs.shape[0], dtype=np.bool_)
+
+        for row, filename in enumerate(filenames):
+            image_tags = labels.get(_image_key(filename))
+            if image_tags is None:
+                keep[row] = False
+                missing += 1
+                continue
+
+            truth[row, [tag_idx[tag] for tag in image_tags if tag in tag_idx]] = True
+
+        if not keep.all():
+            probs, truth = probs[keep], truth[keep]
+
+        counts.update(probs, truth)
+
+    if counts is None:
+        counts = ConfusionCounts(0, thresholds)
+
+    return tags, counts, missing
+
+def write_stats(writer: Any, tags: list[str], counts: ConfusionCounts) -> None:
+    writer.writerow(("tag", "threshold", "tp", "fp", "tn", "fn"))
+
+    thresholds = [f"{threshold:.4f}" for threshold in counts.thresholds]
+    tp, fp, tn, fn = (array.tolist() for array in counts.counts())
+
+    for idx, tag in enumerate(tags):
+        writer.writerows(zip(
+            (tag,) * len(thresholds), thresholds,
+            tp[idx], fp[idx], tn[idx], fn[idx],
+        ))
+
+if __name__ == "__main__":
+    def main() -> None:
+        parser = argparse.ArgumentParser(
+            description="Generate validation data for calibrate.py from model predictions and ground truth tags."
+        )
+        parser.add_argument(
+            "predictions",
+            help="Path to a CSV file of predictions, written by inference.py -o. Use -O to keep the original tag names."
+        )
+        parser.add_argument(
+            "-l", "--labels", required=True,
+            help="Path to a CSV file with a filename and list of ground truth tags per row."
+        )
+        parser.add_argument(
+            "-s", "--separator", choices=LABEL_SEPARATORS, default="auto",
+            help="Separator of the ground truth tags. auto uses commas if any row has one, and spaces otherwise. (Default: auto)"
+        )
+        parser.add_argument(
+            "-o", "--output", default="data/validation.csv",
+            help="Path to output .csv validation data file, or '-' for standard output. (Default: data/validation.csv)"
+        )
+        parser.add_argument(
+            "--step", type=float, default=0.01,
+            help="Spacing of thresholds between 0.0 and 1.0. (Default: 0.01)"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=1024,
+            help="Number of images to read at once. (Default: 1024)"
+        )
+
+        args = parser.parse_args()
+
+        if not 0.0 < args.step <= 0.5:
+            parser.error("--step must be between 0.0 and 0.5")
+        if args.chunk_size < 1:
+            parser.error("--chunk-size must be at least 1")
+
+        print(f"Loading {repr(args.labels)} ...", end="", file=sys.stderr)
+        labels = load_labels(args.labels, args.separator)
+        print(f" {len(labels)} images", file=sys.stderr)
+
+        tags, counts, missing = generate(
+            read_predictions(args.predictions, args.chunk_size),
+            labels, make_thresholds(args.step),
+        )
+
+        if missing:
+            print(f"Skipped {missing} images without ground truth tags.", file=sys.stderr)
+        print(f"Counted {len(tags)} tags over {counts.images} images.", file=sys.stderr)
+
+        out_file: Any = None
+        writer: Any
+
+        if args.output == "-":
+            writer = csv.writer(sys.stdout)
+        else:
+            out_file = open(args.output, "w", encoding="utf-8", newline="")
+            writer = csv.writer(out_file)
+
+        try:
+            write_stats(writer, tags, counts)
+        finally:
+            if out_file is not None:
+                out_file.close()
+
+    main()
@@ -0,0 +1,96 @@
+from time import perf_counter
+from typing import Any, BinaryIO, Callable
+
+from PIL.Image import Image
+
+from metrics import metrics
+
+try:
+    import av
+except ImportError:
+    av = None
+
+VIDEO_SUPPORTED = av is not None
+
+VIDEO_EXTENSIONS = (".webm", ".mp4", ".m4v", ".mkv", ".mov")
+
+# ISO base media brands of still images, which share the ftyp box with MP4
+_IMAGE_BRANDS = (b"avif", b"avis", b"heic", b"heix", b"heim", b"heis", b"mif1", b"msf1")
+
+def is_video_path(path: str) -> bool:
+    return path.lower().endswith(VIDEO_EXTENSIONS)
+
+def is_video_data(data: bytes) -> bool:
+    """Recognize WebM, Matroska, MP4 and QuickTime files by their header."""
+
+    if data[:4] == b"\x1a\x45\xdf\xa3": # EBML, for WebM and Matroska
+        return True
+
+    return data[4:8] == b"ftyp" and data[8:12] not in _IMAGE_BRANDS
+
+def _require_av() -> Any:
+    if av is None:
+        raise RuntimeError("Reading videos requires PyAV. Install it with 'pip install av'.")
+
+    return av
+
+def sample_video(
+    source: str | BinaryIO,
+    count: int,
+    *,
+    resize: Callable[[tuple[int, int]], tuple[int, int]],
+    time_budget: float | None = None,
+) -> list[Image]:
+    """
+    Decode up to `count` keyframes of a video as RGB images, returning them in order.
+
+    The targets are the centers of `count` equal spans of the video, and each is read
+    from the keyframe at or before it, so no other frame is decoded. Frames are scaled
+    to the (width, height) returned by `resize` while converting from the video's pixel
+    format. Keyframes shared by several targets are returned once, so short videos with
+    few keyframes return fewer frames. Once `time_budget` seconds have passed, no more
+    frames are decoded, but the first is always returned.
+    """
+
+    deadline = perf_counter() + time_budget if time_budget is not None else None
+
+    with metrics.stage("decode_video"), _require_av().open(source) as container:
+        if not container.streams.video:
+            raise ValueError("File has no video stream.")
+
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        stream.codec_context.skip_frame = "NONKEY"
+
+        size = resize((stream.codec_context.width, stream.codec_context.height))
+
+        if stream.duration is not None and stream.time_base is not None:
+            duration = float(stream.duration * stream.time_base)
+        elif container.duration is not None:
+            duration = container.duration / 1_000_000 # av.time_base
+        else:
+            duration = 0.0
+
+        targets = [(2 * idx + 1) * duration / (2 * count) for idx in range(count)] if duration > 0 else [0.0]
+
+        frames: list[Image] = []
+        seen: set[int | None] = set()
+
+        for target in targets:
+            if frames and deadline is not None and perf_counter() >= deadline:
+                break
+
+            if target > 0:
+                container.seek(int(target / stream.time_base), stream=stream, backward=True, any_frame=False)
+
+            frame = next(container.decode(stream), None)
+            if frame is None or frame.pts in seen:
+                continue
+
+            seen.add(frame.pts)
+            frames.append(frame.to_image(width=size[0], height=size[1], interpolation="AREA"))
+
+    if not frames:
+        raise ValueError("Video has no decodable frames.")
+
+    return frames
@@ -0,0 +1,237 @@
+import os
+
+from collections import deque
+from threading import Condition, Event, Thread
+from time import monotonic
+from typing import Any, Callable, Iterable, Iterator
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+WATCH_NOTIFY = Observer is not None
+
+# (size, mtime_ns) of a file, or None if it could not be read
+_Signature = tuple[int, int] | None
+
+def _signature(path: str) -> _Signature:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_size, stat.st_mtime_ns
+
+class _Handler(FileSystemEventHandler): # type: ignore[misc, valid-type]
+    def __init__(self, watcher: "FolderWatcher", root: str, recursive: bool) -> None:
+        super().__init__()
+        self.watcher = watcher
+        self.root = root
+        self.recursive = recursive
+
+    def on_any_event(self, event: Any) -> None:
+        if event.event_type in ("deleted", "moved"):
+            self.watcher.forget(os.fsdecode(event.src_path))
+
+        if event.event_type not in ("created", "modified", "moved", "closed"):
+            return
+
+        path = os.fsdecode(event.dest_path if event.event_type == "moved" else event.src_path)
+        if event.is_directory:
+            # files moved in with a directory have no events of their own
+            if self.recursive and event.event_type in ("created", "moved"):
+                self.watcher.rescan(path)
+        else:
+            self.watcher.touch(path, self.root)
+
+class FolderWatcher:
+    """
+    Files in directories, as they are created or modified.
+
+    Changes are found with filesystem notifications from watchdog when it is installed,
+    and otherwise by scanning the directories every `poll_interval` seconds. A changed file
+    is only returned once its size and modification time have not changed for `settle`
+    seconds, so files still being written or copied are not read halfway. Files already
+    in the directories when watching starts are returned first, in the same way. Files
+    are remembered until they are deleted or moved away, so an unchanged file is only
+    returned once.
+
+    `scan` lists the files of a directory to watch, and `accept` decides whether a file
+    reported by a notification, given by its path relative to the watched directory, is
+    one of them.
+    """
+
+    def __init__(
+        self,
+        roots: list[str],
+        *,
+        scan: Callable[[str], Iterable[str]],
+        accept: Callable[[str], bool],
+        recursive: bool = False,
+        settle: float = 1.0,
+        max_delay: float = 0.5,
+        poll_interval: float = 2.0,
+        notify: bool = WATCH_NOTIFY,
+    ) -> None:
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.scan = scan
+        self.accept = accept
+        self.settle = settle
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+
+        self._cond = Condition()
+        self._pending: dict[str, tuple[_Signature, float]] = {}
+        self._ready: deque[str] = deque()
+        self._seen: dict[str, _Signature] = {}
+        self._stop = Event()
+
+        self._observer: Any = None
+        self._poller: Thread | None = None
+
+        if notify:
+            if Observer is None:
+                raise RuntimeError("Filesystem notifications require watchdog. Install it with 'pip install watchdog'.")
+
+            self._observer = Observer()
+            for root in self.roots:
+                self._observer.schedule(_Handler(self, root, recursive), root, recursive=recursive)
+
+            self._observer.start()
+            for root in self.roots:
+                self.rescan(root)
+        else:
+            self._poller = Thread(target=self._poll, name="watch-poll", daemon=True)
+            self._poller.start()
+
+    @property
+    def notify(self) -> bool:
+        return self._observer is not None
+
+    def touch(self, path: str, root: str) -> None:
+        """Check `path`, in the watched directory `root`, for changes."""
+
+        if not self.accept(os.path.relpath(path, root)):
+            return
+
+        now = monotonic()
+        with self._cond:
+            if path not in self._pending:
+                self._pending[path] = (_signature(path), now)
+                self._cond.notify()
+
+    def forget(self, path: str) -> None:
+        """Drop a deleted or moved file, or every file under a deleted or moved directory."""
+
+        prefix = os.path.join(path, "")
+        with self._cond:
+            self._seen.pop(path, None)
+
+            for seen in [seen for seen in self._seen if seen.startswith(prefix)]:
+                del self._seen[seen]
+
+    def rescan(self, root: str) -> None:
+        """Check every file under `root` for changes."""
+
+        try:
+            paths = list(self.scan(root))
+        except OSError:
+            return
+
+        now = monotonic()
+        with self._cond:
+            # files no longer listed were deleted or moved away
+            listed = set(paths)
+            prefix = os.path.join(root, "")
+            for seen in [seen for seen in self._seen if seen.startswith(prefix) and seen not in listed]:
+                del self._seen[seen]
+
+            for path in paths:
+                if path not in self._pending and (signature := _signature(path)) != self._seen.get(path):
+                    self._pending[path] = (signature, now)
+
+            if self._pending:
+                self._cond.notify()
+
+    def _poll(self) -> None:
+        while not self._stop.is_set():
+            for root in self.roots:
+                self.rescan(root)
+
+            self._stop.wait(self.poll_interval)
+
+    def _settle(self, now: float) -> float | None:
+        """Move settled files to the ready queue, returning when the next pending file may settle."""
+
+        checks: list[float] = []
+
+        for path, (signature, since) in list(self._pending.items()):
+            current = _signature(path)
+
+            if current is None: # deleted or renamed
+                del self._pending[path]
+                self._seen.pop(path, None)
+            elif current != signature:
+                self._pending[path] = (current, now)
+                checks.append(now + self.settle)
+            elif now - since >= self.settle:
+                del self._pending[path]
+
+                if self._seen.get(path) != current:
+                    self._seen[path] = current
+                    self._ready.append(path)
+            else:
+                checks.append(since + self.settle)
+
+        return min(checks, default=None)
+
+    def _take(self, count: int, deadline: float | None) -> list[str]:
+        with self._cond:
+            while not self._ready:
+                now = monotonic()
+                next_check = self._settle(now)
+
+                if self._ready:
+                    break
+
+                if deadline is not None and now >= deadline:
+                    return []
+
+                wake = min((t for t in (next_check, deadline) if t is not None), default=None)
+                self._cond.wait(None if wake is None else max(wake - now, 0.0))
+
+            return [self._ready.popleft() for _ in range(min(count, len(self._ready)))]
+
+    def batches(self, batch_size: int) -> Iterator[list[str]]:
+        """
+        Yield settled files in batches of up to `batch_size`, forever.
+
+        Once a file is ready, up to `max_delay` seconds are spent waiting for more to fill
+        its batch. While nothing changes, this waits without polling, unless notifications
+        are unavailable.
+        """
+
+        while True:
+            batch = self._take(batch_size, None)
+            deadline = monotonic() + self.max_delay
+
+            while len(batch) < batch_size and monotonic() < deadline:
+                if not (more := self._take(batch_size - len(batch), deadline)):
+                    break
+
+                batch.extend(more)
+
+            yield batch
+
+    def close(self) -> None:
+        self._stop.set()
+
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+
+        if self._poller is not None:
+            self._poller.join()